@@ -0,0 +1,321 @@
+# encoding: utf-8
+"""
+Benchmarks of the operations of the functions.py module on synthetic folders.
+
+A tree of N files spread over all the 'EXTENSIONS' categories of data.yaml
+is generated, with tiny but valid videos (MP4, AVI, ASF and FLV headers) of
+chosen durations, then each operation is run on a fresh copy of it. For each
+operation, the time, the throughput in files/s, the number of files opened
+and the number of file system calls are measured: those reported by the audit
+hooks of Python, and the calls to os.stat and os.lstat (os.path.isfile,
+os.path.exists...), which raise no audit event.
+
+Usage:
+    python benchmarks/bench.py --files 10000 --depth 2 --output results.json
+    python benchmarks/bench.py --files 10000 --compare results.json
+
+Use '--dir /dev/shm' to measure the code rather than the disk.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+import yaml
+import videologging.functions as fun
+from videologging.catalog import catalog
+from videologging.extensions import ExtensionIndex
+from videologging.probe import ASF_FILE_PROPERTIES_GUID, ASF_HEADER_GUID
+
+
+# audit events counted as file system calls
+FILE_SYSTEM_EVENTS = {
+    "open", "os.scandir", "os.listdir", "os.rename", "os.mkdir", "os.rmdir", "os.remove", "os.chdir",
+    "os.utime", "os.chmod", "os.link", "os.symlink", "os.truncate", "os.posix_spawn", "subprocess.Popen",
+    "shutil.copyfile", "shutil.copystat", "shutil.move", "shutil.rmtree",
+}
+
+
+# functions of the os module counted as file system calls, as they raise no audit event
+COUNTED_FUNCTIONS = ["stat", "lstat"]
+
+
+class AuditCounter(object):
+    """Counter of the file system calls made while it is enabled.
+
+    Audit hooks cannot be removed, so a single hook is added and switched on
+    and off. The functions of COUNTED_FUNCTIONS are wrapped while the counter
+    is enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = Counter()
+        self.originals = {name: getattr(os, name) for name in COUNTED_FUNCTIONS}
+        sys.addaudithook(self.hook)
+
+    def hook(self, event, args):
+        if self.enabled and event in FILE_SYSTEM_EVENTS:
+            self.events[event] += 1
+
+    def wrap(self, name):
+        original = self.originals[name]
+        event = "os." + name
+
+        def counted(*args, **kwargs):
+            self.events[event] += 1
+            return original(*args, **kwargs)
+        return counted
+
+    def start(self):
+        self.events = Counter()
+        self.enabled = True
+        for name in COUNTED_FUNCTIONS:
+            setattr(os, name, self.wrap(name))
+
+    def stop(self):
+        self.enabled = False
+        for name, original in self.originals.items():
+            setattr(os, name, original)
+        return dict(self.events)
+
+
+# Synthetic files ===============================================================
+
+def atom(kind, data):
+    """Return a MP4 atom."""
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+
+def make_mp4(duration, width=1920, height=1080, timescale=1000):
+    """Return the bytes of a MP4 file with a video track and no sample."""
+    mvhd = atom(b'mvhd', struct.pack('>4xIIII', 0, 0, timescale, int(duration * timescale)) + bytes(80))
+    tkhd = atom(b'tkhd', bytes(76) + struct.pack('>II', width << 16, height << 16))
+    hdlr = atom(b'hdlr', bytes(8) + b'vide' + bytes(13))
+    stsd = atom(b'stsd', struct.pack('>4xI', 1) + atom(b'avc1', bytes(78)))
+    minf = atom(b'minf', atom(b'stbl', stsd))
+    trak = atom(b'trak', tkhd + atom(b'mdia', hdlr + minf))
+    return atom(b'ftyp', b'isom' + bytes(4) + b'isomavc1') + atom(b'moov', mvhd + trak) + atom(b'mdat', b'')
+
+
+def make_avi(duration, width=1920, height=1080, fps=25):
+    """Return the bytes of an AVI file with a video stream and no frame."""
+    avih = b'avih' + struct.pack('<I', 56) + struct.pack('<14I', 1000000 // fps, 0, 0, 0, int(duration * fps),
+                                                         0, 1, 0, width, height, 0, 0, 0, 0)
+    strh = b'strh' + struct.pack('<I', 56) + b'vidsH264' + bytes(48)
+    strl = b'LIST' + struct.pack('<I', 4 + len(strh)) + b'strl' + strh
+    hdrl = b'LIST' + struct.pack('<I', 4 + len(avih) + len(strl)) + b'hdrl' + avih + strl
+    movi = b'LIST' + struct.pack('<I', 4) + b'movi'
+    return b'RIFF' + struct.pack('<I', 4 + len(hdrl) + len(movi)) + b'AVI ' + hdrl + movi
+
+
+def make_asf(duration):
+    """Return the bytes of an ASF (WMV) file with a File Properties object and
+    no data."""
+    # file id, file size, creation date, data packets count, play duration, send duration, preroll,
+    # flags, minimum and maximum packet sizes, maximum bitrate
+    properties = bytes(16) + struct.pack('<QQQQQQIIII', 0, 0, 0, int(duration * 1e7), int(duration * 1e7), 0,
+                                         2, 0, 0, 0)
+    file_properties = ASF_FILE_PROPERTIES_GUID + struct.pack('<Q', 24 + len(properties)) + properties
+    return ASF_HEADER_GUID + struct.pack('<QIBB', 30 + len(file_properties), 1, 1, 2) + file_properties
+
+
+def amf_string(text):
+    """Return an AMF0 string, without its type marker."""
+    return struct.pack('>H', len(text)) + text.encode()
+
+
+def make_flv(duration, width=1920, height=1080):
+    """Return the bytes of a FLV file with an 'onMetaData' script tag and no
+    frame."""
+    metadata = b''.join(amf_string(key) + b'\x00' + struct.pack('>d', value)
+                        for key, value in [("duration", duration), ("width", width), ("height", height)])
+    data = b'\x02' + amf_string("onMetaData") + b'\x08' + struct.pack('>I', 3) + metadata + amf_string("") + b'\x09'
+    tag = struct.pack('>B', 18) + struct.pack('>I', len(data))[1:] + bytes(7) + data
+    return b'FLV' + struct.pack('>BBI', 1, 5, 9) + bytes(4) + tag + struct.pack('>I', len(tag))
+
+
+# generator of each video extension
+VIDEO_GENERATORS = {
+    ".mp4": make_mp4, ".mov": make_mp4, ".m4v": make_mp4, ".m4a": make_mp4, ".m4b": make_mp4, ".m4r": make_mp4,
+    ".f4v": make_mp4, ".f4a": make_mp4, ".f4b": make_mp4, ".3gp": make_mp4,
+    ".avi": make_avi, ".wmv": make_asf, ".asf": make_asf, ".flv": make_flv,
+}
+
+
+def generate_tree(root, extensions, files, depth=0, durations=(1, 2, 5, 30)):
+    """Generate a synthetic folder.
+
+    Parameters
+    ----------
+    root : string
+        Folder to fill, created if needed.
+    extensions : dict
+        'EXTENSIONS' of data.yaml.
+    files : int
+        Number of files.
+    depth : int
+        Number of nested subfolders. The files are spread over the folder and
+        its subfolders.
+    durations : tuple
+        Durations of the videos, in seconds, used in turn.
+
+    Returns
+    -------
+    int
+        Number of files of the top folder.
+    """
+    # the videos that cannot be synthesized would not be probed by their header
+    all_extensions = [extension for category in extensions for extension in extensions[category]
+                      if extension and (category != 'Videos' or extension.lower() in VIDEO_GENERATORS)]
+    folders = [os.path.join(root, *[f"level{i}" for i in range(1, level + 1)]) for level in range(depth + 1)]
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    videos = VIDEO_GENERATORS
+    mtime = time.time()
+    for i in range(files):
+        extension = all_extensions[i % len(all_extensions)]
+        path = os.path.join(folders[i % len(folders)], f"file{i:07d}{extension}")
+        with open(path, 'wb') as f:
+            if extension.lower() in videos:
+                f.write(videos[extension.lower()](durations[(i // len(all_extensions)) % len(durations)]))
+        # spread the files over a few days for 'date'
+        day = mtime - 86400 * (i % 7)
+        os.utime(path, (day, day))
+    return len(range(0, files, len(folders)))
+
+
+# Benchmarks ====================================================================
+
+def operations(index, trash_folder_name):
+    """Return the benchmarked operations, as (name, function of the root,
+    whether it modifies the tree)."""
+    return [
+        ("get_number_files", lambda root: fun.get_number_files(index, entries=catalog(root, index)), False),
+        ("folder_sort", lambda root: fun.folder_sort(index, False, root=root), True),
+        ("sort_by_date", lambda root: fun.sort_by_date(index, False, use_cache=False, root=root), True),
+        ("trash_videos (no cache)", lambda root: fun.trash_videos(3, index, trash_folder_name, False,
+                                                                  use_cache=False, root=root), True),
+        ("trash_videos (warm cache)", lambda root: fun.trash_videos(3, index, trash_folder_name, False,
+                                                                    use_cache=True, root=root), True),
+        ("tree_sort folder", lambda root: fun.tree_sort("folder", index, False, trash_folder_name,
+                                                        use_cache=False, root=root), True),
+    ]
+
+
+def run_benchmarks(arguments, data):
+    """Run the benchmarks and return the results as a dict."""
+    index = ExtensionIndex(data["EXTENSIONS"], data["PARAMETERS"]["case_sensitive_extensions"])
+    trash_folder_name = data["PARAMETERS"]["trash_folder_name"]
+    fun.show_progress = False
+    counter = AuditCounter()
+    parent = tempfile.mkdtemp(prefix="videolog-bench-", dir=arguments.dir)
+    template = os.path.join(parent, "template")
+    top_files = generate_tree(template, data["EXTENSIONS"], arguments.files, arguments.depth)
+    results = []
+    try:
+        for name, function, modifies in operations(index, trash_folder_name):
+            if arguments.only and not any(word in name for word in arguments.only):
+                continue
+            # the tree operations see all the files, the others only the top folder
+            files = arguments.files if name.startswith("tree") else top_files
+            runs, events = [], dict()
+            for _ in range(arguments.repeat):
+                root = os.path.join(parent, "run") if modifies else template
+                if modifies:
+                    shutil.copytree(template, root)
+                if name.endswith("(warm cache)"):
+                    # probe all the videos without trashing any
+                    fun.trash_videos(0, index, trash_folder_name, False, use_cache=True, root=root)
+                fun.safety_check.invalidate()
+                counter.start()
+                start = time.perf_counter()
+                try:
+                    function(root)
+                except fun.EmptyFolder:
+                    pass
+                runs.append(time.perf_counter() - start)
+                events = counter.stop()
+                if modifies:
+                    shutil.rmtree(root)
+            seconds = statistics.median(runs)
+            results.append({
+                "operation": name,
+                "files": files,
+                "seconds": round(seconds, 6),
+                "runs": [round(run, 6) for run in runs],
+                "files_per_second": round(files / seconds, 1) if seconds > 0 else None,
+                "opens": events.get("open", 0),
+                "file_system_calls": sum(events.values()),
+                "events": events,
+            })
+            print(f"{name:<28}{seconds * 1000:>10.1f} ms{results[-1]['files_per_second'] or 0:>14.0f} files/s"
+                  f"{results[-1]['opens']:>10} opens{results[-1]['file_system_calls']:>10} calls")
+    finally:
+        shutil.rmtree(parent)
+    return {
+        "version": git_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": arguments.files,
+        "depth": arguments.depth,
+        "dir": arguments.dir or tempfile.gettempdir(),
+        "repeat": arguments.repeat,
+        "results": results,
+    }
+
+
+def compare(results, reference):
+    """Print the speedup of each operation relatively to older results."""
+    old = {result["operation"]: result for result in reference["results"]}
+    print(f"\nCompared to {reference.get('version')}:")
+    for result in results["results"]:
+        if result["operation"] in old and result["seconds"] > 0:
+            ratio = old[result["operation"]]["seconds"] / result["seconds"]
+            print(f"{result['operation']:<28}{ratio:>8.2f}x {'faster' if ratio >= 1 else 'slower'}")
+
+
+def git_version():
+    """Return the commit of the working tree, or None."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the operations of video-logging on synthetic folders.")
+    parser.add_argument("--files", type=int, default=10000, help="number of files generated")
+    parser.add_argument("--depth", type=int, default=0, help="number of nested subfolders")
+    parser.add_argument("--dir", default=None, help="where to generate the folders, e.g. /dev/shm")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each operation")
+    parser.add_argument("--only", nargs="*", help="run only the operations whose name contains these words")
+    parser.add_argument("--output", help="JSON file where to save the results")
+    parser.add_argument("--compare", help="JSON file of older results to compare with")
+    return parser.parse_args()
+
+
+def main():
+    arguments = parse_arguments()
+    with open(os.path.join(os.path.dirname(fun.__file__), "data.yaml"), 'r') as f:
+        data = yaml.load(f, Loader=yaml.FullLoader)
+    results = run_benchmarks(arguments, data)
+    if arguments.output:
+        with open(arguments.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if arguments.compare:
+        with open(arguments.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,18 @@
 CLI for videologging.
 """
 
+import argparse
+import copy
+import json
 import os
+import pickle
 import sys
-import yaml
+import time
 import videologging.functions as fun
+import videologging.fanout as fanout
+import videologging.jobs as jobs
+from videologging.extensions import ExtensionIndex
+from videologging.jobs import JobCancelled, JobManager, checkpoint, current_job
 
 
 class CLI(object):
@@ -17,6 +25,8 @@ class CLI(object):
         # data files
         self.PARAMETERS = data["PARAMETERS"]
         self.EXTENSIONS = data["EXTENSIONS"]
+        # lookup index of the extensions, compiled once and cached with the data
+        self.extension_index = data["EXTENSION_INDEX"]
         self.HELP = data["HELP"]
         self.WARNINGS = data["WARNINGS"]
         self.HEADER = data["HEADER"]
@@ -26,13 +36,26 @@ class CLI(object):
         self.trash_list = ["trash", "t", "short"]
         self.date_list = ["date", "d", "when"]
         self.rename_list = ["rename", "r", "name"]
+        self.bulk_list = ["bulk", "b"]
         self.help_list = ["help", "h", "?", "what", "how"]
         self.sudo_list = ["sudo"]
+        self.cache_list = ["cache"]
+        self.undo_list = ["undo", "u"]
+        self.resume_list = ["resume"]
+        self.dedupe_list = ["dedupe", "duplicates", "dup"]
+        self.each_list = ["each", "all"]
+        self.watch_list = ["watch", "w"]
+        self.pipeline_list = ["pipeline", "p"]
+        self.jobs_list = ["jobs"]
+        self.wait_list = ["wait"]
+        self.cancel_list = ["cancel", "kill"]
+        self.stats_list = ["stats", "profile"]
+        self.du_list = ["du", "footprint"]
         self.exit_list = ["exit", "e", "leave", "l", "quit", "q"]
         # Using a dictionary that translates an accepted user input into its internal representation.
         # Several keywords can have the same internal representation (if they trigger the same command).
         self.preprocess = dict()
-        for instruction in ["cd", "folder", "trash", "date", "rename", "help", "sudo", "exit"]:
+        for instruction in ["cd", "folder", "trash", "date", "rename", "bulk", "help", "sudo", "cache", "undo", "resume", "dedupe", "each", "watch", "pipeline", "jobs", "wait", "cancel", "stats", "du", "exit"]:
             instruction_list = getattr(self, instruction + "_list")
             self.preprocess.update({keyword: instruction for keyword in instruction_list})
 
@@ -43,8 +66,54 @@ class CLI(object):
         self.trash_folder_name = self.PARAMETERS["trash_folder_name"]
         # open while renaming
         self.open_while_renaming = self.PARAMETERS["open_while_renaming"]
+        # number of workers used to probe videos
+        self.max_workers = self.PARAMETERS["max_workers"]
+        # number of processes used to run a command in many folders
+        self.fanout_workers = self.PARAMETERS["fanout_workers"]
+        # metadata cache
+        self.use_cache = self.PARAMETERS["metadata_cache"]
+        self.cache_size = self.PARAMETERS["cache_max_entries"]
+        # dating files by their capture time
+        self.capture_dates = self.PARAMETERS["capture_dates"]
         # sudo mode
         self.sudo = self.PARAMETERS["default_sudo"]
+        # depth of the search for the '.videolog' marker
+        fun.safety_check.depth = self.PARAMETERS["safety_check_depth"]
+        # moves across file systems
+        fun.transfer_settings.workers = self.PARAMETERS["transfer_workers"]
+        fun.transfer_settings.verify = self.PARAMETERS["verify_transfers"]
+        # preview of the files while renaming them
+        fun.preview_settings.player = self.PARAMETERS["player"]
+        fun.preview_settings.prefetch = self.PARAMETERS["prefetch_files"]
+        fun.preview_settings.proxies = self.PARAMETERS["rename_proxies"]
+        fun.preview_settings.proxy_height = self.PARAMETERS["proxy_height"]
+        fun.preview_settings.proxy_workers = self.PARAMETERS["proxy_workers"]
+        # detection of failed takes
+        fun.detection_settings.frames = self.PARAMETERS["sampled_frames"]
+        fun.detection_settings.black_level = self.PARAMETERS["black_level"]
+        fun.detection_settings.uniform_level = self.PARAMETERS["uniform_level"]
+        fun.detection_settings.similarity = self.PARAMETERS["similarity_level"]
+        # watch mode
+        self.watch_time_limit = self.PARAMETERS["watch_time_limit"]
+        self.watch_by_date = self.PARAMETERS["watch_by_date"]
+        fun.watch_settings.settle = self.PARAMETERS["watch_settle_seconds"]
+        fun.watch_settings.batch_size = self.PARAMETERS["watch_batch_size"]
+        fun.watch_settings.batch_delay = self.PARAMETERS["watch_batch_delay"]
+        fun.watch_settings.queue_size = self.PARAMETERS["watch_queue_size"]
+        fun.watch_settings.poll_interval = self.PARAMETERS["watch_poll_interval"]
+        # stages run by 'pipeline' without argument
+        self.pipeline_stages = self.PARAMETERS["pipeline_stages"]
+        # timing of the phases of the commands
+        fun.recorder.enabled = self.PARAMETERS["instrumentation"]
+        # number of seconds spent listing the tree and probing videos by 'du --approx'
+        self.du_time_budget = self.PARAMETERS["du_time_budget"]
+        # batch mode: messages are recorded instead of being printed
+        self.batch = False
+        # background jobs: the long commands run in a thread, in the background if they end with '&'
+        self.job_manager = JobManager()
+        self.job_instructions = ["folder", "trash", "date", "bulk", "dedupe", "each", "watch", "pipeline", "du", "undo", "resume"]
+        self.messages = []
+        self.counts = dict()
 
     def read_command(self, command):
         """
@@ -70,19 +139,152 @@ class CLI(object):
             elif internal_instruction == "exit":
                 self.exit()
 
+            elif internal_instruction == "stats":
+                # not recorded, so that it shows the previous command
+                self.process_stats(split_command, cursor)
+
+            elif internal_instruction in self.job_instructions + ["rename"] and self.job_manager.running(self.folder):
+                # two commands moving the same files at the same time would conflict
+                job = self.job_manager.running(self.folder)[0]
+                self.report(f"Job [{job.number}] ('{job.command}') is still running in this folder. Wait for it with 'wait {job.number}' or cancel it with 'cancel {job.number}'.", "error")
+
+            elif internal_instruction in self.job_instructions and not self.batch and current_job() is None:
+                # a command ending with '&' runs in the background
+                background = command.rstrip().endswith("&")
+                self.start_job(command.rstrip().rstrip("&").strip(), background)
+
             else:
                 # for instance:
                 # self.process_folder(split_command, cursor)
                 process_instruction = getattr(self, "process_" + internal_instruction)
-                process_instruction(split_command, cursor)
+                fun.recorder.start(command.strip())
+                try:
+                    process_instruction(split_command, cursor)
+                finally:
+                    fun.recorder.finish()
+
+        else:
+            self.report(f"The input command {command} could not be parsed, because the tool did not understand the term '{instruction}'. If you wish to you can use :\n'>> help'\nThat instruction will bring a list of the available instruction and their use cases.", "error")
+
+    def execute(self, command):
+        """
+        Run a command, displaying the errors it raises.
+        """
+        try:
+            self.read_command(command)
+        except fun.EmptyFolder as e:
+            self.report(str(e), "info")
+        except fun.TemplateError as e:
+            self.report(str(e), "error")
+        except fun.BadFolderName as e:
+            if not self.batch:
+                print()  # to avoid ugly output
+            self.report(str(e), "error")
+        except fun.SudoException as e:
+            # in batch mode, this is an error as the command did nothing
+            self.report(self.WARNINGS["sudo-exception"], "error" if self.batch else "warning")
+        except JobCancelled as e:
+            self.report(f"{e} {self.WARNINGS['cancelled']}", "warning")
+        except OSError as e:
+            self.report(str(e), "error")
 
+    def start_job(self, command, background=False):
+        """
+        Run a command in a job, and wait for it unless it runs in the background.
+        The job works on a copy of the CLI, so that it keeps its folder and sudo mode.
+        """
+        worker = copy.copy(self)
+        job = self.job_manager.start(command, self.folder, lambda: worker.execute(command), background)
+        if background:
+            self.report(f"[{job.number}] '{command}' started in the background. Use 'jobs' to follow it.", "info")
         else:
-            print(err(f"The input command {command} could not be parsed, because the tool did not understand the term '{instruction}'. If you wish to you can use :\n'>> help'\nThat instruction will bring a list of the available instruction and their use cases."))
+            self.wait_for_job(job, cancel=True)
+            if not job.background and job.error is not None:
+                self.report(job.error, "error")
+
+    def wait_for_job(self, job, cancel=False):
+        """
+        Wait for a job. On Ctrl-C, cancel it if `cancel` is True, else stop waiting.
+        """
+        try:
+            job.wait()
+        except KeyboardInterrupt:
+            if not cancel:
+                print()
+                return
+            print("\nCancelling... (Ctrl-C again to leave it running in the background)")
+            job.cancel()
+            try:
+                job.wait()
+            except KeyboardInterrupt:
+                job.background = True
+                self.report(f"[{job.number}] '{job.command}' left running in the background.", "info")
+
+    def run_batch(self, commands):
+        """
+        Run commands without interaction, and yield a JSON-serializable result for each one.
+        """
+        self.batch = True
+        for command in commands:
+            split_command = command.split()
+            if len(split_command) == 0 or split_command[0].startswith("#"):
+                # empty line or comment
+                continue
+            if self.preprocess.get(split_command[0].lower()) == "exit":
+                break
+            self.messages = []
+            self.counts = dict()
+            start = time.perf_counter()
+            self.execute(command)
+            errors = [message["text"] for message in self.messages if message["kind"] == "error"]
+            yield {
+                "command": command.strip(),
+                "folder": self.folder,
+                "ok": len(errors) == 0,
+                "seconds": round(time.perf_counter() - start, 6),
+                "counts": self.counts,
+                "messages": self.messages,
+                "errors": errors,
+            }
+
+    def report(self, text, kind="text"):
+        """
+        Display a message, or record it in batch mode.
+        kind is one of 'text', 'info', 'warning' and 'error'.
+        """
+        job = current_job()
+        if job is not None:
+            # the messages of a background job are displayed when it is over
+            job.messages.append((kind, str(text)))
+            if job.background:
+                return
+        if self.batch:
+            self.messages.append({"kind": kind, "text": str(text)})
+            self.counts.update(getattr(text, "counts", dict()))
+        else:
+            print(STYLES[kind](text))
+
+    def report_jobs(self):
+        """
+        Display the end of the background jobs that are over.
+        """
+        for job in self.job_manager.unreported():
+            print(job.describe())
+            for kind, text in job.messages:
+                print(STYLES[kind](text))
 
     def exit(self):
         """
         Used to leave the tool.
         """
+        running = self.job_manager.running()
+        if running:
+            # the journals of the cancelled commands are left consistent
+            print(f"Cancelling {len(running)} running job{'s' if len(running) >= 2 else ''}...")
+            for job in running:
+                job.cancel()
+            for job in running:
+                job.wait()
         print("Leaving the tool...\n")
         sys.exit(0)
 
@@ -92,7 +294,7 @@ class CLI(object):
         """
         if len(split_command) == cursor:
             # i.e. we have no more arguments available
-            print(warning(self.WARNINGS["syntax-dir"]))
+            self.report(self.WARNINGS["syntax-dir"], "warning")
         else:
             # we cannot use split_command here because it does not take spaces into account
             # remove command word
@@ -102,17 +304,25 @@ class CLI(object):
 
             cursor += 1
             try:
-                os.chdir(directory)
+                # relative to the folder of the tool, not to the cwd of the process
+                os.chdir(os.path.join(self.folder, os.path.expanduser(directory)))
                 self.folder = os.getcwd()
+                fun.safety_check.invalidate()
                 # display(self)
             except FileNotFoundError as e:
-                print(err(f"Cannot find the '{directory}' directory."))
+                self.report(f"Cannot find the '{directory}' directory.", "error")
 
     def process_folder(self, split_command, cursor):
         """
         When the 'folder' command is read.
         """
-        print(info(fun.folder_sort(self.EXTENSIONS, self.sudo)))
+        arguments, recursive, flatten = self.parse_tree_flags(split_command[cursor:])
+        if arguments:
+            self.report(f"Could not parse '{arguments[0]}'. The syntax is '>> folder [-r|--flatten]'.", "error")
+        elif recursive:
+            self.report(fun.tree_sort("folder", self.extension_index, self.sudo, self.trash_folder_name, flatten=flatten, root=self.folder), "info")
+        else:
+            self.report(fun.folder_sort(self.extension_index, self.sudo, root=self.folder), "info")
 
     def process_trash(self, split_command, cursor):
         """
@@ -120,68 +330,374 @@ class CLI(object):
         """
         if len(split_command) == cursor:
             # i.e. we have no more arguments available
-            print(warning(self.WARNINGS["syntax-time"]))
+            self.report(self.WARNINGS["syntax-time"], "warning")
         else:
             time_limit = split_command[cursor]
             cursor += 1
+            if time_limit.lower() == "errors":
+                trash_similar = len(split_command) > cursor and split_command[cursor].lower() == "similar"
+                self.report(fun.trash_shooting_errors(self.extension_index, self.trash_folder_name, self.sudo, self.max_workers, self.use_cache, self.cache_size, trash_similar, root=self.folder), "info")
+                return
             try:
                 int_time_limit = int(time_limit)
                 if int_time_limit <= 0:
-                    print(err(f"Negative (zero included) values are not valid. Please input a positive integer."))
+                    self.report(f"Negative (zero included) values are not valid. Please input a positive integer.", "error")
                 else:
-                    print(info(fun.trash_videos(int_time_limit, self.EXTENSIONS, self.trash_folder_name, self.sudo)))
+                    self.report(fun.trash_videos(int_time_limit, self.extension_index, self.trash_folder_name, self.sudo, self.max_workers, self.use_cache, self.cache_size, root=self.folder), "info")
             except ValueError as e:
-                print(err(f"Could not parse '{time_limit}' as a positive int. Please input a positive integer."))
+                self.report(f"Could not parse '{time_limit}' as a positive int. Please input a positive integer.", "error")
 
     def process_date(self, split_command, cursor):
         """
         When the 'date' command is read.
         """
-        if len(split_command) == cursor:
-            # i.e. we have no more arguments available
-            print(info(fun.sort_by_date(self.EXTENSIONS, self.sudo)))
+        arguments, recursive, flatten = self.parse_tree_flags(split_command[cursor:])
+        directory = arguments[0] if arguments else None
+        if len(arguments) > 1:
+            self.report(f"Could not parse '{arguments[1]}'. The syntax is '>> date [$directory] [-r|--flatten]'.", "error")
+        elif directory is not None and directory not in self.EXTENSIONS:
+            self.report(f"{directory} is not a valid directory. Please input a valid directory.", "error")
+        elif recursive:
+            self.report(fun.tree_sort("date", self.extension_index, self.sudo, self.trash_folder_name, directory, flatten, self.capture_dates, self.use_cache, self.cache_size, root=self.folder), "info")
         else:
-            directory = split_command[cursor]
-            cursor += 1
-            if directory not in self.EXTENSIONS:
-                print(err(f"{directory} is not a valid directory. Please input a valid directory."))
-            else:
-                print(info(fun.sort_by_date(self.EXTENSIONS, self.sudo, directory)))
+            self.report(fun.sort_by_date(self.extension_index, self.sudo, directory, self.capture_dates, self.use_cache, self.cache_size, root=self.folder), "info")
+
+    @staticmethod
+    def parse_tree_flags(arguments):
+        """Split the '-r'/'--recursive' and '--flatten' flags from the other
+        arguments of a command. '--flatten' implies '--recursive'.
+
+        Returns
+        -------
+        (list, bool, bool)
+            Other arguments, whether the command is recursive, and whether it
+            flattens the tree.
+        """
+        others = [argument for argument in arguments if argument not in ["-r", "--recursive", "--flatten"]]
+        flatten = "--flatten" in arguments
+        recursive = flatten or "-r" in arguments or "--recursive" in arguments
+        return others, recursive, flatten
 
     def process_rename(self, split_command, cursor):
         """
         When the 'rename' command is read.
         """
-        if len(split_command) == cursor:
+        if self.batch:
+            self.report("The 'rename' command is interactive, it cannot be used in batch mode.", "error")
+        elif len(split_command) == cursor:
             # i.e. we have no more arguments available
-            print(info(fun.rename_files(self.EXTENSIONS, self.open_while_renaming, self.trash_folder_name)))
+            self.report(fun.rename_files(self.extension_index, self.open_while_renaming, self.trash_folder_name, root=self.folder), "info")
         else:
             directory = split_command[cursor]
             cursor += 1
             if directory not in self.EXTENSIONS:
-                print(err(f"{directory} is not a valid directory. Please input a valid directory."))
+                self.report(f"{directory} is not a valid directory. Please input a valid directory.", "error")
             else:
-                print(info(fun.rename_files(self.EXTENSIONS, self.open_while_renaming, self.trash_folder_name, directory)))
+                self.report(fun.rename_files(self.extension_index, self.open_while_renaming, self.trash_folder_name, directory, root=self.folder), "info")
 
 
+    def process_bulk(self, split_command, cursor):
+        """
+        When the 'bulk' command is read.
+        """
+        if len(split_command) == cursor:
+            # i.e. we have no more arguments available
+            self.report(self.WARNINGS["syntax-bulk"], "warning")
+            return
+        template = split_command[cursor]
+        arguments = split_command[cursor + 1:]
+        apply = len(arguments) > 0 and arguments[-1].lower() == "apply"
+        if apply:
+            arguments = arguments[:-1]
+        directory = arguments[0] if arguments else None
+        if len(arguments) > 1:
+            self.report(self.WARNINGS["syntax-bulk"], "warning")
+        elif directory is not None and directory not in self.EXTENSIONS:
+            self.report(f"{directory} is not a valid directory. Please input a valid directory.", "error")
+        else:
+            self.report(fun.bulk_rename(self.extension_index, template, directory, apply, self.capture_dates, self.use_cache, self.cache_size, root=self.folder), "info")
+
     def process_sudo(self, split_command, cursor):
         """
         When the 'sudo' command is read.
         """
         if len(split_command) == cursor:
             # i.e. we have no more arguments available
-            print(warning(self.WARNINGS["syntax-sudo"]))
+            self.report(self.WARNINGS["syntax-sudo"], "warning")
         else:
             mode = split_command[cursor].lower()
             cursor += 1
             if mode == "on":
                 self.sudo = True
-                print(warning(self.WARNINGS["sudo-on"]))
+                self.report(self.WARNINGS["sudo-on"], "warning")
             elif mode == "off":
                 self.sudo = False
-                print(warning(self.WARNINGS["sudo-off"]))
+                self.report(self.WARNINGS["sudo-off"], "warning")
+            else:
+                self.report("The possible values for sudo mode are 'on' and 'off'.", "error")
+
+    def process_cache(self, split_command, cursor):
+        """
+        When the 'cache' command is read.
+        """
+        if len(split_command) == cursor:
+            # i.e. we have no more arguments available
+            self.report(self.WARNINGS["syntax-cache"], "warning")
+        else:
+            action = split_command[cursor].lower()
+            cursor += 1
+            if action == "clear":
+                self.report(fun.clear_cache(self.folder), "info")
             else:
-                print(err("The possible values for sudo mode are 'on' and 'off'."))
+                self.report("The only possible action on the cache is 'clear'.", "error")
+
+    def process_dedupe(self, split_command, cursor):
+        """
+        When the 'dedupe' command is read.
+        """
+        if len(split_command) == cursor:
+            # i.e. we have no more arguments available
+            self.report(fun.trash_duplicates(self.extension_index, self.trash_folder_name, self.sudo, max_workers=self.max_workers, root=self.folder), "info")
+        else:
+            directory = split_command[cursor]
+            cursor += 1
+            if directory not in self.EXTENSIONS:
+                self.report(f"{directory} is not a valid directory. Please input a valid directory.", "error")
+            else:
+                self.report(fun.trash_duplicates(self.extension_index, self.trash_folder_name, self.sudo, directory, self.max_workers, root=self.folder), "info")
+
+    def process_watch(self, split_command, cursor):
+        """
+        When the 'watch' command is read.
+        """
+        time_limit = self.watch_time_limit
+        if len(split_command) > cursor:
+            try:
+                time_limit = int(split_command[cursor])
+            except ValueError:
+                time_limit = 0
+            if time_limit <= 0:
+                self.report(f"Could not parse '{split_command[cursor]}' as a positive int. Please input a positive integer.", "error")
+                return
+        pipeline = fun.Pipeline(self.extension_index, self.trash_folder_name, time_limit, self.watch_by_date, self.capture_dates)
+        self.report(fun.watch_folder(pipeline, self.sudo, self.max_workers, self.use_cache, self.cache_size, root=self.folder), "info")
+
+    def process_pipeline(self, split_command, cursor):
+        """
+        When the 'pipeline' command is read.
+        """
+        stages = split_command[cursor:] if len(split_command) > cursor else self.pipeline_stages.split()
+        pipeline = self.parse_pipeline(stages)
+        if pipeline is None:
+            self.report(self.WARNINGS["syntax-pipeline"], "error")
+            return
+        self.report(fun.run_pipeline(pipeline, self.sudo, self.max_workers, self.use_cache, self.cache_size, root=self.folder), "info")
+
+    def parse_pipeline(self, stages):
+        """
+        Return the Pipeline of a chain of stages such as 'folder trash 3 date Videos', or None if it is not valid.
+        The 'folder' stage comes first, then optionally 'trash $time', then optionally 'date [$directory]'.
+        """
+        if not stages or self.preprocess.get(stages[0].lower()) != "folder":
+            return None
+        time_limit = None
+        by_date = False
+        date_categories = None
+        cursor = 1
+        while len(stages) > cursor:
+            stage = self.preprocess.get(stages[cursor].lower())
+            cursor += 1
+            if stage == "trash" and time_limit is None and not by_date and len(stages) > cursor \
+                    and stages[cursor].isdigit() and int(stages[cursor]) > 0:
+                time_limit = int(stages[cursor])
+                cursor += 1
+            elif stage == "date" and not by_date:
+                by_date = True
+                if len(stages) > cursor and stages[cursor] in self.EXTENSIONS:
+                    date_categories = [stages[cursor]]
+                    cursor += 1
+            else:
+                return None
+        return fun.Pipeline(self.extension_index, self.trash_folder_name, time_limit, by_date, self.capture_dates, date_categories)
+
+    def process_du(self, split_command, cursor):
+        """
+        When the 'du' command is read.
+        """
+        time_limit = None
+        approximate = False
+        budget = self.du_time_budget
+        while len(split_command) > cursor:
+            argument = split_command[cursor]
+            cursor += 1
+            if argument == "--approx":
+                approximate = True
+                if len(split_command) > cursor:
+                    try:
+                        budget = float(split_command[cursor])
+                    except ValueError:
+                        continue
+                    cursor += 1
+                    if budget <= 0:
+                        self.report(f"Could not parse '{split_command[cursor - 1]}' as a positive number of seconds.", "error")
+                        return
+            elif time_limit is None and argument.isdigit() and int(argument) > 0:
+                time_limit = int(argument)
+            else:
+                self.report(self.WARNINGS["syntax-du"], "error")
+                return
+        self.report(fun.folder_footprint(self.extension_index, self.trash_folder_name, time_limit, approximate, budget, self.max_workers, self.use_cache, root=self.folder), "info")
+
+    def process_undo(self, split_command, cursor):
+        """
+        When the 'undo' command is read.
+        """
+        self.report(fun.undo_last_run(self.folder), "info")
+
+    def process_resume(self, split_command, cursor):
+        """
+        When the 'resume' command is read.
+        """
+        self.report(fun.resume_last_run(self.folder), "info")
+
+    def process_each(self, split_command, cursor):
+        """
+        When the 'each' command is read.
+        """
+        if len(split_command) < cursor + 2:
+            # i.e. we need at least the folders and the command
+            self.report(self.WARNINGS["syntax-each"], "warning")
+            return
+        patterns = split_command[cursor].split(",")
+        operation = self.preprocess.get(split_command[cursor + 1].lower())
+        cursor += 2
+        if operation not in fanout.OPERATIONS:
+            self.report(f"The 'each' command can only run the {', '.join(fanout.OPERATIONS)} commands.", "error")
+            return
+        argument = None
+        if operation == "trash":
+            if len(split_command) == cursor:
+                self.report(self.WARNINGS["syntax-time"], "warning")
+                return
+            try:
+                argument = int(split_command[cursor])
+            except ValueError:
+                argument = 0
+            if argument <= 0:
+                self.report(f"Could not parse '{split_command[cursor]}' as a positive int. Please input a positive integer.", "error")
+                return
+        elif operation == "date" and len(split_command) > cursor:
+            argument = split_command[cursor]
+            if argument not in self.EXTENSIONS:
+                self.report(f"{argument} is not a valid directory. Please input a valid directory.", "error")
+                return
+
+        directories = fanout.find_directories(patterns, self.folder)
+        if len(directories) == 0:
+            self.report(f"No folder matches '{split_command[cursor - 2]}'.", "error")
+            return
+        counts = {"folders": len(directories), "failed": 0}
+        for summary in fanout.fan_out(directories, operation, argument, self.options(), self.fanout_workers):
+            checkpoint()
+            if summary["ok"]:
+                self.report(f"{summary['folder']}: {summary['message']}")
+                for name, value in summary["counts"].items():
+                    counts[name] = counts.get(name, 0) + value
+            else:
+                counts["failed"] += 1
+                self.report(f"{summary['folder']}: {summary['error']}", "error")
+        term = "s" if len(directories) >= 2 else ""
+        self.report(fun.Result(f"'{operation}' run in {len(directories)} folder{term}, {counts['failed']} failed.", **counts), "info")
+
+    def process_jobs(self, split_command, cursor):
+        """
+        When the 'jobs' command is read.
+        """
+        if not self.job_manager.jobs:
+            self.report("No job has been started yet.", "info")
+        for job in self.job_manager.jobs.values():
+            self.report(job.describe())
+            # the end of a job listed here is not displayed again
+            job.reported = job.reported or not job.running
+
+    def process_wait(self, split_command, cursor):
+        """
+        When the 'wait' command is read.
+        """
+        jobs = self.parse_jobs(split_command, cursor, self.job_manager.running())
+        for job in jobs:
+            self.wait_for_job(job)
+            if job.running:  # Ctrl-C
+                return
+            if job.background and not job.reported:
+                job.reported = True
+                self.report(job.describe())
+                for kind, text in job.messages:
+                    self.report(text, kind)
+        if jobs:
+            self.report("All the jobs are over." if len(jobs) >= 2 else f"[{jobs[0].number}] is over.", "info")
+
+    def process_cancel(self, split_command, cursor):
+        """
+        When the 'cancel' command is read.
+        """
+        if len(split_command) == cursor and len(self.job_manager.running()) != 1:
+            self.report(self.WARNINGS["syntax-cancel"], "warning")
+            return
+        for job in self.parse_jobs(split_command, cursor, self.job_manager.running()):
+            if job.running:
+                job.cancel()
+                self.report(f"[{job.number}] '{job.command}' will stop after the current file.", "info")
+            else:
+                self.report(f"[{job.number}] '{job.command}' is already over.", "warning")
+
+    def parse_jobs(self, split_command, cursor, default):
+        """
+        Return the jobs given by number (or 'all') in a command, `default` if there is none.
+        """
+        if len(split_command) == cursor:
+            if not default:
+                self.report("No job is running.", "info")
+            return default
+        if split_command[cursor].lower() == "all":
+            return self.job_manager.running()
+        jobs = []
+        for argument in split_command[cursor:]:
+            number = argument.strip("[]%")
+            job = self.job_manager.get(int(number)) if number.isdigit() else None
+            if job is None:
+                self.report(f"There is no job '{argument}'. Use 'jobs' to list the jobs.", "error")
+                return []
+            jobs.append(job)
+        return jobs
+
+    def process_stats(self, split_command, cursor):
+        """
+        When the 'stats' command is read.
+        """
+        if not fun.recorder.enabled:
+            self.report("The instrumentation is disabled. Set 'instrumentation' to True in data.yaml to enable it.", "warning")
+        elif fun.recorder.last is None:
+            self.report("No command has been timed yet.", "info")
+        else:
+            self.report(fun.recorder.last.format())
+
+    def options(self):
+        """
+        Return the settings needed to run an operation in another process.
+        """
+        return {
+            "extensions": self.extension_index,
+            "sudo": self.sudo,
+            "trash_folder_name": self.trash_folder_name,
+            "max_workers": self.max_workers,
+            "use_cache": self.use_cache,
+            "cache_size": self.cache_size,
+            "capture_dates": self.capture_dates,
+            "safety_check_depth": fun.safety_check.depth,
+            "transfer_workers": fun.transfer_settings.workers,
+            "verify_transfers": fun.transfer_settings.verify,
+        }
 
     def process_help(self, split_command, cursor):
         """
@@ -189,7 +705,7 @@ class CLI(object):
         """
         if len(split_command) == cursor:
             # i.e. no more arguments to read, just printing command list.
-            print(self.HELP["help"])
+            self.report(self.HELP["help"])
         else:
             topic = split_command[cursor]
             cursor += 1
@@ -203,15 +719,15 @@ class CLI(object):
                     internal_instruction == "help-twice"
 
                 # now we can print the help for the desired instruction.
-                print(self.HELP[internal_instruction])
+                self.report(self.HELP[internal_instruction])
 
                 # if the instruction was "folder", then we output some more contextual help
                 if internal_instruction == "folder":
                     for directory in self.EXTENSIONS:
-                        print(f"{directory}:".ljust(11, ' '), str(self.EXTENSIONS[directory]), sep='')
-                        print(self.HELP["folder-creation"])
+                        self.report(f"{directory}:".ljust(11, ' ') + str(self.EXTENSIONS[directory]))
+                        self.report(self.HELP["folder-creation"])
             else:  # the instruction is not recognized
-                print(self.HELP["other"])
+                self.report(self.HELP["other"])
 
     def print_header(self):
         """Print header."""
@@ -241,41 +757,138 @@ def dir_style(text):
     """Create a pretty directory string from text."""
     return f"\033[94m{text}\033[m"
 
+STYLES = {"text": str, "info": info, "warning": warning, "error": err}
+
+
+def load_data():
+    """
+    Load the data.yaml file of the package, and compile the index of its extensions.
+    Parsing YAML is slow, so the parsed data and the index are cached in a pickle file of the __pycache__ folder of the package, used as long as data.yaml does not change.
+    """
+    path = os.path.join(os.path.dirname(fun.__file__), 'data.yaml')
+    cache_path = os.path.join(os.path.dirname(path), '__pycache__', f'data.{sys.implementation.cache_tag}.pickle')
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached_key, data = pickle.load(cache_file)
+        if cached_key == key and "EXTENSION_INDEX" in data:
+            return data
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    # imported here because PyYAML is slow to import and only needed when data.yaml changes
+    import yaml
+    with open(path) as yaml_file:
+        data = yaml.load(yaml_file, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    data["EXTENSION_INDEX"] = ExtensionIndex(data["EXTENSIONS"], data["PARAMETERS"]["case_sensitive_extensions"])
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        partial = f"{cache_path}.{os.getpid()}"
+        with open(partial, 'wb') as cache_file:
+            pickle.dump((key, data), cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, cache_path)
+    except OSError:  # read-only installation
+        pass
+    return data
+
+
+def parse_arguments():
+    """Parse the command line arguments."""
+    parser = argparse.ArgumentParser(description="Video logging automation. Without arguments, starts the interactive tool.")
+    parser.add_argument("script", nargs="?", help="file of commands to run in batch mode, one per line ('-' for stdin)")
+    parser.add_argument("-c", "--command", action="append", default=[], help="command to run in batch mode (can be repeated)")
+    parser.add_argument("--profile", metavar="FILE", help="profile the session and save it to FILE: a trace of the phases of the commands if FILE ends with '.json' (for chrome://tracing or Perfetto), else cProfile statistics (for pstats or snakeviz)")
+    return parser.parse_args()
+
+
+def start_profile(path):
+    """Start profiling the session, see the --profile argument. Return the profiler, or None for a trace."""
+    if path.endswith(".json"):
+        fun.recorder.trace = True
+        return None
+    import cProfile
+    # the commands run in jobs, in other threads, which are profiled separately
+    jobs.profiles = []
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save_profile(path, profiler):
+    """Stop profiling the session and save the profile."""
+    if profiler is None:
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": fun.recorder.events, "displayTimeUnit": "ms"}, f)
+    else:
+        profiler.disable()
+        import pstats
+        # the jobs still running are left out
+        stats = pstats.Stats(profiler, *list(jobs.profiles))
+        stats.dump_stats(path)
+    print(f"Profile saved to {path}.", file=sys.stderr)
+
+
+def batch_main(arguments):
+    """Run commands from the command line, a script or stdin, and print one JSON line per command."""
+    commands = list(arguments.command)
+    if arguments.script == "-":
+        commands += sys.stdin.read().splitlines()
+    elif arguments.script is not None:
+        with open(arguments.script) as script:
+            commands += script.read().splitlines()
+    cli = CLI(load_data())
+    ok = True
+    for result in cli.run_batch(commands):
+        print(json.dumps(result), flush=True)
+        ok = ok and result["ok"]
+    sys.exit(0 if ok else 1)
+
 
 def main():
+    arguments = parse_arguments()
+    if arguments.profile is None:
+        run(arguments)
+        return
+    path = os.path.abspath(arguments.profile)
+    profiler = start_profile(path)
+    try:
+        run(arguments)
+    finally:
+        save_profile(path, profiler)
+
+
+def run(arguments):
+    """Run the batch mode or the interactive tool."""
+    if arguments.command or arguments.script is not None:
+        batch_main(arguments)
+
     import platform
     platform = platform.system()
     if platform == "Windows":
         os.system('cls')
     elif platform == "Linux":
-        os.system('clear')
+        # clear the screen without starting a process
+        print("\033[H\033[2J", end="", flush=True)
     else:
         sys.exit(f"Your platform ({platform}) isn't supported yet...")
 
-    with open('videologging/data.yaml') as yaml_file:
-        data = yaml.load(yaml_file, Loader=yaml.FullLoader)
-    cli = CLI(data)
+    cli = CLI(load_data())
     cli.print_header()
 
     while True:
         try:
+            cli.report_jobs()
             print()
             print(cli.pretty_dir())
             command = input(dir_style(">> "))
-            cli.read_command(command)
-        except fun.EmptyFolder as e:
-            print(info(str(e)))
-        except fun.BadFolderName as e:
-            print()  # to avoid ugly output
-            print(err(str(e)))
-        except fun.SudoException as e:
-            print(warning(cli.WARNINGS["sudo-exception"]))
-        except OSError as e:
-            print(error(str(e)))
-        except (EOFError, KeyboardInterrupt):
+            cli.execute(command)
+        except EOFError:
             print("exit")  # to avoid ugly output
             cli.exit()
             break
+        except KeyboardInterrupt:
+            # Ctrl-C cancels the running command (see wait_for_job), not the tool
+            print()
 
 if __name__ == '__main__':
     main()
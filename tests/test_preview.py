@@ -0,0 +1,41 @@
+# encoding: utf-8
+"""Tests of the preview.py module."""
+
+import os
+import tempfile
+import time
+import unittest
+import videologging.preview as preview
+
+
+def write_proxy(path, proxy, height=360):
+    """Stand-in for make_contact_sheet, which needs moviepy and real videos."""
+    time.sleep(0.2)
+    with open(proxy, 'w'):
+        pass
+    return proxy
+
+
+class ProxyBuilderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.make_contact_sheet = preview.make_contact_sheet
+        preview.make_contact_sheet = write_proxy
+
+    def tearDown(self):
+        preview.make_contact_sheet = self.make_contact_sheet
+
+    def test_close_early_removes_the_proxies(self):
+        with tempfile.TemporaryDirectory() as root:
+            paths = [os.path.join(root, f"clip{i}.mp4") for i in range(20)]
+            builder = preview.ProxyBuilder(root, "sheet", paths, max_workers=2)
+            folder = builder.folder
+            # some proxies are built, some are being built and the others are queued
+            time.sleep(0.3)
+            builder.advance(paths[0])
+            builder.close()
+            self.assertFalse(os.path.exists(folder))
+
+
+if __name__ == '__main__':
+    unittest.main()
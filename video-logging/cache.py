@@ -0,0 +1,318 @@
+# encoding: utf-8
+"""Persistent media metadata cache used by the functions.py module.
+
+The metadata of the media files of a folder (duration, resolution, codec and
+creation time) is stored in a SQLite database next to them, so that running
+several times the same command on a folder does not probe the files again.
+The capture times read by the dates.py module and the fingerprints computed
+by the fingerprint.py module are stored in other tables of the same database.
+A file is probed again only if its size, mtime or inode changed.
+
+On read-only media, or if the database cannot be written for another
+reason, the cache keeps working for the session only: it is replaced by an
+in-memory database, a copy of the existing one if it can be read, which the
+next commands run on the folder reuse. Nothing is stored in the folder and
+the command does not fail.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import urllib.parse
+from videologging.fingerprint import Fingerprint
+from videologging.probe import MediaInfo
+
+
+CACHE_FILE_NAME = ".videolog-cache"
+
+# in-memory databases replacing the caches that cannot be written, by folder
+session_databases = dict()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    codec TEXT,
+    creation_time REAL,
+    last_used REAL
+)
+"""
+
+DATES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dates (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    capture_time REAL,
+    last_used REAL
+)
+"""
+
+FINGERPRINTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    name TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    fingerprint TEXT,
+    last_used REAL
+)
+"""
+
+
+class MetadataCache(object):
+    """Metadata cache of the files of a folder.
+
+    The cache is not thread-safe: lookups and stores must happen in the thread
+    that opened it. Use it as a context manager so that the access times are
+    saved and the cache is trimmed to `max_entries` when leaving.
+
+    Parameters
+    ----------
+    folder : string
+        Folder whose files are cached. The database is stored in it.
+    max_entries : int
+        Maximum number of entries kept. The least recently used entries are
+        evicted first. If None, the cache is not bounded.
+    read_only : bool
+        If True, the existing database is only read, and none is created.
+        Nothing is stored, not even for the session.
+    """
+
+    def __init__(self, folder='.', max_entries=None, read_only=False):
+        self.folder = folder
+        self.max_entries = max_entries
+        # whether the database of the folder can be written
+        self.writable = not read_only
+        # whether the cache is the in-memory database of the session
+        self.in_memory = False
+        path = os.path.join(folder, CACHE_FILE_NAME)
+        try:
+            if not read_only and os.path.abspath(folder) in session_databases:
+                # the database of the folder could not be written earlier in the session
+                self.use_session_database()
+            elif read_only:
+                if not os.path.isfile(path):
+                    raise sqlite3.OperationalError("No cache in this folder.")
+                self.connection = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro",
+                                                  uri=True)
+                # fails now rather than at the first lookup if the file is not a database
+                self.connection.execute("SELECT name FROM media LIMIT 1")
+            else:
+                self.connection = sqlite3.connect(path)
+                self.create_tables()
+        except sqlite3.Error:
+            # read-only media, corrupted database...: the cache only lasts for the session
+            if read_only:
+                self.writable = False
+                self.connection = sqlite3.connect(":memory:")
+                self.create_tables()
+            else:
+                self.use_session_database()
+        # names looked up during this session, whose 'last_used' must be updated
+        self.used = set()
+        self.used_dates = set()
+        self.used_fingerprints = set()
+
+    def create_tables(self):
+        self.connection.execute(SCHEMA)
+        self.connection.execute(DATES_SCHEMA)
+        self.connection.execute(FINGERPRINTS_SCHEMA)
+
+    def use_session_database(self):
+        """Replace the database of the folder by the in-memory database of the
+        session, created from a copy of the current one if there is none yet."""
+        key = os.path.abspath(self.folder)
+        if key not in session_databases:
+            # used by the threads of the jobs too, but by one command at a time
+            database = sqlite3.connect(":memory:", check_same_thread=False)
+            try:
+                self.connection.backup(database)
+            except (AttributeError, sqlite3.Error):  # no database opened, or it cannot be read
+                pass
+            session_databases[key] = database
+        if getattr(self, "connection", None) is not None:
+            self.connection.close()
+        self.connection = session_databases[key]
+        self.writable = False
+        self.in_memory = True
+        self.create_tables()
+
+    def write(self, query, parameters):
+        """Execute a query modifying the cache. If the database of the folder
+        turns out not to be writable, the in-memory database of the session
+        is used instead. The queries of a read-only cache are dropped."""
+        if not self.writable and not self.in_memory:
+            return
+        try:
+            self.connection.execute(query, parameters)
+        except sqlite3.Error:
+            if self.in_memory:
+                return
+            self.use_session_database()
+            self.connection.execute(query, parameters)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, name, key):
+        """Return the cached MediaInfo of a file, or None if it is missing or
+        stale.
+
+        Parameters
+        ----------
+        name : string
+            Name of the file in the folder.
+        key : tuple
+            Current (size, mtime_ns, inode) of the file.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, inode, duration, width, height, codec, creation_time "
+            "FROM media WHERE name = ?", (name,)).fetchone()
+        if row is None or tuple(row[:3]) != tuple(key):
+            return None
+        self.used.add(name)
+        return MediaInfo(*row[3:])
+
+    def store(self, name, key, info):
+        """Store the MediaInfo of a file.
+
+        Parameters
+        ----------
+        name : string
+            Name of the file in the folder.
+        key : tuple
+            (size, mtime_ns, inode) of the file when it was probed.
+        info : MediaInfo
+            Metadata to store.
+        """
+        self.write(
+            "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, *key, info.duration, info.width, info.height, info.codec, info.creation_time, time.time()))
+
+    def lookup_date(self, name, key):
+        """Return the cached capture time of a file as a 1-tuple, whose value is
+        None if the file has no capture time, or None if it is missing or
+        stale.
+
+        Parameters
+        ----------
+        name : string
+            Name of the file in the folder.
+        key : tuple
+            Current (size, mtime_ns, inode) of the file.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, inode, capture_time FROM dates WHERE name = ?", (name,)).fetchone()
+        if row is None or tuple(row[:3]) != tuple(key):
+            return None
+        self.used_dates.add(name)
+        return (row[3],)
+
+    def store_date(self, name, key, capture_time):
+        """Store the capture time of a file, None if it has none.
+
+        Parameters
+        ----------
+        name : string
+            Name of the file in the folder.
+        key : tuple
+            (size, mtime_ns, inode) of the file when it was read.
+        capture_time : float
+            Capture time to store.
+        """
+        self.write(
+            "INSERT OR REPLACE INTO dates VALUES (?, ?, ?, ?, ?, ?)",
+            (name, *key, capture_time, time.time()))
+
+    def lookup_fingerprint(self, name, key, frames):
+        """Return the cached Fingerprint of a video, or None if it is missing,
+        stale or made of another number of frames.
+
+        Parameters
+        ----------
+        name : string
+            Name of the file in the folder.
+        key : tuple
+            Current (size, mtime_ns, inode) of the file.
+        frames : int
+            Number of sampled frames.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, inode, fingerprint FROM fingerprints WHERE name = ?", (name,)).fetchone()
+        if row is None or tuple(row[:3]) != tuple(key):
+            return None
+        fingerprint = Fingerprint(*json.loads(row[3]))
+        if len(fingerprint.hashes) != frames:
+            return None
+        self.used_fingerprints.add(name)
+        return fingerprint
+
+    def store_fingerprint(self, name, key, fingerprint):
+        """Store the Fingerprint of a video.
+
+        Parameters
+        ----------
+        name : string
+            Name of the file in the folder.
+        key : tuple
+            (size, mtime_ns, inode) of the file when it was sampled.
+        fingerprint : Fingerprint
+            Fingerprint to store.
+        """
+        self.write(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+            (name, *key, json.dumps(fingerprint), time.time()))
+
+    def close(self):
+        """Save the access times, evict the least recently used entries and
+        close the database."""
+        try:
+            if self.writable or self.in_memory:
+                now = time.time()
+                for table, used in [("media", self.used), ("dates", self.used_dates),
+                                    ("fingerprints", self.used_fingerprints)]:
+                    self.connection.executemany(f"UPDATE {table} SET last_used = ? WHERE name = ?",
+                                                ((now, name) for name in used))
+                    if self.max_entries is not None:
+                        self.connection.execute(
+                            f"DELETE FROM {table} WHERE name NOT IN "
+                            f"(SELECT name FROM {table} ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+                self.connection.commit()
+        except sqlite3.Error:  # the database could not be written
+            pass
+        finally:
+            # the in-memory database is kept for the next commands
+            if not self.in_memory:
+                self.connection.close()
+
+
+def clear_cache(folder='.'):
+    """Delete the metadata cache of a folder.
+
+    Parameters
+    ----------
+    folder : string
+        Folder whose cache is deleted.
+
+    Returns
+    -------
+    bool
+        Whether a cache was found and deleted.
+    """
+    path = os.path.join(folder, CACHE_FILE_NAME)
+    found = session_databases.pop(os.path.abspath(folder), None) is not None
+    if os.path.exists(path):
+        os.remove(path)
+        return True
+    return found
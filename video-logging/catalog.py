@@ -0,0 +1,266 @@
+# encoding: utf-8
+"""Columnar listing of a directory, used by the functions.py module.
+
+A Snapshot keeps an Entry (a tuple of Python objects) per file, and each
+operation then splits the extension of every name again. On folders of
+hundreds of thousands of files, this overhead dominates the memory and the
+time of the commands. A Catalog stores the same listing by columns instead:
+    - the names in a single string, with the offset of each one;
+    - the extension of each file as a small integer, the index of its
+      extension in a table of the distinct extensions of the folder, which
+      is looked up in the ExtensionIndex once per distinct extension;
+    - the kinds, sizes, modification times and inodes as arrays of integers.
+The files of a type, the videos shorter than a limit or the days of the files
+are then found by operations on whole columns with NumPy, and an Entry is
+only built for the files an operation actually works on.
+"""
+
+import os
+from array import array
+from itertools import accumulate
+from videologging.instrument import recorder
+from videologging.pipeline import date_folder_name
+import videologging.scan as scan
+
+
+# kind of an entry -> code stored in the 'kinds' column
+KINDS = ('file', 'dir', 'other')
+FILE, DIR, OTHER = range(len(KINDS))
+# the UTC offset of every time zone is a multiple of 15 minutes, so two
+# timestamps of the same 15 minutes slice are always on the same local day
+DAY_SLICE_NS = 15 * 60 * 10 ** 9
+
+
+class Catalog(object):
+    """Listing of a directory stored by columns, see `catalog`.
+
+    Parameters
+    ----------
+    path : string
+        Scanned directory.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    names : string
+        Names of the entries, sorted, one after the other.
+    offsets : array
+        Offset of each name in `names`, followed by the length of `names`.
+    extension_table : list
+        Distinct extensions of the entries, normalized by `extensions`.
+    extension_ids, kinds, sizes, mtimes_ns, inodes : numpy.ndarray
+        Columns of the entries, in the order of `names`: index of the extension in `extension_table`,
+        kind code (see KINDS), size in bytes, modification time in
+        nanoseconds and inode number.
+    """
+
+    def __init__(self, path, extensions, names, offsets, extension_table, extension_ids, kinds, sizes, mtimes_ns, inodes):
+        # imported here because it is slow to import
+        import numpy as np
+        self.path = path
+        self.extensions = extensions
+        self.names = names
+        self.offsets = offsets
+        self.extension_table = extension_table
+        self.extension_ids = extension_ids
+        self.kinds = kinds
+        self.sizes = sizes
+        self.mtimes_ns = mtimes_ns
+        self.inodes = inodes
+        # categories, and the first category of each extension of the table ('Other' if unknown)
+        self.category_table = list(extensions) + ['Other']
+        ids = {category: i for i, category in enumerate(self.category_table)}
+        first = [ids[extensions.categories.get(extension, 'Other')] for extension in extension_table]
+        self.category_ids = np.array(first, dtype=np.uint8)[self.extension_ids] if first else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def name(self, index):
+        """Return the name of an entry."""
+        return self.names[self.offsets[index]:self.offsets[index + 1]]
+
+    def entry(self, index):
+        """Return the Entry of an entry."""
+        name = self.name(index)
+        mtime_ns = int(self.mtimes_ns[index])
+        return scan.Entry(
+            name=name,
+            extension=os.path.splitext(name)[1],
+            kind=KINDS[self.kinds[index]],
+            size=int(self.sizes[index]),
+            mtime=mtime_ns / 1e9,
+            mtime_ns=mtime_ns,
+            inode=int(self.inodes[index]),
+        )
+
+    def entries(self, indices):
+        """Return the Entry of the entries of an array of indices."""
+        return [self.entry(index) for index in indices.tolist()]
+
+    def cache_keys(self, indices):
+        """Yield the name and the metadata cache key (size, mtime_ns, inode) of
+        the entries of an array of indices, without building their Entry."""
+        for index, size, mtime_ns, inode in zip(indices.tolist(), self.sizes[indices].tolist(),
+                                                self.mtimes_ns[indices].tolist(), self.inodes[indices].tolist()):
+            yield self.name(index), (size, mtime_ns, inode)
+
+    def select(self, category=None, files_only=False, directories=False):
+        """Return the indices of the entries of a type, in the order of their
+        names, as an array.
+
+        Parameters
+        ----------
+        category : string
+            Type of the entries, e.g. 'Videos'. An extension listed in several
+            types matches all of them. If None, the entries of all types.
+        files_only : bool
+            Whether to leave out the entries that are not regular files.
+        directories : bool
+            Whether to leave out the directories. Ignored if `files_only`.
+        """
+        import numpy as np
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            members = self.extensions.members[category]
+            mask &= np.array([extension in members for extension in self.extension_table] or [False],
+                             dtype=bool)[self.extension_ids]
+        if files_only:
+            mask &= self.kinds == FILE
+        elif not directories:
+            mask &= self.kinds != DIR
+        return np.flatnonzero(mask)
+
+    def count(self, category=None, files_only=False):
+        """Return the number of entries of a type, see `select`."""
+        if category is None and not files_only:
+            return len(self)
+        return len(self.select(category, files_only, directories=True))
+
+    def total_size(self, indices):
+        """Return the total size of the entries of an array of indices."""
+        return int(self.sizes[indices].sum())
+
+    def categories(self, indices):
+        """Return the type of each entry of an array of indices, 'Other' if
+        its extension is unknown."""
+        table = self.category_table
+        return [table[category_id] for category_id in self.category_ids[indices].tolist()]
+
+    def shorter_than(self, indices, durations, time_limit):
+        """Return the indices of the entries shorter than a time limit.
+
+        Parameters
+        ----------
+        indices : array
+            Indices of the entries.
+        durations : list
+            Duration of each entry of `indices`, or None if it is unknown (the
+            entry is then left out).
+        time_limit : float
+            Duration limit, in seconds.
+        """
+        import numpy as np
+        durations = np.array([duration if duration is not None else np.nan for duration in durations], dtype=float)
+        return indices[durations < time_limit]
+
+    def day_folders(self, indices, dates=None):
+        """Return the 'YYMMDD-Day' folder of each entry of an array of indices.
+
+        The local date is computed once per 15 minutes slice of the times of
+        the entries, not once per entry.
+
+        Parameters
+        ----------
+        indices : array
+            Indices of the entries.
+        dates : dict
+            Capture time of the entries that have one, indexed by name. The
+            other entries are dated by their modification time.
+        """
+        import numpy as np
+        # a copy, as `indices` is an array
+        times_ns = self.mtimes_ns[indices]
+        if dates:
+            for position, index in enumerate(indices.tolist()):
+                date = dates.get(self.name(index))
+                if date is not None:
+                    times_ns[position] = int(date * 1e9)
+        slices, inverse = np.unique(times_ns // DAY_SLICE_NS, return_inverse=True)
+        names = [date_folder_name(slice_ * DAY_SLICE_NS / 1e9) for slice_ in slices.tolist()]
+        return [names[i] for i in inverse.reshape(-1).tolist()]
+
+
+def catalog(path, extensions):
+    """Scan a directory and return its Catalog.
+
+    The files created by this tool are left out. The columns are filled while
+    the directory is listed, and then sorted by name at once, so that no
+    Python object is kept per entry but its name.
+
+    Parameters
+    ----------
+    path : string
+        Directory to scan.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    """
+    # imported here because it is slow to import
+    import numpy as np
+    with recorder.phase("listing"):
+        names = []
+        extension_ids = array('I')
+        kinds = array('B')
+        sizes = array('q')
+        mtimes_ns = array('q')
+        inodes = array('Q')
+        # normalized extension -> index in the table
+        extension_table = dict()
+        # last suffix of the name -> index in the table, for the names that cannot end with a multi-part extension
+        suffix_ids = dict()
+        multi_part_ends = {'.' + extension.rsplit('.', 1)[1] for extension in extensions.multi_part}
+        with os.scandir(path) as iterator:
+            for dir_entry in iterator:
+                name = dir_entry.name
+                if scan.is_tool_file(name):
+                    continue
+                try:
+                    kind, stat = kind_and_stat(dir_entry)
+                except FileNotFoundError:  # removed since it was listed
+                    continue
+                suffix = os.path.splitext(name)[1]
+                extension_id = suffix_ids.get(suffix)
+                if extension_id is None:
+                    extension = extensions.normalize(extensions.extension(name))
+                    extension_id = extension_table.setdefault(extension, len(extension_table))
+                    if extensions.normalize(suffix) not in multi_part_ends:
+                        suffix_ids[suffix] = extension_id
+                names.append(name)
+                extension_ids.append(extension_id)
+                kinds.append(kind)
+                sizes.append(stat.st_size)
+                mtimes_ns.append(stat.st_mtime_ns)
+                inodes.append(stat.st_ino)
+
+        order = np.array(sorted(range(len(names)), key=names.__getitem__), dtype=np.intp)
+        names = [names[index] for index in order.tolist()]
+        offsets = array('q', accumulate(map(len, names), initial=0))
+        columns = [np.frombuffer(column, dtype=dtype)[order] for column, dtype in
+                   [(extension_ids, np.uint32), (kinds, np.uint8), (sizes, np.int64), (mtimes_ns, np.int64),
+                    (inodes, np.uint64)]]
+    recorder.count("files scanned", len(names))
+    return Catalog(path, extensions, "".join(names), offsets, list(extension_table), *columns)
+
+
+def kind_and_stat(dir_entry):
+    """Return the kind code and the stat result of an os.DirEntry, using its
+    cached stat data."""
+    try:
+        stat = dir_entry.stat()
+    except OSError:  # broken symbolic link
+        stat = dir_entry.stat(follow_symlinks=False)
+    if dir_entry.is_dir():
+        kind = DIR
+    elif dir_entry.is_file():
+        kind = FILE
+    else:
+        kind = OTHER
+    return kind, stat
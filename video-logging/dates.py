@@ -0,0 +1,291 @@
+# encoding: utf-8
+"""Capture time of media files, used by the functions.py module.
+
+The modification time of a file changes when it is copied from a card, so
+the 'date' command reads the time the picture, video or sound was recorded
+from the file itself when it can:
+    - EXIF 'DateTimeOriginal' for the JPEG and TIFF images,
+    - 'mvhd' creation time for the MP4/QuickTime videos,
+    - File Properties creation date for the ASF (WMV) files,
+    - 'bext' origination date for the Broadcast Wave files,
+    - ID3v2 recording time for the MP3 files.
+As for the probes of the probe.py module, each reader only reads the few
+header bytes it needs. The other files are dated by their modification time.
+"""
+
+import os
+import struct
+import time
+from videologging.probe import ProbeError, find_atom, probe_asf, read_mvhd
+
+
+# extension -> reader function, filled by the register_reader decorator
+READERS = dict()
+# seconds a capture time can be ahead of now, as the clock of a camera may be set to another time zone
+FUTURE_MARGIN = 24 * 3600
+
+
+def register_reader(*extensions):
+    """Register a function as the capture time reader of some extensions.
+
+    The reader receives an open binary file and must return a POSIX timestamp,
+    or None if the file does not contain a capture time.
+
+    Parameters
+    ----------
+    extensions : strings
+        Extensions handled by the reader (case insensitive).
+    """
+    def decorator(function):
+        for extension in extensions:
+            READERS[extension.lower()] = function
+        return function
+    return decorator
+
+
+def read_capture_time(file):
+    """Return the capture time of a file as a POSIX timestamp, or None if it
+    has no reader or no readable capture time. A capture time before 1970 or
+    in the future, read from a corrupted file, is not readable.
+
+    Parameters
+    ----------
+    file : string
+        Path of the file.
+    """
+    extension = os.path.splitext(file)[1].lower()
+    function = READERS.get(extension)
+    if function is None:
+        return None
+    try:
+        with open(file, 'rb') as f:
+            capture_time = function(f)
+    except (ProbeError, struct.error, IndexError, ValueError, OverflowError):
+        return None
+    return capture_time if is_plausible(capture_time) else None
+
+
+def is_plausible(timestamp):
+    """Return whether a capture time is between 1970 and now, give or take
+    FUTURE_MARGIN. Beyond, it cannot be turned into a date folder."""
+    return timestamp is not None and 0 <= timestamp <= time.time() + FUTURE_MARGIN
+
+
+def parse_date(date, time_of_day="00:00:00"):
+    """Return the local POSIX timestamp of a 'YYYY?MM?DD' date and a
+    'HH?MM?SS' time, whatever the separators are, or None if it is not set."""
+    digits = "".join(character for character in date + time_of_day if character.isdigit())
+    if len(digits) < 8 or int(digits[:4]) == 0:
+        return None
+    digits = digits[:14].ljust(14, "0")
+    fields = [int(digits[:4]), int(digits[4:6]), int(digits[6:8]),
+              int(digits[8:10]), int(digits[10:12]), int(digits[12:14])]
+    return time.mktime((*fields, 0, 0, -1))
+
+
+# EXIF ===========================================================================
+
+TIFF_MODEL = 0x0110
+TIFF_DATE_TIME = 0x0132
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATE_TIME_ORIGINAL = 0x9003
+
+
+@register_reader('.jpg', '.jpeg')
+def read_jpeg(f):
+    """Read the EXIF data of the APP1 segment of a JPEG file."""
+    base = find_jpeg_exif(f)
+    return read_tiff_at(f, base) if base is not None else None
+
+
+def find_jpeg_exif(f):
+    """Return the offset of the TIFF structure of the EXIF data of a JPEG
+    file, or None if it has no EXIF data."""
+    if f.read(2) != b'\xff\xd8':
+        raise ProbeError("Not a JPEG file.")
+    while True:
+        marker, size = struct.unpack('>2sH', f.read(4))
+        if marker[0] != 0xff or marker[1] == 0xda:  # start of the image data
+            return None
+        if marker[1] == 0xe1 and f.read(6) == b'Exif\0\0':
+            return f.tell()
+        f.seek(f.tell() + size - 2 - (6 if marker[1] == 0xe1 else 0))
+
+
+@register_reader('.tif', '.tiff', '.dng', '.nef', '.cr2', '.arw')
+def read_tiff(f):
+    """Read the EXIF data of a TIFF (or TIFF-based raw) file."""
+    return read_tiff_at(f, 0)
+
+
+def read_tiff_at(f, base):
+    """Return 'DateTimeOriginal', or 'DateTime', of the TIFF structure
+    starting at `base`. The offsets of the structure are relative to it."""
+    byte_order, tags = read_tiff_header(f, base)
+    if EXIF_IFD_POINTER in tags:
+        exif = read_ifd(f, base, tags[EXIF_IFD_POINTER][1], byte_order)
+        if EXIF_DATE_TIME_ORIGINAL in exif:
+            return read_exif_date(f, base, exif[EXIF_DATE_TIME_ORIGINAL], byte_order)
+    if TIFF_DATE_TIME in tags:
+        return read_exif_date(f, base, tags[TIFF_DATE_TIME], byte_order)
+    return None
+
+
+def read_tiff_header(f, base):
+    """Return the byte order ('<' or '>') and the first IFD of the TIFF
+    structure starting at `base`."""
+    f.seek(base)
+    byte_order = {b'II': '<', b'MM': '>'}.get(f.read(2))
+    if byte_order is None:
+        raise ProbeError("Invalid TIFF header.")
+    magic, ifd = struct.unpack(byte_order + 'HI', f.read(6))
+    if magic != 42:
+        raise ProbeError("Invalid TIFF header.")
+    return byte_order, read_ifd(f, base, ifd, byte_order)
+
+
+def read_ifd(f, base, offset, byte_order):
+    """Return the entries of an IFD as a dict tag -> (count, value_or_offset)."""
+    f.seek(base + offset)
+    count = struct.unpack(byte_order + 'H', f.read(2))[0]
+    data = f.read(12 * count)
+    tags = dict()
+    for i in range(count):
+        tag, _, n, value = struct.unpack(byte_order + 'HHII', data[12 * i:12 * i + 12])
+        tags[tag] = (n, value)
+    return tags
+
+
+def read_exif_date(f, base, entry, byte_order):
+    """Return the timestamp of a 'YYYY:MM:DD HH:MM:SS' ASCII entry."""
+    if entry[0] <= 4:  # too short to be a date
+        return None
+    date, _, time_of_day = read_exif_text(f, base, entry).partition(' ')
+    return parse_date(date, time_of_day)
+
+
+def read_exif_text(f, base, entry):
+    """Return the text of an ASCII entry."""
+    count, offset = entry
+    if count <= 4:  # stored in the entry itself
+        return ""
+    f.seek(base + offset)
+    return f.read(count).split(b'\0')[0].decode('ascii', 'replace').strip()
+
+
+def read_camera_model(file):
+    """Return the camera model stored in the EXIF data of a JPEG or TIFF
+    image, or None.
+
+    Parameters
+    ----------
+    file : string
+        Path of the image.
+    """
+    extension = os.path.splitext(file)[1].lower()
+    if READERS.get(extension) not in [read_jpeg, read_tiff]:
+        return None
+    try:
+        with open(file, 'rb') as f:
+            base = find_jpeg_exif(f) if READERS[extension] == read_jpeg else 0
+            if base is None:
+                return None
+            _, tags = read_tiff_header(f, base)
+            if TIFF_MODEL not in tags:
+                return None
+            return read_exif_text(f, base, tags[TIFF_MODEL]) or None
+    except (ProbeError, struct.error, IndexError, ValueError):
+        return None
+
+
+# MP4 / QuickTime and ASF ========================================================
+
+@register_reader('.mp4', '.m4a', '.m4v', '.m4b', '.m4r', '.f4v', '.f4a', '.f4b', '.mov', '.3gp')
+def read_mp4(f):
+    """Read the creation time of the 'mvhd' atom, which is in UTC."""
+    end = f.seek(0, os.SEEK_END)
+    moov = find_atom(f, [b'moov'], 0, end)
+    if moov is None:
+        raise ProbeError("No 'moov' atom.")
+    return read_mvhd(f, moov[0], moov[0] + moov[1])[0]
+
+
+@register_reader('.wmv', '.wma', '.asf')
+def read_asf(f):
+    """Read the creation date of the File Properties object."""
+    return probe_asf(f).creation_time
+
+
+# Broadcast Wave =================================================================
+
+@register_reader('.wav', '.bwf')
+def read_bwf(f):
+    """Read the origination date and time of the 'bext' chunk."""
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ProbeError("Not a WAVE file.")
+    position = 12
+    while True:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        kind, size = struct.unpack('<4sI', header)
+        if kind == b'bext':
+            f.seek(position + 8 + 320)  # description, originator, originator reference
+            origination = f.read(18).decode('ascii')
+            return parse_date(origination[:10], origination[10:])
+        position += 8 + size + (size & 1)  # chunks are word-aligned
+
+
+# ID3 ============================================================================
+
+# version -> (frame id size, frames of the recording time, in order of preference)
+ID3_DATE_FRAMES = {
+    2: (3, [b'TYE', b'TDA', b'TIM']),
+    3: (4, [b'TYER', b'TDAT', b'TIME']),
+    4: (4, [b'TDRC', b'TDOR']),
+}
+ID3_ENCODINGS = ['latin-1', 'utf-16', 'utf-16-be', 'utf-8']
+
+
+@register_reader('.mp3')
+def read_id3(f):
+    """Read the recording time of the ID3v2 tag at the start of a MP3 file."""
+    header = f.read(10)
+    if header[:3] != b'ID3' or header[3] not in ID3_DATE_FRAMES:
+        return None
+    version = header[3]
+    tag = f.read(syncsafe(header[6:10]))
+    id_size, wanted = ID3_DATE_FRAMES[version]
+    header_size = 6 if version == 2 else 10
+    frames = dict()
+    position = 0
+    while position + header_size <= len(tag):
+        frame = tag[position:position + id_size]
+        if frame[0] == 0:  # padding
+            break
+        if version == 2:
+            size = int.from_bytes(tag[position + 3:position + 6], 'big')
+        elif version == 3:
+            size = struct.unpack('>I', tag[position + 4:position + 8])[0]
+        else:
+            size = syncsafe(tag[position + 4:position + 8])
+        if frame in wanted:
+            data = tag[position + header_size:position + header_size + size]
+            frames[frame] = data[1:].decode(ID3_ENCODINGS[data[0]]).strip('\0')
+        position += header_size + size
+    if version == 4:
+        text = frames.get(b'TDRC') or frames.get(b'TDOR')
+        if text is None or len(text) < 10:  # year or month only
+            return None
+        return parse_date(text[:10], text[11:])
+    year, day_month, hour_minute = (frames.get(frame, "") for frame in wanted)
+    if len(year) != 4 or len(day_month) != 4:
+        return None
+    return parse_date(year + day_month[2:] + day_month[:2], hour_minute)
+
+
+def syncsafe(data):
+    """Return the integer of 4 syncsafe bytes (7 bits per byte)."""
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
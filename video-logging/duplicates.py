@@ -0,0 +1,93 @@
+# encoding: utf-8
+"""Duplicate files detection used by the functions.py module.
+
+Hashing every file of a card dump would read it entirely, so the candidates
+are narrowed in stages, each one cheaper than the next:
+    1. the files are grouped by size, and the unique sizes are dropped;
+    2. the remaining files are grouped by a hash of their first and last
+       PARTIAL_SIZE bytes;
+    3. only the files still colliding are hashed entirely.
+The hashes are computed concurrently by a pool of threads, as reading the
+files is the bottleneck.
+"""
+
+import hashlib
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from videologging.transfer import file_digest
+
+
+# number of bytes hashed at the start and at the end of a file by the second stage
+PARTIAL_SIZE = 1024 * 1024
+
+
+def partial_digest(path, size):
+    """Return the BLAKE2 digest of the first and last PARTIAL_SIZE bytes of a
+    file of `size` bytes."""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_SIZE))
+        if size > PARTIAL_SIZE:
+            f.seek(max(PARTIAL_SIZE, size - PARTIAL_SIZE))
+            digest.update(f.read(PARTIAL_SIZE))
+    return digest.digest()
+
+
+def find_duplicates(entries, root='.', max_workers=None, on_hash=None):
+    """Return the groups of files of a list having the same content.
+
+    Parameters
+    ----------
+    entries : list
+        Entries of the files to compare. Empty files are ignored.
+    root : string
+        Folder of the files.
+    max_workers : int
+        Number of threads used to hash the files.
+    on_hash : function
+        Called with the entry of each file after it is hashed, in the calling
+        thread.
+
+    Returns
+    -------
+    list
+        Groups of entries, sorted by the name of their first file. In each
+        group, the files are sorted from the oldest to the newest, so that the
+        first one can be seen as the original.
+    """
+    by_size = defaultdict(list)
+    for entry in entries:
+        if entry.size > 0:
+            by_size[entry.size].append(entry)
+    candidates = [group for group in by_size.values() if len(group) >= 2]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def split(groups, function):
+            """Split each group by the digest of its files, hashing the files
+            of all the groups concurrently."""
+            futures = [[executor.submit(function, os.path.join(root, entry.name), entry.size) for entry in group]
+                       for group in groups]
+            result = []
+            for group, group_futures in zip(groups, futures):
+                by_digest = defaultdict(list)
+                for entry, future in zip(group, group_futures):
+                    by_digest[future.result()].append(entry)
+                    if on_hash is not None:
+                        on_hash(entry)
+                result.extend(group for group in by_digest.values() if len(group) >= 2)
+            return result
+
+        try:
+            candidates = split(candidates, partial_digest)
+            # the partial digest of a small file is already a digest of all its content
+            small = [group for group in candidates if group[0].size <= 2 * PARTIAL_SIZE]
+            large = [group for group in candidates if group[0].size > 2 * PARTIAL_SIZE]
+            duplicates = small + split(large, lambda path, size: file_digest(path))
+        except BaseException:
+            # the files not hashed yet are dropped, if the job is cancelled for instance
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    duplicates = [sorted(group, key=lambda entry: (entry.mtime_ns, entry.name)) for group in duplicates]
+    return sorted(duplicates, key=lambda group: group[0].name)
@@ -0,0 +1,94 @@
+# encoding: utf-8
+"""Extension index used by the functions.py module.
+
+The EXTENSIONS lists of data.yaml are compiled once into dictionaries, so that
+finding the category of a file is a single lookup instead of a scan of every
+list.
+"""
+
+import os
+
+
+class ExtensionIndex(object):
+    """Precomputed lookup from extensions to categories.
+
+    Parameters
+    ----------
+    extensions : dict
+        Contains the lists of extensions for each type of file.
+    case_sensitive : bool
+        Whether '.MOV' and '.mov' are different extensions.
+
+    Notes
+    -----
+    * If an extension is listed in several categories, `category` returns the
+    first one, but `matches` is true for all of them;
+    * Multi-part extensions such as '.tar.gz' are matched before the last
+    suffix of the name.
+    """
+
+    def __init__(self, extensions, case_sensitive=False):
+        self.extensions = extensions
+        self.case_sensitive = case_sensitive
+        # extension -> first category listing it
+        self.categories = dict()
+        # category -> set of its extensions
+        self.members = dict()
+        for category, category_extensions in extensions.items():
+            normalized = {self.normalize(extension) for extension in category_extensions}
+            self.members[category] = normalized
+            for extension in normalized:
+                self.categories.setdefault(extension, category)
+        # extensions with several dots, longest first
+        self.multi_part = sorted((extension for extension in self.categories if extension.count('.') > 1),
+                                 key=len, reverse=True)
+
+    def __iter__(self):
+        return iter(self.extensions)
+
+    def __contains__(self, category):
+        return category in self.extensions
+
+    def __getitem__(self, category):
+        return self.extensions[category]
+
+    def normalize(self, text):
+        """Return `text` in the case used by the index."""
+        return text if self.case_sensitive else text.lower()
+
+    def extension(self, file):
+        """Return the extension of a file, taking the multi-part extensions of
+        the index into account. The original case is kept.
+
+        Parameters
+        ----------
+        file : string
+            Name of the file.
+        """
+        normalized = self.normalize(file)
+        for suffix in self.multi_part:
+            if normalized.endswith(suffix) and len(normalized) > len(suffix):
+                return file[-len(suffix):]
+        return os.path.splitext(file)[1]
+
+    def category(self, file):
+        """Return the category of a file, or None if its extension is unknown.
+
+        Parameters
+        ----------
+        file : string
+            Name of the file.
+        """
+        return self.categories.get(self.normalize(self.extension(file)))
+
+    def matches(self, file, category):
+        """Return whether the extension of a file belongs to a category.
+
+        Parameters
+        ----------
+        file : string
+            Name of the file.
+        category : string
+            Category, e.g. 'Videos'.
+        """
+        return self.normalize(self.extension(file)) in self.members[category]
@@ -0,0 +1,128 @@
+# encoding: utf-8
+"""Fan-out of an operation over many folders, used by the cli.py script.
+
+Each folder is processed in its own worker process, so that a failure in one
+folder does not stop the others, and the result of each folder is summarized.
+The worker processes are spawned rather than forked: the fan-out may run in a
+job thread while other threads hold locks, which a forked process would
+inherit locked. They therefore get the settings of the CLI from run_operation.
+"""
+
+import glob
+import os
+import time
+import videologging.functions as fun
+
+
+# operations that can be fanned out
+OPERATIONS = ["folder", "trash", "date"]
+
+
+def find_directories(patterns, root='.'):
+    """Return the directories matching some glob patterns, sorted and without
+    duplicates.
+
+    Parameters
+    ----------
+    patterns : list
+        Glob patterns or paths, relative to `root` if they are not absolute.
+    root : string
+        Folder the patterns are relative to.
+    """
+    directories = set()
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(root, os.path.expanduser(pattern))):
+            if os.path.isdir(path):
+                directories.add(os.path.abspath(path))
+    return sorted(directories)
+
+
+def run_operation(root, operation, argument, options):
+    """Run an operation of the functions.py module in a folder and return its
+    summary.
+
+    Parameters
+    ----------
+    root : string
+        Folder to process.
+    operation : string
+        One of OPERATIONS.
+    argument : int or string
+        Time limit of 'trash', type of files of 'date' (or None).
+    options : dict
+        Settings of the CLI: 'extensions', 'sudo', 'trash_folder_name',
+        'max_workers', 'use_cache', 'cache_size', 'capture_dates', 'safety_check_depth',
+        'transfer_workers' and 'verify_transfers'.
+
+    Returns
+    -------
+    dict
+        'folder', 'ok', 'message', 'counts', 'seconds' and 'error' of the run.
+    """
+    # the worker process is spawned, with the default module settings
+    fun.show_progress = False
+    fun.safety_check.depth = options["safety_check_depth"]
+    fun.transfer_settings.workers = options["transfer_workers"]
+    fun.transfer_settings.verify = options["verify_transfers"]
+    summary = {"folder": root, "ok": True, "message": "", "counts": dict(), "error": None}
+    start = time.perf_counter()
+    try:
+        if operation == "folder":
+            result = fun.folder_sort(options["extensions"], options["sudo"], root=root)
+        elif operation == "trash":
+            result = fun.trash_videos(argument, options["extensions"], options["trash_folder_name"], options["sudo"],
+                                      options["max_workers"], options["use_cache"], options["cache_size"], root=root)
+        else:
+            result = fun.sort_by_date(options["extensions"], options["sudo"], argument, options["capture_dates"],
+                                      options["use_cache"], options["cache_size"], root=root)
+        summary["message"] = str(result)
+        summary["counts"] = result.counts
+    except fun.EmptyFolder as e:
+        summary["message"] = str(e)
+    except fun.SudoException:
+        summary["ok"] = False
+        summary["error"] = "The folder contains the 'video-logging' scripts."
+    except Exception as e:
+        summary["ok"] = False
+        summary["error"] = f"{type(e).__name__}: {e}"
+    summary["seconds"] = round(time.perf_counter() - start, 6)
+    return summary
+
+
+def fan_out(directories, operation, argument, options, max_workers=None):
+    """Run an operation in many folders concurrently.
+
+    Parameters
+    ----------
+    directories : list
+        Folders to process.
+    operation : string
+        One of OPERATIONS.
+    argument : int or string
+        Argument of the operation, see run_operation.
+    options : dict
+        Settings of the CLI, see run_operation.
+    max_workers : int
+        Number of worker processes. If None, use the number of CPUs.
+
+    Yields
+    ------
+    dict
+        Summary of each folder, in completion order.
+    """
+    # imported here because multiprocessing is slow to import and rarely needed
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(run_operation, directory, operation, argument, options): directory
+                   for directory in directories}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:  # the worker process died
+                    yield {"folder": futures[future], "ok": False, "message": "", "counts": dict(),
+                           "error": f"{type(e).__name__}: {e}", "seconds": None}
+        finally:
+            # the folders not started yet are dropped if the caller stops early (cancelled job)
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,175 @@
+# encoding: utf-8
+"""Sampled-frame fingerprints of videos, used by the functions.py module.
+
+A few frames evenly spread over each clip are decoded with moviepy and
+reduced to cheap statistics: mean luma, luma variance and a 64-bit difference
+hash (dHash) of the frame. They are enough to flag the failed takes that a
+duration threshold misses:
+    - near-black clips (lens cap on), whose frames are all dark;
+    - near-uniform clips (pointing at the floor or the sky), whose frames all
+      have a low variance;
+    - near-identical clips, whose frames have close hashes.
+Decoding is slow, so the frames are sampled by a pool of processes and the
+fingerprints are stored in the metadata cache: changing the thresholds does
+not decode anything again.
+"""
+
+from collections import namedtuple
+
+
+Fingerprint = namedtuple("Fingerprint", ["lumas", "variances", "hashes"])
+Fingerprint.__doc__ = """Statistics of the sampled frames of a video, one value per frame.
+
+lumas : list
+    Mean luma of the frames, between 0 and 255.
+variances : list
+    Variance of the luma of the frames.
+hashes : list
+    64-bit difference hash of the frames.
+"""
+
+
+class DetectionSettings(object):
+    """Settings of the detection of failed takes.
+
+    Parameters
+    ----------
+    frames : int
+        Number of frames sampled per video.
+    black_level : float
+        Maximum mean luma (0-255) of the frames of a near-black video.
+    uniform_level : float
+        Maximum luma variance of the frames of a near-uniform video.
+    similarity : float
+        Maximum number of different bits of the frame hashes, on average, of
+        two near-identical videos.
+    """
+
+    def __init__(self, frames=5, black_level=16, uniform_level=20, similarity=5):
+        self.frames = frames
+        self.black_level = black_level
+        self.uniform_level = uniform_level
+        self.similarity = similarity
+
+
+# weights of the red, green and blue channels in the luma (ITU-R BT.601)
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+# the difference hash compares HASH_SIZE + 1 columns on HASH_SIZE rows
+HASH_SIZE = 8
+
+
+def fingerprint(file, frames=5):
+    """Return the Fingerprint of a video, or None if it cannot be decoded.
+
+    Parameters
+    ----------
+    file : string
+        Path of the video.
+    frames : int
+        Number of frames sampled, evenly spread over the video.
+    """
+    # imported here because they are slow to import and only needed by this mode
+    import numpy as np
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    try:
+        with VideoFileClip(file, audio=False) as clip:
+            times = [(i + 0.5) * clip.duration / frames for i in range(frames)]
+            lumas, variances, hashes = [], [], []
+            for t in times:
+                luma = clip.get_frame(t)[:, :, :3] @ np.array(LUMA_WEIGHTS)
+                lumas.append(float(luma.mean()))
+                variances.append(float(luma.var()))
+                hashes.append(difference_hash(luma))
+    except Exception:  # moviepy and ffmpeg raise all kinds of errors on broken files
+        return None
+    return Fingerprint(lumas, variances, hashes)
+
+
+def difference_hash(luma):
+    """Return the 64-bit difference hash of a luma frame.
+
+    The frame is reduced to HASH_SIZE x (HASH_SIZE + 1) blocks by averaging,
+    and each bit tells whether a block is brighter than its left neighbour.
+    """
+    import numpy as np
+    rows, columns = HASH_SIZE, HASH_SIZE + 1
+    height, width = luma.shape
+    if height < rows or width < columns:
+        raise ValueError("Frame too small.")
+    height, width = height - height % rows, width - width % columns
+    blocks = luma[:height, :width].reshape(rows, height // rows, columns, width // columns).mean(axis=(1, 3))
+    bits = blocks[:, 1:] > blocks[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def fingerprint_files(paths, frames=5, max_workers=None):
+    """Yield (path, Fingerprint) for videos, sampled by a pool of processes,
+    in the order of `paths`.
+
+    Parameters
+    ----------
+    paths : list
+        Paths of the videos.
+    frames : int
+        Number of frames sampled per video.
+    max_workers : int
+        Number of processes. If None, use the number of CPUs.
+    """
+    # imported here because multiprocessing is slow to import and rarely needed
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            yield from zip(paths, executor.map(fingerprint, paths, [frames] * len(paths)))
+        finally:
+            # the videos not sampled yet are dropped if the caller stops early
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_shooting_errors(fingerprints, black_level=16, uniform_level=20, similarity=5):
+    """Return the videos that look like failed takes.
+
+    Parameters
+    ----------
+    fingerprints : dict
+        Fingerprint of each video, indexed by name. The videos are compared in
+        the order of the dict, and a near-identical video is flagged only if
+        an earlier one is kept.
+    black_level : float
+        Maximum mean luma (0-255) of the frames of a near-black video.
+    uniform_level : float
+        Maximum luma variance of the frames of a near-uniform video.
+    similarity : float
+        Maximum number of different bits, on average over the frames, between
+        the hashes of two near-identical videos.
+
+    Returns
+    -------
+    dict
+        Reason ('black', 'uniform' or 'similar') of each flagged video,
+        indexed by name.
+    """
+    import numpy as np
+    flagged = dict()
+    kept = []
+    for name, fingerprint in fingerprints.items():
+        if max(fingerprint.lumas) <= black_level:
+            flagged[name] = "black"
+        elif max(fingerprint.variances) <= uniform_level:
+            flagged[name] = "uniform"
+        else:
+            kept.append(name)
+
+    # compare the hashes of each video to those of all the following ones at once
+    frames = min((len(fingerprints[name].hashes) for name in kept), default=0)
+    hashes = np.array([fingerprints[name].hashes[:frames] for name in kept], dtype=np.uint64)
+    duplicate = np.zeros(len(kept), dtype=bool)
+    for i in range(len(kept) - 1):
+        if duplicate[i]:
+            continue
+        different = np.unpackbits((hashes[i + 1:] ^ hashes[i]).view(np.uint8), axis=-1)
+        distances = different.reshape(len(kept) - i - 1, -1).sum(axis=1) / max(frames, 1)
+        duplicate[i + 1:] |= distances <= similarity
+    for name, is_duplicate in zip(kept, duplicate):
+        if is_duplicate:
+            flagged[name] = "similar"
+    return flagged
@@ -0,0 +1,233 @@
+# encoding: utf-8
+"""Storage footprint of a tree, used by the functions.py module.
+
+The number of files and of bytes of each type of file are counted from a
+single listing of the tree. The durations of the videos, which must be
+probed, are gathered in a DurationSample: either all the videos are probed,
+or, to stay within a time budget on very large trees, a uniform random
+sample of them. The totals of all the videos (duration histogram, impact of
+'trash N') are then estimated from the sample, with 95% margins of error.
+When the time budget does not even allow listing the whole tree, the listing
+stops too, and the counts are extrapolated from the fraction of the tree
+listed, estimated by a TreeCoverage.
+"""
+
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# upper bounds of the classes of the duration histogram, in seconds
+DURATION_BINS = [1, 2, 5, 10, 30, 60, 300, 900, 3600]
+# z-score of the margins of error
+Z_95 = 1.96
+
+
+class Footprint(object):
+    """Number of files and of bytes of each type of file of a tree."""
+
+    def __init__(self):
+        # category -> [files, bytes], in the order they are met
+        self.categories = dict()
+        self.folders = 0
+
+    def add(self, category, size):
+        """Count a file of `size` bytes."""
+        total = self.categories.setdefault(category, [0, 0])
+        total[0] += 1
+        total[1] += size
+
+    def files(self):
+        return sum(files for files, _ in self.categories.values())
+
+    def bytes(self):
+        return sum(size for _, size in self.categories.values())
+
+    def extrapolate(self, coverage):
+        """Scale the counts of the part of a tree listed to the whole tree,
+        `coverage` being the fraction of the tree listed."""
+        for total in self.categories.values():
+            total[0] = round(total[0] / coverage)
+            total[1] = round(total[1] / coverage)
+        self.folders = round(self.folders / coverage)
+
+
+class TreeCoverage(object):
+    """Estimated fraction of a tree listed by a depth-first walk.
+
+    The root weighs 1, and the weight of each folder is shared equally
+    between its own files and each of its subfolders, as if the subtrees of a
+    folder had the same size. The fraction listed is the sum of the weights of
+    the files of the folders visited.
+    """
+
+    def __init__(self):
+        # weight of each folder not visited yet, by path relative to the root
+        self.weights = {'': 1.}
+        self.fraction = 0.
+
+    def visit(self, relative, entries):
+        """Account for a folder of the walk, of Snapshot `entries`."""
+        weight = self.weights.pop(relative, 0.)
+        # the walk does not follow the symbolic links to folders
+        subdirectories = [entry.name for entry in entries if entry.kind == 'dir'
+                          and not os.path.islink(os.path.join(entries.path, entry.name))]
+        has_files = any(entry.kind == 'file' for entry in entries)
+        shares = len(subdirectories) + has_files
+        if shares == 0:
+            self.fraction += weight
+            return
+        if has_files:
+            self.fraction += weight / shares
+        for name in subdirectories:
+            self.weights[os.path.join(relative, name)] = weight / shares
+
+
+class DurationSample(object):
+    """Durations of a uniform random sample (or of all) of the videos of a
+    tree, to estimate the totals of all of them.
+
+    Parameters
+    ----------
+    population : int
+        Number of videos of the tree.
+    """
+
+    def __init__(self, population):
+        self.population = population
+        # duration, size and whether it is out of the trash folders, of each probed video
+        self.durations = []
+        self.sizes = []
+        self.trashable = []
+        # number of probed videos whose duration could not be read
+        self.failed = 0
+
+    def add(self, duration, size, trashable=True):
+        """Add a probed video. `duration` is None if it could not be read."""
+        if duration is None:
+            self.failed += 1
+            return
+        self.durations.append(duration)
+        self.sizes.append(size)
+        self.trashable.append(trashable)
+
+    def __len__(self):
+        return len(self.durations) + self.failed
+
+    @property
+    def exact(self):
+        """Whether all the videos were probed."""
+        return len(self) >= self.population
+
+    def estimate(self, values):
+        """Return the estimated total of a value over all the videos, and its
+        margin of error, from its values on the probed videos.
+
+        Parameters
+        ----------
+        values : list
+            Value of each probed video, 0 for those that could not be read.
+        """
+        n = len(self)
+        if n == 0:
+            return 0, 0
+        total = sum(values) * self.population / n
+        if self.exact or n < 2:
+            return total, 0
+        mean = sum(values) / n
+        variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+        # finite population correction, as the videos are drawn without replacement
+        margin = Z_95 * self.population * math.sqrt(variance / n * (1 - n / self.population))
+        return total, margin
+
+    def padded(self, values):
+        """Return values of the read videos, followed by a 0 for each video
+        that could not be read."""
+        return values + [0] * self.failed
+
+    def histogram(self):
+        """Return the estimated number and bytes of the videos of each class
+        of DURATION_BINS, as (lower bound, upper bound, files, bytes). The
+        upper bound of the last class is None."""
+        bounds = [0] + DURATION_BINS + [None]
+        classes = []
+        for lower, upper in zip(bounds[:-1], bounds[1:]):
+            inside = [lower <= duration and (upper is None or duration < upper) for duration in self.durations]
+            files, _ = self.estimate(self.padded([int(flag) for flag in inside]))
+            size, _ = self.estimate(self.padded([size if flag else 0 for size, flag in zip(self.sizes, inside)]))
+            classes.append((lower, upper, files, size))
+        return classes
+
+    def trash_impact(self, time_limit):
+        """Return the estimated number and bytes of the videos 'trash
+        time_limit' would trash, with their margins of error, as
+        ((files, margin), (bytes, margin)). The videos already in a trash
+        folder are left out."""
+        short = [duration < time_limit and trashable for duration, trashable in zip(self.durations, self.trashable)]
+        files = self.estimate(self.padded([int(flag) for flag in short]))
+        size = self.estimate(self.padded([size if flag else 0 for size, flag in zip(self.sizes, short)]))
+        return files, size
+
+    def total_duration(self):
+        """Return the estimated total duration of the videos, in seconds, and
+        its margin of error."""
+        return self.estimate(self.padded(list(self.durations)))
+
+
+def sample_durations(videos, probe, bar, max_workers=None, budget=None, seed=None, population=None):
+    """Probe the videos of a list in a random order, until all of them are
+    probed or the time budget is spent, and return their DurationSample.
+
+    Parameters
+    ----------
+    videos : list
+        (path, size, whether it is out of the trash folders) of the videos.
+    probe : function
+        Returns the MediaInfo of a path.
+    bar : IncrementalBar
+        Progress bar, advanced once per probed video.
+    max_workers : int
+        Number of threads probing the videos.
+    budget : float
+        Number of seconds after which no video is probed anymore. If None,
+        all the videos are probed.
+    seed : int
+        Seed of the random order, for reproducible estimates.
+    population : int
+        Number of videos of the tree, if `videos` are only those of the part
+        of the tree listed. Equal to len(videos) by default.
+    """
+    sample = DurationSample(len(videos) if population is None else population)
+    order = list(range(len(videos)))
+    random.Random(seed).shuffle(order)
+    deadline = None if budget is None else time.monotonic() + budget
+
+    def read_duration(index):
+        try:
+            return probe(videos[index][0]).duration
+        except Exception:
+            return None
+
+    # default of ThreadPoolExecutor
+    workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # only a few probes per thread are submitted at once, so that the budget is not exceeded by much
+        in_flight = set()
+        position = 0
+        while position < len(order) or in_flight:
+            while position < len(order) and len(in_flight) < 4 * workers \
+                    and (deadline is None or time.monotonic() < deadline):
+                future = executor.submit(read_duration, order[position])
+                future.index = order[position]
+                in_flight.add(future)
+                position += 1
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                _, size, trashable = videos[future.index]
+                sample.add(future.result(), size, trashable)
+                bar.next()
+    return sample
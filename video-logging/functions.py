@@ -6,39 +6,76 @@ video logging process.
 """
 
 import os
-import platform
+import re
 import time
-from moviepy.video.io.VideoFileClip import VideoFileClip
 from progress.bar import IncrementalBar
-from subprocess import Popen
-from psutil import Process
+from progress.counter import Counter
+from videologging.instrument import recorder
+from videologging.jobs import JobBar, JobCancelled, cancel_event, current_job
+from videologging.fingerprint import DetectionSettings
+from videologging.safety import SafetyCheck
+from videologging.pipeline import Pipeline
+from videologging.preview import PreviewSettings
+from videologging.templates import TemplateError
+from videologging.transfer import TransferSettings
+from videologging.watch import WatchSettings
+import videologging.scan as scan
+# the modules of the features (probing, moves, caches...) are imported by the
+# functions that use them, so that starting the tool stays fast
 
 
-def folder_sort(extensions, sudo):
+# memoized check for the '.videolog' marker, configured by the CLI
+safety_check = SafetyCheck()
+# settings of the moves across file systems, configured by the CLI
+transfer_settings = TransferSettings()
+# settings of the detection of failed takes by 'trash errors'
+detection_settings = DetectionSettings()
+# settings of the preview of the files by 'rename'
+preview_settings = PreviewSettings()
+# settings of the 'watch' command
+watch_settings = WatchSettings()
+# whether or not progress bars are displayed
+show_progress = True
+# names of the folders created by the 'date' command
+DATE_FOLDER_PATTERN = re.compile(r"^\d{6}-\w+$")
+
+
+def folder_sort(extensions, sudo, root='.'):
     """Sort the files into directories according to their extension.
     Create the extensions directories if they don't exist.
 
     Parameters
     ----------
-    extensions : dict
-        Contains the lists of extensions for each type of file.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
     sudo : bool
         Whether sudo mode is activated or not.
+    root : string
+        Folder to work in. Equal to cwd by default.
     """
-    check_parent(sudo)
-    n = get_number_files(extensions)
+    from videologging.catalog import DIR, catalog
+    from videologging.moves import MovePlan
+    check_parent(sudo, root)
+    entries = catalog(root, extensions)
+    n = get_number_files(extensions, entries=entries)
     if n == 0:
         raise EmptyFolder("Nothing to do here, this folder is empty.")
-    bar = IncrementalBar("Sorting files...", max=n)
-
-    for file in os.listdir():
-        move_to_dir(file, get_folder_from_extension(file, extensions))
-        bar.next()
-    bar.finish()
-    return "Files sorted by type."
+    plan = MovePlan(root)
+    # the type of the files is looked up once per extension
+    destinations = entries.categories(entries.select(directories=True))
+    kinds = entries.kinds.tolist()
+    sizes = entries.sizes.tolist()
+    for index, directory in enumerate(destinations):
+        name = entries.name(index)
+        if kinds[index] == DIR:
+            directory = get_folder_from_extension(name, extensions, True)
+        if directory is not None:
+            plan.add(name, directory, sizes[index])
+    execute_plan(plan, "folder", "Sorting files...")
+    return Result("Files sorted by type.", files=n, moved=len(plan))
 
 
-def trash_videos(time_limit, extensions, trash_folder_name, sudo):
+def trash_videos(time_limit, extensions, trash_folder_name, sudo, max_workers=None, use_cache=True, cache_size=None, root='.'):
     """Trash the videos that are shorter than time_limit to get rid of
     the shooting errors.
 
@@ -47,147 +84,780 @@ def trash_videos(time_limit, extensions, trash_folder_name, sudo):
     time_limit : int
         Duration limit. If a video has a duration smaller than time_limit, it is
         moved into trash_folder_name.
-    extensions : dict
-        Contains the lists of extensions for each type of file.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
     trash_folder_name : string
         Name of the folder where to put the trashed videos. Equal to 'Trash' by
         default but can be change in the video-logging/data.yaml file.
     sudo : bool
         Whether sudo mode is activated or not.
+    max_workers : int
+        Number of threads used to probe the videos. If None, use the default
+        of ThreadPoolExecutor.
+    use_cache : bool
+        Whether to read and store the durations in the metadata cache of the
+        folder.
+    cache_size : int
+        Maximum number of entries of the metadata cache. If None, it is not
+        bounded.
+    root : string
+        Folder to work in. Equal to cwd by default.
+
+    Notes
+    -----
+    The durations are probed concurrently, then the videos are moved
+    sequentially in directory order so that the outcome is deterministic.
     """
-    def move_to_trash(file, duration, trash_folder_name):
-        """Move a video to trash if it is too short.
-
-        Check if a directory named trash_folder_name exists in current directory.
-        If not, create it. Then, move `file` in trash_folder_name if `duration`
-        is smaller than `time_limit`.
-
-        Parameters
-        ----------
-        file : string
-            File to check.
-        duration : int
-            Duration of video file.
-        trash_folder_name : string
-            Name of the folder where to put the trashed videos. Equal to 'Trash'
-            by default but can be change in the video-logging/data.yaml file.
-        """
-        if duration < time_limit:
-            if os.path.exists(trash_folder_name):  # if 'trash_folder_name' already exists
-                if os.path.isfile(trash_folder_name):  # if 'trash_folder_name' is a regular file
-                    raise BadFolderName(f"You have a file named '{trash_folder_name}' in the current working directory, which is not a valid file name because this tool uses it as a directory name. You may consider changing the 'trash_folder_name' default in 'data.yaml'.")
-                else:  # if 'trash_folder_name' is a directory
-                    pass
-            else:  # if 'trash_folder_name' does not exist
-                os.mkdir(f'./{trash_folder_name}')
-
-            os.rename(file, os.path.join(trash_folder_name, file))
-            return True
-        return False
-
-    check_parent(sudo)
-    n = get_number_files(extensions, directory='Videos')
+    from videologging.cache import MetadataCache
+    from videologging.catalog import catalog
+    from videologging.moves import MovePlan
+    check_parent(sudo, root)
+    entries = catalog(root, extensions)
+    n = get_number_files(extensions, directory='Videos', ignore_folders=True, entries=entries)
     if n == 0:
         raise EmptyFolder("Nothing to do here, this folder does not countain any video.")
 
-    bar = IncrementalBar(f"Trashing videos of duration <= {time_limit}s...", max=n)
-    nb_trashed = 0
-    for file in os.listdir():
-        extension = os.path.splitext(file)[1]
-        if extension in extensions['Videos']:
-            with VideoFileClip(file) as clip:
-                # we need to wait a little so that bad things do not happen
-                time.sleep(.001)
-                duration = clip.duration
-            is_moved = move_to_trash(file, duration, trash_folder_name)  # warning: side effect happening here
-            if is_moved:
-                nb_trashed += 1
+    indices = entries.select('Videos', files_only=True)
+    videos = entries.entries(indices)
+    bar = progress_bar(f"Trashing videos of duration <= {time_limit}s...", n)
+    if use_cache:
+        with MetadataCache(root, cache_size) as cache:
+            infos = probe_files(videos, bar, max_workers, cache, root)
+    else:
+        infos = probe_files(videos, bar, max_workers, root=root)
+    bar.finish()
+
+    plan = MovePlan(root)
+    durations = [infos[entry.name].duration for entry in videos]
+    for index in entries.shorter_than(indices, durations, time_limit).tolist():
+        plan.add(entries.name(index), trash_folder_name, int(entries.sizes[index]))
+    execute_plan(plan, "trash", hint="'trash_folder_name'")
+    nb_trashed = len(plan)
+
+    term = "s" if nb_trashed >= 2 else ""
+    return Result(f"{nb_trashed} video{term} trashed.", videos=n, trashed=nb_trashed)
+
+
+def trash_shooting_errors(extensions, trash_folder_name, sudo, max_workers=None, use_cache=True, cache_size=None,
+                          trash_similar=False, root='.'):
+    """Put the failed takes of the current directory in the trash folder.
+
+    A few frames of each video are sampled, and the near-black and
+    near-uniform videos are trashed, as set by `detection_settings`. The
+    near-identical videos are only reported, unless `trash_similar` is True:
+    two takes of the same shot can look alike and yet both be wanted. Of
+    near-identical videos, the oldest one is kept.
+
+    Parameters
+    ----------
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    trash_folder_name : string
+        Name of the trash folder.
+    sudo : bool
+        Whether sudo mode is activated or not.
+    max_workers : int
+        Number of processes used to sample the frames. If None, use the
+        number of CPUs.
+    use_cache : bool
+        Whether to read and store the fingerprints in the metadata cache of
+        the folder.
+    cache_size : int
+        Maximum number of entries of the metadata cache. If None, it is not
+        bounded.
+    trash_similar : bool
+        Whether to trash the near-identical videos too.
+    root : string
+        Folder to work in. Equal to cwd by default.
+    """
+    from videologging.cache import MetadataCache
+    from videologging.fingerprint import find_shooting_errors
+    from videologging.moves import MovePlan
+    check_parent(sudo, root)
+    entries = scan.snapshot(root)
+    videos = [entry for entry in entries.files() if extensions.matches(entry.name, 'Videos')]
+    if not videos:
+        raise EmptyFolder("Nothing to do here, this folder does not countain any video.")
+    videos.sort(key=lambda entry: (entry.mtime_ns, entry.name))
+
+    bar = progress_bar("Sampling frames...", len(videos))
+    if use_cache:
+        with MetadataCache(root, cache_size) as cache:
+            fingerprints = get_fingerprints(videos, bar, max_workers, cache, root)
+    else:
+        fingerprints = get_fingerprints(videos, bar, max_workers, root=root)
+    bar.finish()
+    flagged = find_shooting_errors(fingerprints, detection_settings.black_level,
+                                   detection_settings.uniform_level, detection_settings.similarity)
+
+    plan = MovePlan(root)
+    similar = []
+    for entry in videos:
+        if flagged.get(entry.name) == "similar" and not trash_similar:
+            similar.append(entry.name)
+        elif entry.name in flagged:
+            plan.add(entry.name, trash_folder_name, entry.size)
+    execute_plan(plan, "trash", hint="'trash_folder_name'")
+    nb_trashed = len(plan)
+
+    reasons = {reason: sum(1 for value in flagged.values() if value == reason)
+               for reason in ["black", "uniform", "similar"]}
+    term = "s" if nb_trashed >= 2 else ""
+    message = f"{nb_trashed} video{term} trashed ({reasons['black']} black, {reasons['uniform']} uniform"
+    if trash_similar:
+        message += f", {reasons['similar']} near-identical)."
+    else:
+        message += ")."
+        if similar:
+            term = "s" if len(similar) >= 2 else ""
+            message += (f" {len(similar)} near-identical video{term} kept, use 'trash errors similar' to trash "
+                        f"{'them' if term else 'it'}: {', '.join(similar)}.")
+    return Result(message, videos=len(videos), trashed=nb_trashed, undecodable=len(videos) - len(fingerprints),
+                  **reasons)
+
+
+def get_fingerprints(entries, bar, max_workers=None, cache=None, root='.'):
+    """Return the Fingerprint of each video of a list that can be decoded, as
+    a dict indexed by name, in the order of the list.
+
+    The videos missing from `cache` are sampled by a pool of processes and
+    stored in it. `bar` is advanced once per video.
+    """
+    from videologging.fingerprint import fingerprint_files
+    fingerprints = dict()
+    to_sample = []
+    for entry in entries:
+        fingerprint = None
+        if cache is not None:
+            fingerprint = cache.lookup_fingerprint(entry.name, cache_key(entry), detection_settings.frames)
+        if fingerprint is not None:
             bar.next()
+        else:
+            to_sample.append(entry)
+        fingerprints[entry.name] = fingerprint
+
+    recorder.count("videos sampled", len(to_sample))
+
+    paths = [os.path.join(root, entry.name) for entry in to_sample]
+    with recorder.phase("sampling"):
+        for entry, (_, fingerprint) in zip(to_sample, fingerprint_files(paths, detection_settings.frames,
+                                                                        max_workers)):
+            fingerprints[entry.name] = fingerprint
+            if cache is not None and fingerprint is not None:
+                cache.store_fingerprint(entry.name, cache_key(entry), fingerprint)
+            bar.next()
+    return {name: fingerprint for name, fingerprint in fingerprints.items() if fingerprint is not None}
+
 
+def trash_duplicates(extensions, trash_folder_name, sudo, directory=None, max_workers=None, root='.'):
+    """Put the files of the current directory having the same content as
+    another one in the trash folder.
+
+    In each group of identical files, the oldest one is kept.
+
+    Parameters
+    ----------
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    trash_folder_name : string
+        Name of the trash folder.
+    sudo : bool
+        Whether sudo mode is activated or not.
+    directory : string
+        Type of files to compare. If None, all the files are compared.
+    max_workers : int
+        Number of threads used to hash the files.
+    root : string
+        Folder to work in. Equal to cwd by default.
+    """
+    from videologging.duplicates import find_duplicates
+    from videologging.moves import MovePlan
+    check_parent(sudo, root)
+    entries = scan.snapshot(root)
+    files = [entry for entry in entries.files() if not directory or extensions.matches(entry.name, directory)]
+    if not files:
+        if directory is not None:
+            raise EmptyFolder(f"Nothing to do here, this folder does not contain any element of the type '{directory}'.")
+        raise EmptyFolder("Nothing to do here, this folder is empty.")
+
+    bar = progress_bar("Looking for duplicates...", None)
+    with recorder.phase("hashing"):
+        groups = find_duplicates(files, root, max_workers, on_hash=lambda entry: bar.next())
+    recorder.count("files compared", len(files))
     bar.finish()
+
+    plan = MovePlan(root)
+    # names given to the duplicates in the trash folder
+    taken = set()
+    for group in groups:
+        for entry in group[1:]:
+            plan.add(entry.name, trash_folder_name, entry.size,
+                     unique_name(os.path.join(root, trash_folder_name), entry.name, taken))
+    reclaimed = plan.total_size()
+    execute_plan(plan, "dedupe", hint="'trash_folder_name'")
+    nb_trashed = len(plan)
+
     term = "s" if nb_trashed >= 2 else ""
-    return f"{nb_trashed} video{term} trashed."
+    return Result(f"{nb_trashed} duplicate{term} trashed, {format_size(reclaimed)} reclaimed.",
+                  files=len(files), duplicates=nb_trashed, reclaimed=reclaimed)
 
 
-def sort_by_date(extensions, sudo, directory=None):
+def sort_by_date(extensions, sudo, directory=None, use_metadata=True, use_cache=True, cache_size=None, root='.'):
     """Sort files in directories by creation date.
 
     Repositories will be in the form of 'YYMMDD-Day'.
 
     Parameters
     ----------
-    extensions : dict
-        Contains the lists of extensions for each type of file.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
     sudo : bool
         Whether sudo mode is activated or not.
     directory : string
         Type of files to move. If None, all the files are moved.
+    use_metadata : bool
+        Whether to date the files by the capture time stored in them (EXIF,
+        MP4 creation time...) when they have one. Otherwise, or if they have
+        none, the files are dated by their modification time.
+    use_cache : bool
+        Whether to read and store the capture times in the metadata cache of
+        the folder.
+    cache_size : int
+        Maximum number of entries of the metadata cache. If None, it is not
+        bounded.
+    root : string
+        Folder to work in. Equal to cwd by default.
     """
-    check_parent(sudo)
-    n = get_number_files(extensions, directory)
+    from videologging.catalog import catalog
+    from videologging.moves import MovePlan
+    check_parent(sudo, root)
+    entries = catalog(root, extensions)
+    n = get_number_files(extensions, directory, ignore_folders=True, entries=entries)
     if n == 0:  # i.e. no file match the request
         if directory is not None:
             raise EmptyFolder(f"Nothing to do here, this folder does not contain any element of the type '{directory}'.")
         else:
             raise EmptyFolder("Nothing to do here, this folder is empty.")
 
-    bar = IncrementalBar(f"Sorting files by date...", max=n)
-    for file in os.listdir():
-        extension = os.path.splitext(file)[1]
-        if not directory or extension in extensions[directory]:
-            if not os.path.isdir(file):
-                creation = time.localtime(os.path.getmtime(file))
-                destination_directory = time.strftime('%y%m%d-%a', creation)
-                move_to_dir(file, destination_directory)
+    indices = entries.select(directory or None)
+    # read from the columns, without building the entries, and only if the files have to be read
+    dates = get_capture_times(entries.cache_keys(indices), use_metadata, use_cache, cache_size, root)
+    plan = MovePlan(root)
+    for index, folder, size in zip(indices.tolist(), entries.day_folders(indices, dates), entries.sizes[indices].tolist()):
+        plan.add(entries.name(index), folder, size)
+    execute_plan(plan, "date", "Sorting files by date...")
+    return Result(f"Files sorted by date ({len(dates)} dated by their metadata).", files=n, moved=len(plan), dated=len(dates))
 
-                bar.next()
 
+def tree_sort(command, extensions, sudo, trash_folder_name, directory=None, flatten=False,
+              use_metadata=True, use_cache=True, cache_size=None, root='.'):
+    """Sort the files of a whole tree by type or by date.
+
+    The tree is walked one folder at a time, and the files of each folder are
+    moved before the next folder is listed, so that the memory used does not
+    depend on the size of the tree. The folders created by this tool (type
+    folders, 'YYMMDD-Day' folders and trash folder) are not visited, nor the
+    folders holding the '.videolog' marker of the scripts of this tool: the
+    walk goes deeper than `check_parent`, so they are pruned even in sudo
+    mode.
+
+    Parameters
+    ----------
+    command : string
+        'folder' to sort by type, 'date' to sort by date.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    sudo : bool
+        Whether sudo mode is activated or not.
+    trash_folder_name : string
+        Name of the trash folder, which is not visited.
+    directory : string
+        Type of files to move. If None, all the files are moved.
+    flatten : bool
+        If True, the files are moved into the folders of `root`. Otherwise,
+        into the folders of the folder they are in. When flattening, a file
+        whose name is already taken is renamed 'name_1.ext', 'name_2.ext'...
+    use_metadata, use_cache, cache_size
+        How the files are dated by 'date', see sort_by_date. Each folder has its
+        own metadata cache.
+    root : string
+        Root of the tree. Equal to cwd by default.
+    """
+    from videologging.moves import MovePlan
+    from videologging.pipeline import date_folder_name
+    from videologging.safety import has_marker
+    check_parent(sudo, root)
+
+    def is_skipped(dir_entry):
+        name = dir_entry.name
+        return name in extensions or name == trash_folder_name or DATE_FOLDER_PATTERN.match(name) is not None \
+            or has_marker(dir_entry.path)
+
+    bar = progress_bar("Sorting files...", None)
+    n = moved = folders = dated = 0
+    run = None
+    for relative, entries in scan.walk(root, is_skipped):
+        folders += 1
+        plan = MovePlan(root)
+        # names given to the files of this folder, when flattening
+        taken = set()
+        files = [entry for entry in entries.files()
+                 if directory is None or extensions.matches(entry.name, directory)]
+        dates = dict()
+        if command == "date" and files:
+            dates = get_capture_times(keyed(files), use_metadata, use_cache, cache_size, entries.path)
+            dated += len(dates)
+        for entry in files:
+            n += 1
+            if command == "folder":
+                destination_directory = get_folder_from_extension(entry.name, extensions, False)
+            else:
+                destination_directory = date_folder_name(dates.get(entry.name, entry.mtime))
+            if flatten:
+                name = unique_name(os.path.join(root, destination_directory), entry.name, taken)
+            else:
+                destination_directory = os.path.join(relative, destination_directory)
+                name = None
+            plan.add(os.path.join(relative, entry.name), destination_directory, entry.size, name)
+        check_destinations(plan)
+        run = plan.execute(command, on_move=lambda source, destination: bar.next(),
+                           settings=transfer_settings, run=run)
+        moved += len(plan)
     bar.finish()
-    return f"Files sorted by date."
+    if n == 0:
+        if directory is not None:
+            raise EmptyFolder(f"Nothing to do here, this tree does not contain any element of the type '{directory}'.")
+        raise EmptyFolder("Nothing to do here, this tree does not contain any file.")
+    term = "s" if folders >= 2 else ""
+    if command == "folder":
+        return Result(f"Files of {folders} folder{term} sorted by type.", files=n, moved=moved, folders=folders)
+    return Result(f"Files of {folders} folder{term} sorted by date ({dated} dated by their metadata).",
+                  files=n, moved=moved, folders=folders, dated=dated)
+
+
+def folder_footprint(extensions, trash_folder_name, time_limit=None, approximate=False, budget=10.,
+                     max_workers=None, use_cache=True, root='.'):
+    """Return a report of the number of files and of bytes of each type of
+    file of a tree, of the durations of its videos, and of what
+    'trash time_limit' would trash. Nothing is moved.
+
+    The tree is listed once, which gives the exact counts and sizes. The
+    durations of the videos must be probed: in approximate mode, only a random
+    sample of them is probed within `budget` seconds, and the duration
+    histogram and the impact of 'trash' are estimated from it, with their 95%
+    margins of error. The listing itself may take at most half of the budget:
+    past it, the listing stops and the counts are extrapolated from the part
+    of the tree listed.
 
+    Parameters
+    ----------
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    trash_folder_name : string
+        Name of the trash folders. The videos already in one are left out of
+        the impact of 'trash'.
+    time_limit : int
+        Duration limit of 'trash' whose impact is estimated. If None, it is
+        not estimated.
+    approximate : bool
+        Whether to probe a random sample of the videos only.
+    budget : float
+        Number of seconds spent listing the tree and probing videos in
+        approximate mode.
+    max_workers : int
+        Number of threads used to probe the videos.
+    use_cache : bool
+        Whether to read the durations from the existing metadata cache of
+        each folder. The caches are neither created nor updated. Not used in
+        approximate mode.
+    root : string
+        Root of the tree. Equal to cwd by default.
+    """
+    from videologging.cache import MetadataCache
+    from videologging.footprint import DurationSample, Footprint, TreeCoverage, sample_durations
+    from videologging.probe import probe
+    deadline = time.monotonic() + budget
+    footprint = Footprint()
+    coverage = TreeCoverage()
+    complete = True
+    # (path relative to root, size, whether it is out of the trash folders) of each video
+    videos = []
+    # (folder, videos) of each folder holding videos, probed once the tree is listed in exact mode
+    folders = []
+    bar = progress_bar("Listing files...", None)
+    for relative, entries in scan.walk(root):
+        if approximate and footprint.files() and time.monotonic() > deadline - budget / 2:
+            # the rest of the budget is kept to probe videos
+            complete = False
+            break
+        if approximate:
+            coverage.visit(relative, entries)
+        footprint.folders += 1
+        trashable = trash_folder_name not in relative.split(os.sep)
+        files = entries.files()
+        folder_videos = []
+        for entry in files:
+            category = extensions.category(entry.name)
+            footprint.add(category if category is not None else 'Other', entry.size)
+            if category == 'Videos':
+                folder_videos.append(entry)
+                videos.append((os.path.join(relative, entry.name), entry.size, trashable))
+            bar.next()
+        if not approximate and folder_videos:
+            folders.append((relative, entries.path, folder_videos))
+    bar.finish()
+    if footprint.files() == 0:
+        raise EmptyFolder("Nothing to do here, this tree does not contain any file.")
+    listed = footprint.folders
+    if not complete:
+        footprint.extrapolate(coverage.fraction)
 
-def rename_files(extensions, open_while_renaming, trash_folder_name, directory=None):
+    if approximate:
+        remaining = max(0., deadline - time.monotonic())
+        bar = progress_bar(f"Probing videos for {remaining:.3g}s...", len(videos))
+        sample = sample_durations(videos, lambda path: probe(os.path.join(root, path)), bar, max_workers, remaining,
+                                  population=len(videos) if complete else round(len(videos) / coverage.fraction))
+        bar.finish()
+    else:
+        infos = dict()
+        bar = progress_bar("Probing videos...", len(videos))
+        for relative, path, folder_videos in folders:
+            # probed folder by folder, so that each one uses its own metadata cache, which
+            # is only read: nothing is written to the tree, which may be a read-only archive
+            if use_cache:
+                with MetadataCache(path, read_only=True) as cache:
+                    found = probe_files(folder_videos, bar, max_workers, cache, path, skip_errors=True)
+            else:
+                found = probe_files(folder_videos, bar, max_workers, root=path, skip_errors=True)
+            infos.update((os.path.join(relative, name), info) for name, info in found.items())
+        bar.finish()
+        sample = DurationSample(len(videos))
+        for path, size, trashable in videos:
+            info = infos.get(path)
+            sample.add(info.duration if info is not None else None, size, trashable)
+
+    about = "" if complete else "about "
+    lines = [f"{about}{footprint.files()} files, {about}{format_size(footprint.bytes())}, in {about}{footprint.folders} folders:"]
+    for category, (files, size) in sorted(footprint.categories.items(), key=lambda item: -item[1][1]):
+        lines.append(f"    {category:<12}{files:>10} files{format_size(size):>12}")
+    if not complete:
+        lines.append(f"    (extrapolated from the {listed} folders listed in {budget / 2:g}s, "
+                     f"about {coverage.fraction:.0%} of the tree)")
+    counts = dict(files=footprint.files(), bytes=footprint.bytes(), folders=footprint.folders,
+                  videos=sample.population, sampled=len(sample), listed=listed)
+    if videos:
+        about = "" if sample.exact else "about "
+        if sample.exact:
+            lines.append(f"Durations of the {len(videos)} videos:")
+        else:
+            lines.append(f"Durations of the videos, estimated from {len(sample)} of {sample.population} probed:")
+        for lower, upper, files, size in sample.histogram():
+            if files:
+                bounds = f"{format_duration(lower)}-{format_duration(upper)}" if upper is not None else f">= {format_duration(lower)}"
+                lines.append(f"    {bounds:<12}{files:>10.0f} files{format_size(round(size)):>12}")
+        duration, margin = sample.total_duration()
+        lines.append(f"Total duration: {about}{format_duration(duration)}" + (f" ± {format_duration(margin)}" if margin else ""))
+        if sample.failed:
+            lines.append(f"{sample.failed} probed videos could not be read.")
+        if time_limit is not None:
+            (files, files_margin), (size, size_margin) = sample.trash_impact(time_limit)
+            if sample.exact:
+                lines.append(f"'trash {time_limit}' would trash {files:.0f} videos, {format_size(round(size))}.")
+            else:
+                lines.append(f"'trash {time_limit}' would trash about {files:.0f} ± {files_margin:.0f} videos, "
+                             f"{format_size(round(size))} ± {format_size(round(size_margin))}.")
+            counts.update(trash_files=round(files), trash_bytes=round(size))
+    return Result("\n".join(lines), **counts)
+
+
+def watch_folder(pipeline, sudo, max_workers=None, use_cache=True, cache_size=None, root='.', stop=None):
+    """Sort the files landing in a folder as they are complete, until Ctrl-C.
+
+    Each new file goes through the stages of `pipeline` (by type, short
+    videos trashed, by date) and is moved once, straight to its final
+    destination. The folder is not listed again after the start, except when
+    inotify is not available or lost some events, see the watch.py module.
+    Each batch of files is recorded as a 'watch' run of the journal.
+
+    Parameters
+    ----------
+    pipeline : Pipeline
+        Stages applied to the files.
+    sudo : bool
+        Whether sudo mode is activated or not.
+    max_workers : int
+        Number of threads used to probe the videos.
+    use_cache : bool
+        Whether to read and store the durations and capture times in the
+        metadata cache of the folder.
+    cache_size : int
+        Maximum number of entries of the metadata cache.
+    root : string
+        Folder to watch. Equal to cwd by default.
+    stop : threading.Event
+        If set, the watch stops after the current batch. If None, it stops
+        when the job running it is cancelled.
+    """
+    from videologging.cache import MetadataCache
+    from videologging.watch import FolderWatcher
+    check_parent(sudo, root)
+    if stop is None:
+        stop = cancel_event()
+    bar = progress_bar(f"Watching ({pipeline.describe()}), Ctrl-C to stop...", None)
+    counts = dict(files=0, moved=0, trashed=0, batches=0)
+    try:
+        with FolderWatcher(root, watch_settings) as watcher:
+            for batch in watcher.batches(stop):
+                # a file may have been reported twice, or removed in the meantime
+                batch = [entry for entry in dict((entry.name, entry) for entry in batch).values()
+                         if os.path.isfile(os.path.join(root, entry.name))]
+                if use_cache:
+                    with MetadataCache(root, cache_size) as cache:
+                        plan = route_files(pipeline, batch, max_workers, cache, root)
+                else:
+                    plan = route_files(pipeline, batch, max_workers, root=root)
+                check_destinations(plan)
+                plan.execute("watch", on_move=lambda source, destination: bar.next(), settings=transfer_settings)
+                counts["files"] += len(batch)
+                counts["moved"] += len(plan)
+                counts["trashed"] += count_trashed(pipeline, plan)
+                counts["batches"] += 1
+    except (KeyboardInterrupt, JobCancelled):
+        pass
+    finally:
+        bar.finish()
+    term = "s" if counts["moved"] >= 2 else ""
+    return Result(f"Watch stopped, {counts['moved']} file{term} sorted ({counts['trashed']} trashed).", **counts)
+
+
+def run_pipeline(pipeline, sudo, max_workers=None, use_cache=True, cache_size=None, root='.'):
+    """Sort the files of a folder through the stages of a pipeline, in one
+    pass.
+
+    Running 'folder', then 'trash' and 'date' in the folders of the types,
+    lists the files and moves them up to three times. Here, the folder is
+    listed once, the durations and capture times are read once, and each file
+    is moved once, straight to its final destination (see pipeline.py). The
+    directories are moved into 'Folders', as with 'folder'. The whole sort is
+    recorded as a single 'pipeline' run of the journal.
+
+    Parameters
+    ----------
+    pipeline : Pipeline
+        Stages applied to the files.
+    sudo : bool
+        Whether sudo mode is activated or not.
+    max_workers : int
+        Number of threads used to probe the videos.
+    use_cache : bool
+        Whether to read and store the durations and capture times in the
+        metadata cache of the folder.
+    cache_size : int
+        Maximum number of entries of the metadata cache.
+    root : string
+        Folder to work in. Equal to cwd by default.
+    """
+    from videologging.cache import MetadataCache
+    from videologging.catalog import DIR, catalog
+    check_parent(sudo, root)
+    entries = catalog(root, pipeline.extensions)
+    n = get_number_files(pipeline.extensions, entries=entries)
+    if n == 0:
+        raise EmptyFolder("Nothing to do here, this folder is empty.")
+
+    files = entries.entries(entries.select())
+    videos = [entry for entry in files if pipeline.needs_duration(entry.name)]
+    bar = progress_bar(f"Probing videos ({pipeline.describe()})...", len(videos)) if videos else NullBar()
+    if use_cache:
+        with MetadataCache(root, cache_size) as cache:
+            plan = route_files(pipeline, files, max_workers, cache, root, bar)
+    else:
+        plan = route_files(pipeline, files, max_workers, root=root, bar=bar)
+    bar.finish()
+    for index, kind in enumerate(entries.kinds.tolist()):
+        if kind == DIR:
+            directory = get_folder_from_extension(entries.name(index), pipeline.extensions, True)
+            if directory is not None:
+                plan.add(entries.name(index), directory, int(entries.sizes[index]))
+    execute_plan(plan, "pipeline", "Sorting files...")
+    trashed = count_trashed(pipeline, plan)
+    term = "s" if trashed >= 2 else ""
+    return Result(f"Files sorted ({pipeline.describe()}), {trashed} video{term} trashed.",
+                  files=n, moved=len(plan), trashed=trashed)
+
+
+def count_trashed(pipeline, plan):
+    """Return the number of files a MovePlan of a Pipeline moves into the
+    trash folder."""
+    return sum(os.path.basename(os.path.dirname(destination)) == pipeline.trash_folder_name
+               for _, destination in plan.moves)
+
+
+def route_files(pipeline, entries, max_workers=None, cache=None, root='.', bar=None):
+    """Return the MovePlan taking the files of a folder straight to their
+    destination in a Pipeline.
+
+    The videos whose duration is needed are probed concurrently (those that
+    cannot be probed are kept), and the capture times are read, once for all
+    the stages. A file whose name is taken in its destination is renamed
+    'name_1.ext', 'name_2.ext'...
+
+    Parameters
+    ----------
+    pipeline : Pipeline
+        Stages applied to the files.
+    entries : list
+        Entries of the files.
+    max_workers : int
+        Number of threads used to probe the videos.
+    cache : MetadataCache
+        Cache of the folder. If None, all the files are read.
+    root : string
+        Folder of the files.
+    bar : IncrementalBar
+        Progress bar advanced once per probed video. If None, no progress is
+        shown.
+    """
+    from videologging.moves import MovePlan
+    videos = [entry for entry in entries if pipeline.needs_duration(entry.name)]
+    infos = probe_files(videos, bar or NullBar(), max_workers, cache, root, skip_errors=True) if videos else dict()
+    dated = [entry for entry in entries if pipeline.needs_date(entry.name)]
+    dates = read_capture_times(keyed(dated), cache, root) if dated else dict()
+    plan = MovePlan(root)
+    # destination directory -> names given to the files moved into it
+    taken = dict()
+    for entry in entries:
+        info = infos.get(entry.name)
+        directory = pipeline.route(entry, info.duration if info is not None else None, dates.get(entry.name))
+        name = unique_name(os.path.join(root, directory), entry.name, taken.setdefault(directory, set()))
+        plan.add(entry.name, directory, entry.size, name)
+    return plan
+
+
+def get_capture_times(files, use_metadata=True, use_cache=True, cache_size=None, root='.'):
+    """Return the capture time of the files of a list that have one, as a dict
+    indexed by name.
+
+    Parameters
+    ----------
+    files : iterable
+        (name, metadata cache key) of the files, see `keyed`.
+    use_metadata : bool
+        If False, no file is read and the dict is empty.
+    use_cache : bool
+        Whether to read and store the capture times in the metadata cache of
+        `root`.
+    cache_size : int
+        Maximum number of entries of the metadata cache.
+    root : string
+        Folder of the files.
+    """
+    from videologging.cache import MetadataCache
+    if not use_metadata:
+        return dict()
+    if use_cache:
+        with MetadataCache(root, cache_size) as cache:
+            return read_capture_times(files, cache, root)
+    return read_capture_times(files, root=root)
+
+
+def read_capture_times(files, cache=None, root='.'):
+    """Return the capture time of the files of a list that have one, reading
+    the files missing from `cache` and storing them in it. `files` are
+    (name, metadata cache key) pairs, see `keyed`."""
+    from videologging.dates import is_plausible, read_capture_time
+    dates = dict()
+    with recorder.phase("dating"):
+        for name, key in files:
+            cached = cache.lookup_date(name, key) if cache is not None else None
+            if cached is not None:
+                # the cache may have been written by a version that did not check the capture times
+                capture_time = cached[0] if is_plausible(cached[0]) else None
+            else:
+                capture_time = read_capture_time(os.path.join(root, name))
+                if cache is not None:
+                    cache.store_date(name, key, capture_time)
+            if capture_time is not None:
+                dates[name] = capture_time
+    return dates
+
+
+def unique_name(directory, name, taken):
+    """Return `name`, or 'name_1.ext', 'name_2.ext'... if it is already used in
+    `directory` or in `taken`. The returned name is added to `taken`."""
+    stem, extension = os.path.splitext(name)
+    candidate = name
+    i = 0
+    while candidate in taken or os.path.exists(os.path.join(directory, candidate)):
+        i += 1
+        candidate = f"{stem}_{i}{extension}"
+    taken.add(candidate)
+    return candidate
+
+
+def rename_files(extensions, open_while_renaming, trash_folder_name, directory=None, root='.'):
     """Open and rename the files in current directory.
 
     Parameters
     ----------
-    extensions : dict
-        Contains the lists of extensions for each type of file.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
     open_while_renaming : bool
         Whether or not opening files while renaming them.
     directory : string
         Type of files to rename. If None, all the files are renamed.
+    root : string
+        Folder to work in. Equal to cwd by default.
 
     Notes
     -----
     * Folders are not renamed;
     * The process of opening and renaming files is as follows:
-        1. run the command `start /WAIT $file` in shell;
+        1. open the file with the player set by `preview_settings`;
         2. wait for the input of the user;
-        3. if the window hasn't been closed yet by the user, close it using
+        3. if the player hasn't been closed yet by the user, close it using
         `psutil`.
     This method is inspired by https://stackoverflow.com/a/20820644.
+    * While a file is opened, the next `preview_settings.prefetch` files are
+    read into the page cache, and the proxies of the next videos are built if
+    `preview_settings.proxies` is set, so that opening them is instant.
     """
-    n = get_number_files(extensions, directory, ignore_folders=True)
+    import platform
+    from videologging.catalog import catalog
+    from videologging.preview import Player, Prefetcher, ProxyBuilder
+    entries = catalog(root, extensions)
+    n = get_number_files(extensions, directory, ignore_folders=True, entries=entries)
     if n == 0:  # i.e. no file match the request
         if directory is not None:
             raise EmptyFolder(f"Nothing to do here, this folder does not contain any element of the type '{directory}'.")
         else:
             raise EmptyFolder("Nothing to do here, this folder is empty.")
 
+    files = entries.entries(entries.select(directory))
+    paths = [os.path.join(root, entry.name) for entry in files]
+    system = platform.system()
+    player = Player(preview_settings.player)
+    prefetcher = None
+    proxies = None
+    if open_while_renaming and preview_settings.prefetch > 0:
+        prefetcher = Prefetcher(paths, preview_settings.prefetch)
+    if open_while_renaming and preview_settings.proxies is not None:
+        videos = [path for entry, path in zip(files, paths) if extensions.matches(entry.name, 'Videos')]
+        proxies = ProxyBuilder(root, preview_settings.proxies, videos, preview_settings.proxy_height,
+                               preview_settings.proxy_workers)
+
     nb_renamed = 0
     nb_trashed = 0
-    system = platform.system()
     try:
-        for file in os.listdir():
-            extension = os.path.splitext(file)[-1]
-            if os.path.isdir(file) or (directory is not None and extension not in extensions[directory]):
-                # we don't have to rename this file
-                continue
-
+        for index, (entry, path) in enumerate(zip(files, paths)):
+            file, extension = entry.name, extensions.extension(entry.name)
+            if prefetcher is not None:
+                prefetcher.advance(index)
+            if proxies is not None:
+                proxies.advance(path)
             if can_open(open_while_renaming, extension, system):
-                # run subprocess
-                process = Popen("start /WAIT " + file, shell=True)
+                proxy = proxies.get(path) if proxies is not None else None
+                player.open(proxy if proxy is not None else path)
             # loop until new name for file is ok
             new_name = ""
             while new_name in ["", "help"]:
@@ -195,19 +865,18 @@ def rename_files(extensions, open_while_renaming, trash_folder_name, directory=N
                     print("help on renaming")
                     new_name = ""
                 new_name = input(f"[{file}] >> new name: ")
-            if can_open(open_while_renaming, extension, system):
-                # kill subprocess if not closed
-                if process.poll() is None:
-                    Process(process.pid).children()[0].kill()
-                    time.sleep(.1)
+            # close the player if not closed
+            player.close()
+            if proxies is not None:
+                proxies.discard(path)
             # use input
             if new_name == "trash":
-                move_to_dir(file, trash_folder_name)
+                move_to_dir(file, trash_folder_name, root)
                 nb_trashed += 1
             elif new_name == "exit":
                 raise UserInterrupt()  # to leave the two loops
             else:
-                os.rename(file, new_name + extension)
+                os.rename(path, os.path.join(root, new_name + extension))
                 nb_renamed += 1
 
     except UserInterrupt:
@@ -217,110 +886,432 @@ def rename_files(extensions, open_while_renaming, trash_folder_name, directory=N
     except Exception as e:
         print(e)
     finally:
-        if can_open(open_while_renaming, extension, system):
-            # kill subprocess if not closed
-            if process.poll() is None:
-                Process(process.pid).children()[0].kill()
+        player.close()
+        if prefetcher is not None:
+            prefetcher.close()
+        if proxies is not None:
+            proxies.close()
         # print result in shell
         term_renamed = "s" if nb_renamed >= 2 else ""
         sentence_renamed = f"{nb_renamed} file{term_renamed} renamed."
         term_trashed = "s" if nb_trashed >= 2 else ""
         sentence_trashed = f"{nb_trashed} file{term_trashed} trashed."
         if nb_renamed >= 1 and nb_trashed >= 1:
-            return f"{sentence_renamed}\n{sentence_trashed}"
+            message = f"{sentence_renamed}\n{sentence_trashed}"
         elif nb_renamed != 0:
-            return sentence_renamed
+            message = sentence_renamed
         elif nb_trashed != 0:
-            return sentence_trashed
+            message = sentence_trashed
         else:  # both are 0
-            return "Nothing has been modified."
+            message = "Nothing has been modified."
+        return Result(message, renamed=nb_renamed, trashed=nb_trashed)
+
+
+def bulk_rename(extensions, template, directory=None, apply=False, use_metadata=True, use_cache=True, cache_size=None, root='.'):
+    """Rename the files in current directory following a template.
+
+    Parameters
+    ----------
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    template : string
+        Template of the new names, e.g. '{date:%y%m%d}_{camera}_{seq:04d}{ext}'.
+        See the templates.py module for the available fields.
+    directory : string
+        Type of files to rename. If None, all the files are renamed.
+    apply : bool
+        If False, only show the renames that would be done.
+    use_metadata, use_cache, cache_size
+        How the files are dated, see sort_by_date.
+    root : string
+        Folder to work in. Equal to cwd by default.
+    """
+    from datetime import datetime
+    from videologging.dates import read_camera_model
+    from videologging.moves import MovePlan
+    from videologging.templates import count_cycles, plan_renames, render, template_fields
+    fields = template_fields(template)
+    entries = scan.snapshot(root)
+    files = [entry for entry in entries
+             if entry.kind != 'dir' and (directory is None or extensions.matches(entry.name, directory))]
+    if not files:
+        if directory is not None:
+            raise EmptyFolder(f"Nothing to do here, this folder does not contain any element of the type '{directory}'.")
+        raise EmptyFolder("Nothing to do here, this folder is empty.")
+
+    dates = dict()
+    if "date" in fields or "seq" in fields:
+        dates = get_capture_times(keyed(files), use_metadata, use_cache, cache_size, root)
+        files.sort(key=lambda entry: (dates.get(entry.name, entry.mtime), entry.name))
+    folder = os.path.basename(os.path.abspath(root))
+    renames = []
+    for seq, entry in enumerate(files, start=1):
+        extension = extensions.extension(entry.name)
+        values = {
+            "name": entry.name[:len(entry.name) - len(extension)],
+            "ext": extension,
+            "type": get_folder_from_extension(entry.name, extensions, False),
+            "date": datetime.fromtimestamp(dates.get(entry.name, entry.mtime)),
+            "seq": seq,
+            "camera": "unknown",
+            "folder": folder,
+        }
+        if "camera" in fields:
+            values["camera"] = read_camera_model(os.path.join(root, entry.name)) or "unknown"
+        renames.append((entry.name, render(template, values)))
+
+    moves = plan_renames(renames, entries.names())
+    changed = [(old, new) for old, new in renames if old != new]
+    if not apply:
+        diff = [f"{old} -> {new}" for old, new in changed]
+        cycles = count_cycles(changed)
+        term = "s" if len(changed) >= 2 else ""
+        summary = f"{len(changed)} file{term} would be renamed ({cycles} cycle{'s' if cycles >= 2 else ''}). Add 'apply' to the command to rename them."
+        return Result("\n".join(diff + [summary]), files=len(files), renamed=0, planned=len(changed), cycles=cycles)
+
+    plan = MovePlan(root)
+    for source, destination in moves:
+        plan.add(source, '', name=destination)
+    execute_plan(plan, "bulk", "Renaming files...")
+    term = "s" if len(changed) >= 2 else ""
+    return Result(f"{len(changed)} file{term} renamed.", files=len(files), renamed=len(changed))
+
+
+def probe_files(entries, bar, max_workers=None, cache=None, root='.', skip_errors=False):
+    """Return the MediaInfo of each file of a list, as a dict indexed by name.
+
+    The files missing from `cache` are probed concurrently and stored in it.
+    `bar` is advanced once per file, in completion order.
+
+    Parameters
+    ----------
+    entries : list
+        Entries of the files to probe.
+    bar : IncrementalBar
+        Progress bar to advance.
+    max_workers : int
+        Number of threads used to probe the files.
+    cache : MetadataCache
+        Cache of the folder. If None, all the files are probed.
+    root : string
+        Folder of the files.
+    skip_errors : bool
+        If True, the files that cannot be probed are left out of the dict.
+        Otherwise, the error of the probe is raised.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from videologging.probe import probe
+    infos = dict()
+    to_probe = []
+    for entry in entries:
+        if cache is not None:
+            info = cache.lookup(entry.name, cache_key(entry))
+            if info is not None and info.duration is not None:
+                infos[entry.name] = info
+                bar.next()
+                continue
+        to_probe.append(entry)
+    recorder.count("cache hits", len(infos))
+    recorder.count("videos probed", len(to_probe))
+    recorder.count("bytes probed", sum(entry.size for entry in to_probe))
+
+    with recorder.phase("probing"), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(probe, os.path.join(root, entry.name)): entry for entry in to_probe}
+        try:
+            for future in as_completed(futures):
+                entry = futures[future]
+                bar.next()
+                try:
+                    infos[entry.name] = future.result()
+                except Exception:
+                    if not skip_errors:
+                        raise
+                    continue
+                if cache is not None:
+                    cache.store(entry.name, cache_key(entry), infos[entry.name])
+        except BaseException:
+            # the probes not started yet are dropped, if the job is cancelled for instance
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return infos
+
+
+def cache_key(entry):
+    """Return the key of a file in the metadata cache.
+
+    Parameters
+    ----------
+    entry : Entry
+        Entry of the file.
+    """
+    return entry.size, entry.mtime_ns, entry.inode
+
+
+def keyed(entries):
+    """Return the name and the metadata cache key of each entry of a list."""
+    return [(entry.name, cache_key(entry)) for entry in entries]
+
+
+def clear_cache(root='.'):
+    """Delete the metadata cache of a folder, cwd by default."""
+    from videologging.cache import clear_cache as remove_cache
+    if remove_cache(root):
+        return "Metadata cache cleared."
+    return "There is no metadata cache in this folder."
 
 
 def can_open(open_while_renaming, extension, system):
     return open_while_renaming and (system == "Linux" or extension != "")
 
 
-def move_to_dir(file, directory):
+def execute_plan(plan, command, message=None, hint="'EXTENSIONS' directories"):
+    """Check the destinations of a MovePlan, then execute it.
+
+    If a destination is on another file system, the progress is shown in
+    bytes per second, as the files have to be copied.
+
+    Parameters
+    ----------
+    plan : MovePlan
+        Moves to do.
+    command : string
+        Name of the command, recorded in the journal.
+    message : string
+        Message of the progress bar. If None, no progress is shown.
+    hint : string
+        Parameter of data.yaml to change if a destination is a regular file.
+    """
+    from videologging.transfer import ByteBar
+    check_destinations(plan, hint)
+    if plan.crosses_devices():
+        bar = progress_bar(message or "Copying files...", plan.total_size(), ByteBar)
+        plan.execute(command, on_bytes=bar.next, settings=transfer_settings)
+        bar.finish()
+    elif message is not None:
+        bar = progress_bar(message, len(plan))
+        plan.execute(command, on_move=lambda source, destination: bar.next(), settings=transfer_settings)
+        bar.finish()
+    else:
+        plan.execute(command, settings=transfer_settings)
+
+
+def check_destinations(plan, hint="'EXTENSIONS' directories"):
+    """Raise BadFolderName if a destination directory of a MovePlan is a
+    regular file.
+
+    Parameters
+    ----------
+    plan : MovePlan
+        Moves to check.
+    hint : string
+        Parameter of data.yaml to change if a destination is a regular file.
+    """
+    for directory in plan.directories():
+        if os.path.isfile(os.path.join(plan.folder, directory)):
+            raise BadFolderName(f"You have a file named '{directory}' in the current working directory, which is not a valid file name because this tool uses it as a directory name. You may consider changing the {hint} default in 'data.yaml'.")
+
+
+def format_size(size):
+    """Return a number of bytes in a human readable form, e.g. '1.5 GB'."""
+    for unit in ["B", "kB", "MB", "GB"]:
+        if size < 1000:
+            return f"{size:.3g} {unit}" if unit != "B" else f"{size} B"
+        size /= 1000
+    return f"{size:.3g} TB"
+
+
+def format_duration(seconds):
+    """Return a number of seconds in a human readable form, e.g. '1h05m'."""
+    seconds = round(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s" if seconds % 60 else f"{seconds // 60}m"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+def progress_bar(message, maximum, bar_class=IncrementalBar):
+    """Return a progress bar, or a NullBar if `show_progress` is False.
+
+    Parameters
+    ----------
+    message : string
+        Message of the bar.
+    maximum : int
+        Maximum value of the bar. If None, a Counter is returned.
+    bar_class : class
+        Class of the bar, IncrementalBar by default.
+    """
+    job = current_job()
+    if not show_progress or (job is not None and job.background):
+        bar = NullBar()
+    elif maximum is None:
+        bar = Counter(message)
+    else:
+        bar = bar_class(message, max=maximum)
+    # the progress of a job is recorded, and the job can be cancelled at each step
+    return JobBar(job, message, maximum, bar) if job is not None else bar
+
+
+class NullBar(object):
+    """Progress bar that displays nothing."""
+
+    def next(self, n=1):
+        pass
+
+    def finish(self):
+        pass
+
+
+def undo_last_run(root='.'):
+    """Move back the files moved by the last command run in a folder, cwd by
+    default."""
+    from videologging.moves import Journal
+    run = Journal(root).last_run()
+    if run is None:
+        return "Nothing to undo in this folder."
+    n = run.undo()
+    term = "s" if n >= 2 else ""
+    message = f"'{run.command}' undone, {n} file{term} moved back."
+    if run.conflicts:
+        kept = ", ".join(f"'{destination}'" for destination, _ in run.conflicts[:5])
+        more = f" and {len(run.conflicts) - 5} more" if len(run.conflicts) > 5 else ""
+        term = "s" if len(run.conflicts) >= 2 else ""
+        names = "their former names are" if len(run.conflicts) >= 2 else "its former name is"
+        message += f" {len(run.conflicts)} file{term} not moved back, because {names} taken: {kept}{more}."
+    if run.kept_directories:
+        kept = ", ".join(f"'{directory}'" for directory in run.kept_directories[:5])
+        more = f" and {len(run.kept_directories) - 5} more" if len(run.kept_directories) > 5 else ""
+        term = "s" if len(run.kept_directories) >= 2 else ""
+        them = "them" if len(run.kept_directories) >= 2 else "it"
+        message += f" {len(run.kept_directories)} folder{term} left, because other files were put in {them}: {kept}{more}."
+    return Result(message, moved=n, conflicts=len(run.conflicts), kept=len(run.kept_directories))
+
+
+def resume_last_run(root='.'):
+    """Finish the last command run in a folder, cwd by default, if it was
+    interrupted."""
+    from videologging.moves import Journal
+    run = Journal(root).last_run()
+    if run is None or run.finished:
+        return "There is no interrupted command to resume in this folder."
+    n = run.resume(settings=transfer_settings)
+    term = "s" if n >= 2 else ""
+    return Result(f"'{run.command}' resumed, {n} file{term} moved.", moved=n)
+
+
+def move_to_dir(file, directory, root='.'):
     """Move file to directory.
 
-    Check if a directory named `directory` exists in current directory. If not,
-    create it. Then, move `file` in `directory`.
+    Check if a directory named `directory` exists in `root`. If not, create it.
+    Then, move `file` in `directory`.
 
     Parameters
     ----------
     file : string
-        File to move.
+        File to move, relative to `root`.
     directory : string
-        Target directory.
+        Target directory, relative to `root`.
+    root : string
+        Folder to work in. Equal to cwd by default.
     """
+    from videologging.transfer import move
     if directory is not None:
-        if os.path.exists(directory):  # if 'directory' already exists
-            if os.path.isfile(directory):  # if 'directory' is a regular file
+        path = os.path.join(root, directory)
+        if os.path.exists(path):  # if 'directory' already exists
+            if os.path.isfile(path):  # if 'directory' is a regular file
                 raise BadFolderName(f"You have a file named '{directory}' in the current working directory, which is not a valid file name because this tool uses it as a directory name. You may consider changing the 'EXTENSIONS' directories default in 'data.yaml'.")
             else:  # if 'directory' is a directory
                 pass
         else:  # if 'directory' does not exist
-            os.mkdir(f'./{directory}')
-        os.rename(file, os.path.join(directory, file))
+            os.mkdir(path)
+        move(os.path.join(root, file), os.path.join(path, file), transfer_settings.verify)
+
+def check_parent(sudo, root='.'):
+    """Check if 'video-logging' scripts are in `root` to prevent bad things
+    from happening.
 
-def check_parent(sudo):
-    """Check if 'video-logging' scripts are in cwd to prevent bad things from
-    happening.
+    The marker is searched in `root`, its ancestors and its subfolders up to
+    `safety_check.depth` levels. The duration of the check is available in
+    `safety_check.last_duration`.
 
     Parameters
     ----------
     sudo : bool
         Whether sudo mode is activated or not.
+    root : string
+        Folder to check. Equal to cwd by default.
     """
     if not sudo:
-        for root, dirs, files in os.walk("./"):
-            if ".videolog" in files:
-                raise SudoException()
+        with recorder.phase("safety check"):
+            found = safety_check.contains_marker(root)
+        if found:
+            raise SudoException()
     else:
         # maybe print a message here if verbose
         pass
 
 
-def get_number_files(extensions, directory=None, ignore_folders=False):
+def get_number_files(extensions, directory=None, ignore_folders=False, entries=None):
     """Return number of file of a certain type in cwd.
 
     Parameters
     ----------
-    extensions : dict
-        Contains the lists of extensions for each type of file.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
     directory : string
         Target directory. If None, return total number of files.
+    ignore_folders : bool
+        Whether or not to count only the regular files.
+    entries : Catalog
+        Listing of the folder. If None, cwd is scanned.
     """
-    count = 0
-    for file in os.listdir():
-        extension = os.path.splitext(file)[1]
-        if directory is None or extension in extensions[directory]:
-            if not ignore_folders or os.path.isfile(file):
-                count += 1
-    return count
+    from videologging.catalog import catalog
+    if entries is None:
+        entries = catalog('.', extensions)
+    return entries.count(directory, ignore_folders)
 
 
-def get_folder_from_extension(file, extensions):
+def get_folder_from_extension(file, extensions, is_dir=None):
     """Return the folder corresponding to an extension.
 
     Parameters
     ----------
     file : string
         File whose extension is targetted.
-    extensions : dict
-        Contains the lists of extensions for each type of file.
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    is_dir : bool
+        Whether `file` is a directory. If None, it is checked on the disk.
     """
-    name, extension = os.path.splitext(file)
-    if os.path.isdir(file):
+    name = os.path.splitext(file)[0]
+    if is_dir is None:
+        is_dir = os.path.isdir(file)
+    if is_dir:
         if name not in extensions:
             return 'Folders'
         else:
             return None
     else:
-        for directory in extensions:
-            if extension in extensions[directory]:
-                return directory
-        return 'Other'
+        directory = extensions.category(file)
+        return directory if directory is not None else 'Other'
+
+class Result(str):
+    """Message returned by an operation, with the counts of what it did.
+
+    Parameters
+    ----------
+    message : string
+        Message to display.
+    counts : int
+        Counts of the operation, e.g. files=12, moved=10.
+    """
+
+    def __new__(cls, message, **counts):
+        result = super().__new__(cls, message)
+        result.counts = counts
+        return result
+
 
 class EmptyFolder(Exception):
     pass
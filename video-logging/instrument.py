@@ -0,0 +1,163 @@
+# encoding: utf-8
+"""Timing instrumentation of the commands, used by the cli.py script and the
+functions.py module.
+
+Each command is recorded as a run made of phases (safety check, listing,
+probing, moving...), whose durations are summed, and of counters (files
+scanned, bytes probed, renames, mkdirs...). The phases are coarse and the
+counters are incremented once per batch of files, so that recording costs a
+few microseconds per command. When the recorder is disabled, `phase` returns
+a shared no-op context manager.
+
+The phases can also be kept as trace events, in the Trace Event Format read
+by chrome://tracing and Perfetto.
+
+Each thread records its own run, so that commands running as background jobs
+are recorded separately.
+"""
+
+import os
+import threading
+import time
+from collections import Counter
+
+
+class Recorder(object):
+    """Recorder of the phases and counters of the runs of the commands.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether or not the runs are recorded.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # whether or not to keep the phases as trace events
+        self.trace = False
+        self.events = []
+        # run being recorded by each thread
+        self.local = threading.local()
+        # last run with at least one phase
+        self.last = None
+
+    @property
+    def current(self):
+        """Run being recorded by the current thread, or None."""
+        return getattr(self.local, "run", None)
+
+    @current.setter
+    def current(self, run):
+        self.local.run = run
+
+    def start(self, command):
+        """Start recording the run of a command."""
+        if self.enabled:
+            self.current = Run(command)
+
+    def finish(self):
+        """Stop recording the current run. It becomes the last run if some
+        phases were recorded, so that commands such as 'help' are ignored."""
+        run = self.current
+        if run is None:
+            return
+        run.seconds = time.perf_counter() - run.start
+        if self.trace:
+            self.events.append(trace_event(run.command, run.start, run.seconds))
+        if run.phases:
+            self.last = run
+        self.current = None
+
+    def phase(self, name):
+        """Return a context manager timing a phase of the current run."""
+        if self.current is None:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def count(self, name, n=1):
+        """Add `n` to a counter of the current run. Call it from the
+        thread of the command only."""
+        if self.current is not None:
+            self.current.counters[name] += n
+
+
+class Run(object):
+    """Phases and counters of the run of a command.
+
+    Parameters
+    ----------
+    command : string
+        Command run.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.start = time.perf_counter()
+        self.seconds = None
+        # name -> [seconds, calls], in the order of the first call
+        self.phases = dict()
+        self.counters = Counter()
+        # number of phases being timed, to sum the top-level ones only
+        self.depth = 0
+        self.top_level_seconds = 0.
+
+    def format(self):
+        """Return the breakdown of the run as text."""
+        lines = [f"Last run: '{self.command}' in {self.seconds * 1000:.1f} ms"]
+        for name, (seconds, calls) in self.phases.items():
+            share = 100 * seconds / self.seconds if self.seconds else 0
+            times = f" ({calls} times)" if calls > 1 else ""
+            lines.append(f"  {name:<16}{seconds * 1000:>10.1f} ms {share:>5.1f}%{times}")
+        other = max(self.seconds - self.top_level_seconds, 0)
+        lines.append(f"  {'other':<16}{other * 1000:>10.1f} ms {100 * other / self.seconds if self.seconds else 0:>5.1f}%")
+        for name, value in self.counters.items():
+            lines.append(f"  {name:<16}{value:>10}")
+        return "\n".join(lines)
+
+
+class Phase(object):
+    """Context manager timing a phase of the current run of a Recorder."""
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.run = recorder.current
+        self.name = name
+
+    def __enter__(self):
+        self.run.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.run.depth -= 1
+        if self.run.depth == 0:
+            self.run.top_level_seconds += seconds
+        total = self.run.phases.setdefault(self.name, [0., 0])
+        total[0] += seconds
+        total[1] += 1
+        if self.recorder.trace:
+            self.recorder.events.append(trace_event(self.name, self.start, seconds))
+
+
+class NullPhase(object):
+    """Context manager doing nothing, returned when nothing is recorded."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+def trace_event(name, start, seconds):
+    """Return a complete event of the Trace Event Format."""
+    return {"name": name, "ph": "X", "ts": round(start * 1e6, 3), "dur": round(seconds * 1e6, 3),
+            "pid": os.getpid(), "tid": threading.get_ident()}
+
+
+# recorder of the session
+recorder = Recorder()
@@ -0,0 +1,228 @@
+# encoding: utf-8
+"""Background jobs of the interactive tool, used by the cli.py script and the
+functions.py module.
+
+Each long command (sorting, trashing, dating...) runs in a Job, a thread of
+its own, so that the prompt stays available: the operator can start another
+command in another folder while a job runs, follow the progress of the jobs,
+wait for them or cancel them.
+
+The cancellation is cooperative: the operations of the functions.py module
+call `checkpoint` between two files (through their progress bars, see
+JobBar), which raises JobCancelled once the job has been asked to stop. The
+moves already done are recorded in the journal of the folder, so a cancelled
+command can be undone or resumed like an interrupted one.
+"""
+
+import threading
+import time
+
+
+# job of each thread, if any
+local = threading.local()
+# when the session is profiled with cProfile, which only profiles the thread
+# it is enabled in, the profiles of the finished jobs, to be merged with it
+profiles = None
+
+
+class Job(object):
+    """Command running in a thread.
+
+    Parameters
+    ----------
+    number : int
+        Number of the job, shown to the operator.
+    command : string
+        Command run.
+    folder : string
+        Folder the command runs in.
+    function : function
+        Function running the command, called without arguments in the thread.
+    background : bool
+        Whether the job runs in the background. If not, the CLI waits for it
+        and the progress bars are displayed.
+    """
+
+    def __init__(self, number, command, folder, function, background=False):
+        self.number = number
+        self.command = command
+        self.folder = folder
+        self.background = background
+        # 'running', 'done', 'failed' or 'cancelled'
+        self.state = "running"
+        # messages reported by the command, as (kind, text)
+        self.messages = []
+        # whether the end of the job was shown to the operator
+        self.reported = False
+        # error not handled by the command, if any
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        # progress of the current step of the command
+        self.step = None
+        self.done = 0
+        self.total = None
+        self.cancel_requested = threading.Event()
+        self.over = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(function,), daemon=True)
+        self.thread.start()
+
+    def run(self, function):
+        local.job = self
+        profiler = start_thread_profiler()
+        try:
+            function()
+        except Exception as e:  # not handled by the command, so that the job is not reported as done
+            self.error = f"{type(e).__name__}: {e}"
+            self.messages.append(("error", self.error))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiles.append(profiler)
+            if self.cancel_requested.is_set():
+                self.state = "cancelled"
+            elif any(kind == "error" for kind, _ in self.messages):
+                self.state = "failed"
+            else:
+                self.state = "done"
+            self.finished = time.time()
+            self.over.set()
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def cancel(self):
+        """Ask the job to stop at its next checkpoint."""
+        self.cancel_requested.set()
+
+    def wait(self, timeout=None):
+        """Wait for the end of the job. Return whether it is over."""
+        # waited by steps so that Ctrl-C is handled by the main thread, and
+        # not with Thread.join, which can be left inconsistent by a Ctrl-C
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.over.is_set():
+            remaining = 0.2 if deadline is None else min(0.2, deadline - time.monotonic())
+            if remaining <= 0:
+                return False
+            self.over.wait(remaining)
+        return True
+
+    def seconds(self):
+        """Return the number of seconds the job has been running, or ran."""
+        return (self.finished or time.time()) - self.started
+
+    def progress(self):
+        """Return the progress of the current step of the job as text."""
+        if self.step is None:
+            return ""
+        if self.total:
+            return f"{self.step} {self.done}/{self.total} ({100 * self.done // self.total}%)"
+        return f"{self.step} {self.done}"
+
+    def describe(self):
+        """Return a line describing the job."""
+        return f"[{self.number}] {self.state:<10}{self.seconds():>8.1f}s  {self.command}  ({self.folder})  {self.progress()}"
+
+
+def start_thread_profiler():
+    """Start profiling the current thread if the session is profiled, and
+    return the profiler, else None."""
+    if profiles is None:
+        return None
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Python 3.12+: the profiler of the session already profiles every thread
+        return None
+    return profiler
+
+
+class JobManager(object):
+    """Jobs started by the operator."""
+
+    def __init__(self):
+        # number -> Job, in the order they were started
+        self.jobs = dict()
+        self.count = 0
+
+    def start(self, command, folder, function, background=False):
+        """Start a Job and return it."""
+        self.count += 1
+        job = Job(self.count, command, folder, function, background)
+        self.jobs[job.number] = job
+        return job
+
+    def get(self, number):
+        """Return a job by its number, or None."""
+        return self.jobs.get(number)
+
+    def running(self, folder=None):
+        """Return the running jobs, of a folder if it is not None."""
+        return [job for job in self.jobs.values() if job.running and (folder is None or job.folder == folder)]
+
+    def unreported(self):
+        """Return the background jobs that are over but whose end was not
+        shown yet, and mark them as shown."""
+        over = [job for job in self.jobs.values() if job.background and not job.running and not job.reported]
+        for job in over:
+            job.reported = True
+        return over
+
+
+class JobBar(object):
+    """Progress bar of an operation run in a Job, recording its progress in
+    the job and checking whether the job is cancelled at each step.
+
+    Parameters
+    ----------
+    job : Job
+        Job of the operation.
+    message : string
+        Message of the bar.
+    maximum : int
+        Maximum value of the bar, or None if it is not known.
+    bar : IncrementalBar
+        Bar displayed, a NullBar for a background job.
+    """
+
+    def __init__(self, job, message, maximum, bar):
+        self.job = job
+        self.bar = bar
+        job.step = message.rstrip('.')
+        job.done = 0
+        job.total = maximum
+        checkpoint()
+
+    def next(self, n=1):
+        self.job.done += n
+        self.bar.next(n)
+        checkpoint()
+
+    def finish(self):
+        self.bar.finish()
+
+
+def current_job():
+    """Return the Job of the current thread, or None."""
+    return getattr(local, "job", None)
+
+
+def checkpoint():
+    """Raise JobCancelled if the job of the current thread was asked to stop.
+    Does nothing outside of a job."""
+    job = current_job()
+    if job is not None and job.cancel_requested.is_set():
+        raise JobCancelled(f"'{job.command}' cancelled.")
+
+
+def cancel_event():
+    """Return the Event set when the job of the current thread is asked to
+    stop, or an Event that is never set outside of a job."""
+    job = current_job()
+    return job.cancel_requested if job is not None else threading.Event()
+
+
+class JobCancelled(Exception):
+    pass
@@ -0,0 +1,441 @@
+# encoding: utf-8
+"""Planned and journaled moves used by the functions.py module.
+
+A command first computes all the moves it will do in a MovePlan. The plan
+creates each destination directory once, then renames the files in bulk. The
+files that cannot be renamed because their destination is on another file
+system are copied concurrently by the transfer.py module. Every
+run is recorded in an append-only journal stored in the folder, so that it can
+be undone, or resumed if it was interrupted. A run can be extended by several
+plans, so that a tree can be processed one folder at a time.
+
+The journal is made of JSON lines, each one being an event of a run:
+    {"run": 3, "event": "plan", "command": "folder", "moves": [...], "directories": [...]}
+    {"run": 3, "event": "extend", "moves": [...], "directories": [...]}
+    {"run": 3, "event": "move", "index": 0}
+    {"run": 3, "event": "end"}
+    {"run": 3, "event": "undo"}
+Once the journal exceeds JOURNAL_MAX_SIZE bytes, it is renamed to
+'.videolog-journal.old' when the next run starts, so that it does not grow
+forever: the runs of both files can be undone.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+from videologging.instrument import recorder
+from videologging.scan import is_tool_file
+from videologging.transfer import TransferSettings, device, is_cross_device, move, transfer
+
+
+JOURNAL_FILE_NAME = ".videolog-journal"
+# size of the journal after which it is rotated
+JOURNAL_MAX_SIZE = 16 * 1024 * 1024
+# path of a journal -> (its size, number of its next run), so that the journal
+# is not read again each time a run starts ('watch' starts one per batch)
+next_numbers = dict()
+
+
+class MovePlan(object):
+    """Moves of files of a folder into some of its subdirectories.
+
+    Parameters
+    ----------
+    folder : string
+        Folder in which the moves happen. The paths of the moves are relative
+        to it.
+    """
+
+    def __init__(self, folder='.'):
+        self.folder = folder
+        # list of (source, destination)
+        self.moves = []
+        # size of the moved files, in bytes
+        self.sizes = []
+
+    def __len__(self):
+        return len(self.moves)
+
+    def add(self, file, directory, size=0, name=None):
+        """Plan the move of `file`, of `size` bytes, into `directory`, under a
+        new `name` if it is not None."""
+        self.moves.append((file, os.path.join(directory, name if name is not None else os.path.basename(file))))
+        self.sizes.append(size)
+
+    def total_size(self):
+        """Return the number of bytes of the moved files."""
+        return sum(self.sizes)
+
+    def crosses_devices(self):
+        """Return whether a destination directory is on another file system
+        than the folder."""
+        folder_device = device(self.folder)
+        return any(device(os.path.join(self.folder, directory)) != folder_device
+                   for directory in self.directories())
+
+    def directories(self):
+        """Return the destination directories, without duplicates, in the
+        order of the moves."""
+        directories = dict()
+        for _, destination in self.moves:
+            directories[os.path.dirname(destination)] = None
+        return [directory for directory in directories if directory != '']
+
+    def missing_directories(self):
+        """Return the destination directories that do not exist yet, and
+        their missing parents, parents first, so that undoing the moves can
+        remove them all."""
+        missing = dict()
+        for directory in self.directories():
+            parents = []
+            while directory and directory not in missing and not os.path.isdir(os.path.join(self.folder, directory)):
+                parents.append(directory)
+                directory = os.path.dirname(directory)
+            for parent in reversed(parents):
+                missing[parent] = None
+        return list(missing)
+
+    def execute(self, command, on_move=None, on_bytes=None, settings=None, journal=True, run=None):
+        """Create the destination directories, then move the files.
+
+        Parameters
+        ----------
+        command : string
+            Name of the command, recorded in the journal.
+        on_move : function
+            Called with (source, destination) after each move.
+        on_bytes : function
+            Called with a number of bytes moved, as the moves progress.
+        settings : TransferSettings
+            Settings of the cross-device moves. If None, use the defaults.
+        journal : bool
+            Whether or not to record the run in the journal of the folder.
+        run : Run
+            Run of a previous plan of the same folder, to extend with this
+            plan. If None, a new run is started.
+
+        Returns
+        -------
+        Run
+            Run of the plan in the journal, or None if `journal` is False.
+        """
+        if not self.moves:
+            return run
+        created = self.missing_directories()
+        base = 0
+        with recorder.phase("moving"):
+            if journal and run is None:
+                run = Journal(self.folder).start(command, self.moves, created)
+            elif journal:
+                base = run.extend(self.moves, created)
+            for directory in created:
+                os.makedirs(os.path.join(self.folder, directory), exist_ok=True)
+            run_moves(self.folder, self.moves, range(len(self.moves)), run if journal else None,
+                      on_move, on_bytes, settings, self.sizes, base)
+        recorder.count("mkdirs", len(created))
+        return run if journal else None
+
+
+def run_moves(folder, moves, indices, run, on_move=None, on_bytes=None, settings=None, sizes=None, base=0):
+    """Do the moves of `moves` whose index is in `indices`, recording them in
+    `run` if it is not None. `base` is the index of the first move of `moves`
+    in the run.
+
+    The files are renamed sequentially. Those whose destination is on another
+    file system are then transferred by a pool of `settings.workers` threads.
+    """
+    if settings is None:
+        settings = TransferSettings()
+
+    def done(index):
+        if run is not None:
+            run.record(base + index)
+        if on_move is not None:
+            on_move(*moves[index])
+
+    cross_device = []
+    for index in indices:
+        source, destination = moves[index]
+        try:
+            os.rename(os.path.join(folder, source), os.path.join(folder, destination))
+        except OSError as e:
+            if not is_cross_device(e):
+                raise
+            cross_device.append(index)
+            continue
+        if on_bytes is not None and sizes is not None:
+            on_bytes(sizes[index])
+        done(index)
+
+    recorder.count("renames", len(indices) - len(cross_device))
+    if cross_device:
+        recorder.count("transfers", len(cross_device))
+        lock = Lock()
+
+        def locked_on_bytes(n):
+            with lock:
+                on_bytes(n)
+
+        with ThreadPoolExecutor(max_workers=settings.workers) as executor:
+            futures = dict()
+            for index in cross_device:
+                source, destination = moves[index]
+                future = executor.submit(transfer, os.path.join(folder, source), os.path.join(folder, destination),
+                                         settings.verify, None if on_bytes is None else locked_on_bytes)
+                futures[future] = index
+            for future in as_completed(futures):
+                future.result()
+                done(futures[future])
+
+    if run is not None:
+        run.finish()
+
+
+class Run(object):
+    """A run of a MovePlan, as recorded in the journal.
+
+    Parameters
+    ----------
+    journal : Journal
+        Journal of the run.
+    number : int
+        Identifier of the run in the journal.
+    command : string
+        Name of the command that planned the moves.
+    moves : list
+        Planned (source, destination) moves.
+    directories : list
+        Directories created by the run.
+
+    Notes
+    -----
+    While a run is being executed, the moves of the plans extending it are
+    only written to the journal, so that processing a tree does not keep all
+    its moves in memory. `moves` is complete for the runs read from the
+    journal, which are the ones that can be undone or resumed.
+    """
+
+    def __init__(self, journal, number, command, moves, directories):
+        self.journal = journal
+        self.number = number
+        self.command = command
+        self.moves = list(moves)
+        self.directories = list(directories)
+        # number of moves, including those of the extending plans
+        self.count = len(self.moves)
+        # indices of the moves already done
+        self.done = set()
+        self.finished = False
+        self.undone = False
+        # moves not undone because another file took the place of their source, as (destination, source)
+        self.conflicts = []
+        self.kept_directories = []
+
+    def extend(self, moves, directories):
+        """Add the moves of another plan to the run and return the index of
+        the first one."""
+        self.journal.append({"run": self.number, "event": "extend", "moves": moves, "directories": directories})
+        base = self.count
+        self.count += len(moves)
+        self.finished = False
+        return base
+
+    def record(self, index):
+        """Record that the move `index` is done."""
+        self.journal.append({"run": self.number, "event": "move", "index": index})
+        self.done.add(index)
+
+    def finish(self):
+        """Record that all the moves are done."""
+        self.journal.append({"run": self.number, "event": "end"})
+        self.finished = True
+
+    def resume(self, on_move=None, settings=None):
+        """Do the moves that were not done, if the run was interrupted.
+
+        Returns
+        -------
+        int
+            Number of files moved.
+        """
+        folder = self.journal.folder
+        remaining = []
+        for index in range(len(self.moves)):
+            if index in self.done:
+                continue
+            source, destination = self.moves[index]
+            if not os.path.lexists(os.path.join(folder, source)) and os.path.lexists(os.path.join(folder, destination)):
+                # done, but interrupted before it was written to the journal
+                self.record(index)
+            else:
+                remaining.append(index)
+        with recorder.phase("moving"):
+            for directory in self.directories:
+                os.makedirs(os.path.join(self.journal.folder, directory), exist_ok=True)
+            run_moves(self.journal.folder, self.moves, remaining, self, on_move, settings=settings)
+        return len(remaining)
+
+    def undo(self, on_move=None):
+        """Move the files back, in reverse order, and remove the directories
+        the run created if they are empty.
+
+        A file whose former path is taken by another file is left in place,
+        and the move is added to `conflicts`. The files of the tool (metadata
+        cache, journal...) do not keep a directory from being removed; the
+        directories that still hold other files are added to
+        `kept_directories`.
+
+        Returns
+        -------
+        int
+            Number of files moved back.
+        """
+        folder = self.journal.folder
+        count = 0
+        with recorder.phase("moving"):
+            for index in sorted(self.done, reverse=True):
+                source, destination = self.moves[index]
+                if not os.path.exists(os.path.join(folder, destination)):  # moved since then
+                    continue
+                if os.path.lexists(os.path.join(folder, source)):  # another file was put there since then
+                    self.conflicts.append((destination, source))
+                    continue
+                move(os.path.join(folder, destination), os.path.join(folder, source))
+                count += 1
+                if on_move is not None:
+                    on_move(destination, source)
+            for directory in reversed(self.directories):
+                if not self.remove_directory(directory):
+                    self.kept_directories.append(directory)
+        recorder.count("renames", count)
+        self.journal.append({"run": self.number, "event": "undo"})
+        self.undone = True
+        return count
+
+    def remove_directory(self, directory):
+        """Remove a directory created by the run, with the files the tool
+        wrote in it. Return False if it holds other files."""
+        path = os.path.join(self.journal.folder, directory)
+        try:
+            files = os.listdir(path)
+        except OSError:  # already removed
+            return True
+        if not all(is_tool_file(file) and os.path.isfile(os.path.join(path, file)) for file in files):
+            return False
+        try:
+            for file in files:
+                os.remove(os.path.join(path, file))
+            os.rmdir(path)
+        except OSError:
+            return False
+        return True
+
+
+class Journal(object):
+    """Append-only journal of the moves done in a folder.
+
+    Parameters
+    ----------
+    folder : string
+        Folder of the journal.
+    """
+
+    def __init__(self, folder='.'):
+        self.folder = folder
+        self.path = os.path.join(folder, JOURNAL_FILE_NAME)
+        self.old_path = self.path + ".old"
+        self.file = None
+
+    def append(self, event):
+        """Append an event to the journal, flushing it to the disk so that an
+        interrupted run can be resumed."""
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+        key = os.path.abspath(self.path)
+        if event["event"] == "plan":
+            next_numbers[key] = (self.file.tell(), event["run"] + 1)
+        elif key in next_numbers:
+            next_numbers[key] = (self.file.tell(), next_numbers[key][1])
+        if event["event"] in ["end", "undo"]:
+            self.file.close()
+            self.file = None
+
+    def start(self, command, moves, directories):
+        """Record a new run and return it."""
+        number = self.next_number()
+        if os.path.exists(self.path) and os.path.getsize(self.path) > JOURNAL_MAX_SIZE:
+            os.replace(self.path, self.old_path)
+        self.append({"run": number, "event": "plan", "command": command,
+                     "moves": moves, "directories": directories})
+        return Run(self, number, command, moves, directories)
+
+    def next_number(self):
+        """Return the number of the next run, reading the journal only if it
+        was written by another session since the last run."""
+        key = os.path.abspath(self.path)
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if key in next_numbers and next_numbers[key][0] == size:
+            return next_numbers[key][1]
+        # the runs of the rotated journal come before those of the current one
+        number = max(self.last_number(self.old_path), self.last_number(self.path)) + 1
+        next_numbers[key] = (size, number)
+        return number
+
+    def last_number(self, path):
+        """Return the largest run number of a journal file, -1 if there is
+        none. Only the start of each line is parsed."""
+        number = -1
+        if not os.path.exists(path):
+            return number
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                # lines start with '{"run": <number>, '
+                try:
+                    number = max(number, int(line[len('{"run": '):line.index(',')]))
+                except ValueError:  # line cut by an interruption
+                    continue
+        return number
+
+    def runs(self):
+        """Return the runs recorded in the journal and in the rotated one, in
+        chronological order."""
+        runs = dict()
+        for path in [self.old_path, self.path]:
+            if os.path.exists(path):
+                self.read_runs(path, runs)
+        return list(runs.values())
+
+    def read_runs(self, path, runs):
+        """Add the runs of a journal file to a dict of runs indexed by number."""
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:  # line cut by an interruption
+                    continue
+                if event["event"] == "plan":
+                    runs[event["run"]] = Run(self, event["run"], event["command"],
+                                             [tuple(move) for move in event["moves"]], event["directories"])
+                elif event["run"] in runs:
+                    run = runs[event["run"]]
+                    if event["event"] == "move":
+                        run.done.add(event["index"])
+                    elif event["event"] == "extend":
+                        run.moves.extend(tuple(move) for move in event["moves"])
+                        run.directories.extend(event["directories"])
+                        run.count = len(run.moves)
+                        run.finished = False
+                    elif event["event"] == "end":
+                        run.finished = True
+                    elif event["event"] == "undo":
+                        run.undone = True
+
+    def last_run(self):
+        """Return the last run that was not undone, or None."""
+        for run in reversed(self.runs()):
+            if not run.undone:
+                return run
+        return None
@@ -0,0 +1,104 @@
+# encoding: utf-8
+"""Routing of the files through the stages of a pipeline, used by the
+functions.py module.
+
+Instead of running 'folder', 'trash' and 'date' one after another, each one
+listing the folder and moving the files again, the final destination of each
+file is computed once from the stages of a Pipeline:
+    - classify: the file goes into the folder of its type, as with 'folder';
+    - drop-short: the videos shorter than a time limit go into the trash
+      folder of the 'Videos' folder, as with 'trash' run in it;
+    - bucket-by-date: the file goes into a 'YYMMDD-Day' folder of the folder
+      of its type, as with 'date' run in it.
+Each file is then moved once, straight to its destination. The pipeline is
+used by the 'watch' command for each new file, and by the 'pipeline' command
+for the files of a folder.
+"""
+
+import os
+import time
+
+
+class Pipeline(object):
+    """Stages applied to the files of a folder.
+
+    Parameters
+    ----------
+    extensions : ExtensionIndex
+        Index of the extensions of each type of file.
+    trash_folder_name : string
+        Name of the trash folder of the 'Videos' folder.
+    time_limit : int
+        Duration limit of the drop-short stage, in seconds. If None, no video
+        is trashed.
+    by_date : bool
+        Whether or not the files are bucketed by date.
+    use_metadata : bool
+        Whether the files are dated by the capture time stored in them, see
+        functions.sort_by_date.
+    date_categories : list
+        Types of the files bucketed by date, e.g. ['Videos'] as with 'date'
+        run in the 'Videos' folder only. If None, the files of all types.
+    """
+
+    def __init__(self, extensions, trash_folder_name, time_limit=None, by_date=True, use_metadata=True,
+                 date_categories=None):
+        self.extensions = extensions
+        self.trash_folder_name = trash_folder_name
+        self.time_limit = time_limit
+        self.by_date = by_date
+        self.use_metadata = use_metadata
+        self.date_categories = date_categories
+
+    def describe(self):
+        """Return the stages of the pipeline as text."""
+        stages = ["classify"]
+        if self.time_limit is not None:
+            stages.append(f"drop videos <= {self.time_limit}s")
+        if self.by_date:
+            stages.append("bucket by date" if self.date_categories is None
+                          else f"bucket {', '.join(self.date_categories)} by date")
+        return " -> ".join(stages)
+
+    def category(self, name):
+        """Return the type of a file, 'Other' if its extension is unknown."""
+        category = self.extensions.category(name)
+        return category if category is not None else 'Other'
+
+    def needs_duration(self, name):
+        """Return whether the duration of a file is needed to route it."""
+        return self.time_limit is not None and self.category(name) == 'Videos'
+
+    def dates(self, category):
+        """Return whether the files of a type are bucketed by date."""
+        return self.by_date and (self.date_categories is None or category in self.date_categories)
+
+    def needs_date(self, name):
+        """Return whether the capture time of a file is needed to route it."""
+        return self.use_metadata and self.dates(self.category(name))
+
+    def route(self, entry, duration=None, capture_time=None):
+        """Return the destination directory of a file, relative to its folder.
+
+        Parameters
+        ----------
+        entry : Entry
+            Entry of the file.
+        duration : float
+            Duration of the file if it is a video, None if it is unknown (the
+            video is then kept).
+        capture_time : float
+            Capture time of the file. If None, its modification time is used.
+        """
+        category = self.category(entry.name)
+        if category == 'Videos' and self.time_limit is not None and duration is not None \
+                and duration < self.time_limit:
+            return os.path.join(category, self.trash_folder_name)
+        if self.dates(category):
+            return os.path.join(category, date_folder_name(capture_time if capture_time is not None else entry.mtime))
+        return category
+
+
+def date_folder_name(timestamp):
+    """Return the 'YYMMDD-Day' folder of a timestamp."""
+    return time.strftime('%y%m%d-%a', time.localtime(timestamp))
@@ -0,0 +1,303 @@
+# encoding: utf-8
+"""Preview of the files during a 'rename' session, used by the functions.py
+module.
+
+The operator should never wait for the disk while renaming files, so:
+    - a Prefetcher thread reads the next files into the page cache while the
+      current one is being watched;
+    - a ProxyBuilder pool can build low-resolution proxy clips, or contact
+      sheets of thumbnails, ahead of the operator, which are opened instead
+      of the original videos;
+    - a Player opens the files with the player of the system ('start' on
+      Windows, 'open' on macOS, 'xdg-open' on Linux) or a configured command.
+"""
+
+import os
+import threading
+from videologging.scan import TOOL_FILE_PREFIX
+from videologging.transfer import BUFFER_SIZE
+
+
+PROXY_FOLDER_NAME = TOOL_FILE_PREFIX + "proxies"
+
+
+class PreviewSettings(object):
+    """Settings of the preview of the files while renaming them.
+
+    Parameters
+    ----------
+    player : string
+        Command opening a file, e.g. 'vlc --play-and-exit'. The path of the
+        file is appended to it. If None, use the player of the system. Note
+        that the player launched by 'xdg-open' is often detached, and then
+        not closed when the file is renamed.
+    prefetch : int
+        Number of files read ahead of the current one. 0 disables it.
+    proxies : string
+        'proxy' to build low-resolution proxy clips of the videos, 'sheet' to
+        build contact sheets of thumbnails, None to open the original files.
+    proxy_height : int
+        Height of the proxy clips and of the thumbnails, in pixels.
+    proxy_workers : int
+        Number of processes building the proxies. If None, use the number of
+        CPUs.
+    """
+
+    def __init__(self, player=None, prefetch=3, proxies=None, proxy_height=360, proxy_workers=None):
+        self.player = player
+        self.prefetch = prefetch
+        self.proxies = proxies
+        self.proxy_height = proxy_height
+        self.proxy_workers = proxy_workers
+
+
+class Prefetcher(object):
+    """Thread reading the files that come after the current one into the page
+    cache.
+
+    Parameters
+    ----------
+    paths : list
+        Files, in the order they are opened.
+    ahead : int
+        Number of files read ahead of the current one.
+    """
+
+    def __init__(self, paths, ahead=3):
+        self.paths = paths
+        self.ahead = ahead
+        # index of the file being watched
+        self.position = -1
+        # index of the next file to read
+        self.next = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def advance(self, position):
+        """Tell the thread that the file `position` is being watched."""
+        with self.condition:
+            self.position = position
+            self.condition.notify()
+
+    def close(self):
+        """Stop the thread."""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.stopped or self.next <= min(self.position + self.ahead,
+                                                                                 len(self.paths) - 1))
+                if self.stopped:
+                    return
+                # the files already watched are not read
+                index = self.next = max(self.next, self.position + 1)
+                self.next += 1
+            if index < len(self.paths):
+                try:
+                    prefetch(self.paths[index])
+                except OSError:  # renamed or deleted in the meantime
+                    pass
+
+
+def prefetch(path):
+    """Load a file into the page cache, asking the kernel to read it ahead if
+    possible, reading it otherwise."""
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return
+        buffer = bytearray(BUFFER_SIZE)
+        while f.readinto(buffer):
+            pass
+
+
+class ProxyBuilder(object):
+    """Pool of processes building the proxies of videos, in the order they
+    are watched, in a '.videolog-proxies' folder.
+
+    Only a few proxies are queued at a time, ahead of the video being
+    watched, so that leaving the session early does not leave a long queue
+    of proxies to build.
+
+    Parameters
+    ----------
+    root : string
+        Folder of the videos.
+    kind : string
+        'proxy' or 'sheet', see PreviewSettings.
+    paths : list
+        Videos, in the order they are watched.
+    height : int
+        Height of the proxies, in pixels.
+    max_workers : int
+        Number of processes. If None, use the number of CPUs.
+    """
+
+    def __init__(self, root, kind, paths, height=360, max_workers=None):
+        # imported here because multiprocessing is slow to import and rarely needed
+        from concurrent.futures import ProcessPoolExecutor
+        self.folder = os.path.join(root, PROXY_FOLDER_NAME)
+        os.makedirs(self.folder, exist_ok=True)
+        self.kind = kind
+        self.height = height
+        self.paths = paths
+        # path of a video -> its index in `paths`
+        self.positions = {path: index for index, path in enumerate(paths)}
+        # index of the first video not skipped, and of the next video whose proxy is submitted
+        self.first = 0
+        self.next = 0
+        # number of proxies queued or being built at most
+        self.ahead = 2 * (max_workers or os.cpu_count() or 1)
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        # path of a video -> future of its proxy
+        self.futures = dict()
+        self.advance()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def advance(self, path=None):
+        """Submit the proxies of the next videos, up to `ahead` at a time.
+
+        Parameters
+        ----------
+        path : string
+            File being watched. If it is one of the videos, the proxies of
+            the videos before it are not built anymore, and its own proxy is
+            only used if it is already built.
+        """
+        position = self.positions.get(path)
+        if position is not None:
+            for skipped in self.paths[self.first:position]:
+                future = self.futures.get(skipped)
+                if future is not None and not future.cancel():
+                    self.discard(skipped)
+            self.first = max(self.first, position)
+            self.next = max(self.next, position + 1)
+        pending = sum(1 for future in self.futures.values() if not future.done())
+        while pending < self.ahead and self.next < len(self.paths):
+            self.submit(self.paths[self.next])
+            self.next += 1
+            pending += 1
+
+    def submit(self, path):
+        """Start building the proxy of a video."""
+        name = os.path.basename(path)
+        proxy = os.path.join(self.folder, name + (".mp4" if self.kind == "proxy" else ".jpg"))
+        function = make_proxy if self.kind == "proxy" else make_contact_sheet
+        self.futures[path] = self.executor.submit(function, path, proxy, self.height)
+
+    def get(self, path):
+        """Return the proxy of a video if it is already built, else None."""
+        future = self.futures.get(path)
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def discard(self, path):
+        """Delete the proxy of a video once it has been watched."""
+        proxy = self.get(path)
+        if proxy is not None and os.path.exists(proxy):
+            os.remove(proxy)
+
+    def close(self):
+        """Cancel the proxies not started yet, wait for those being built and
+        delete the proxies folder, with the proxies that were not watched."""
+        # imported here because it is slow to import
+        import shutil
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def make_proxy(path, proxy, height=360):
+    """Write a low-resolution copy of a video to `proxy` and return it."""
+    # imported here because moviepy is slow to import and rarely needed
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    partial = proxy[:-len(".mp4")] + ".part.mp4"
+    with VideoFileClip(path) as clip:
+        clip.resize(height=height).write_videofile(partial, preset="ultrafast", logger=None,
+                                                   temp_audiofile=partial + ".m4a")
+    os.replace(partial, proxy)
+    return proxy
+
+
+def make_contact_sheet(path, sheet, height=360, size=3):
+    """Write a `size` x `size` grid of thumbnails of a video to `sheet` and
+    return it."""
+    # imported here because they are slow to import and rarely needed
+    import numpy as np
+    from moviepy.video.VideoClip import ImageClip
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    partial = sheet[:-len(".jpg")] + ".part.jpg"
+    with VideoFileClip(path, audio=False, target_resolution=(height, None)) as clip:
+        count = size * size
+        frames = [clip.get_frame((i + 0.5) * clip.duration / count) for i in range(count)]
+    rows = [np.hstack(frames[i * size:(i + 1) * size]) for i in range(size)]
+    ImageClip(np.vstack(rows)).save_frame(partial)
+    os.replace(partial, sheet)
+    return sheet
+
+
+class Player(object):
+    """Opens files one at a time, closing the previous one.
+
+    Parameters
+    ----------
+    command : string
+        Player command, see PreviewSettings. If None, use the player of the
+        system.
+    """
+
+    def __init__(self, command=None):
+        # imported here because they are slow to import and only needed by 'rename'
+        import platform
+        self.command = command
+        self.system = platform.system()
+        self.process = None
+
+    def open(self, path):
+        """Open a file, closing the one previously opened."""
+        # imported here because they are slow to import and only needed by 'rename'
+        import shlex
+        from subprocess import Popen
+        self.close()
+        if self.command is not None:
+            self.process = Popen(shlex.split(self.command) + [path])
+        elif self.system == "Windows":
+            self.process = Popen("start /WAIT " + path, shell=True)
+        elif self.system == "Darwin":
+            self.process = Popen(["open", "-W", path])
+        else:
+            self.process = Popen(["xdg-open", path])
+
+    def close(self):
+        """Close the opened file if the user did not close it."""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            # imported here because psutil is slow to import and only needed to close a player
+            from psutil import NoSuchProcess, Process
+            # 'start' and 'xdg-open' run the player in a child process
+            try:
+                for child in Process(self.process.pid).children(recursive=True):
+                    child.kill()
+            except NoSuchProcess:
+                pass
+            self.process.kill()
+        self.process.wait()
+        self.process = None
@@ -0,0 +1,389 @@
+# encoding: utf-8
+"""Header-only media probing used by the functions.py module.
+
+Reads the duration of a video straight from its container metadata instead
+of opening it with a decoder. Each container family has its own probe; a probe
+only reads the few header bytes it needs. Containers that cannot be parsed
+fall back to moviepy.
+"""
+
+import os
+import struct
+from collections import namedtuple
+
+
+MediaInfo = namedtuple("MediaInfo", ["duration", "width", "height", "codec", "creation_time"])
+MediaInfo.__new__.__defaults__ = (None,) * len(MediaInfo._fields)
+MediaInfo.__doc__ = """Metadata read from a media file. Unknown fields are None.
+
+duration : float
+    Duration in seconds.
+width, height : int
+    Resolution of the first video stream.
+codec : string
+    Codec identifier of the first video stream (e.g. 'avc1').
+creation_time : float
+    Creation time as a POSIX timestamp.
+"""
+
+# seconds between 1904-01-01 (QuickTime epoch) and 1970-01-01
+QUICKTIME_EPOCH = 2082844800
+# 100 ns intervals between 1601-01-01 (Windows FILETIME epoch) and 1970-01-01
+FILETIME_EPOCH = 116444736000000000
+
+# extension -> probe function, filled by the register_probe decorator
+PROBES = dict()
+
+
+def register_probe(*extensions):
+    """Register a function as the probe of some extensions.
+
+    The probe receives an open binary file and must return a MediaInfo, or
+    raise ProbeError if the file cannot be parsed.
+
+    Parameters
+    ----------
+    extensions : strings
+        Extensions handled by the probe (case insensitive).
+    """
+    def decorator(function):
+        for extension in extensions:
+            PROBES[extension.lower()] = function
+        return function
+    return decorator
+
+
+def probe(file):
+    """Return the MediaInfo of a media file.
+
+    Use the header probe registered for the extension of `file`, and fall back
+    to moviepy if there is none or if it fails.
+
+    Parameters
+    ----------
+    file : string
+        Path of the file to probe.
+    """
+    extension = os.path.splitext(file)[1].lower()
+    function = PROBES.get(extension)
+    if function is not None:
+        try:
+            with open(file, 'rb') as f:
+                info = function(f)
+            if info.duration is not None:
+                return info
+        except (ProbeError, struct.error, IndexError):
+            pass
+    return probe_with_moviepy(file)
+
+
+def get_duration(file):
+    """Return the duration of a video file in seconds.
+
+    Parameters
+    ----------
+    file : string
+        Path of the video.
+    """
+    return probe(file).duration
+
+
+def probe_with_moviepy(file):
+    """Return the MediaInfo of a file by opening it with moviepy.
+
+    This spawns an ffmpeg reader, so it is only used for the containers the
+    header probes cannot parse.
+
+    Parameters
+    ----------
+    file : string
+        Path of the file to probe.
+    """
+    # imported here because moviepy is slow to import and rarely needed
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    with VideoFileClip(file) as clip:
+        duration = clip.duration
+        width, height = clip.size
+    return MediaInfo(duration=duration, width=width, height=height)
+
+
+# MP4 / QuickTime ================================================================
+
+def iter_atoms(f, start, end):
+    """Yield (type, data_offset, data_size) for the atoms between `start` and
+    `end`."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:  # 64-bit size follows the type
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:  # atom extends to the end of the file
+            size = end - position
+        if size < header_size:
+            raise ProbeError("Invalid atom size.")
+        yield kind, position + header_size, size - header_size
+        position += size
+
+
+def find_atom(f, path, start, end):
+    """Return (data_offset, data_size) of the atom at `path`, e.g.
+    [b'moov', b'mvhd'], or None if it does not exist."""
+    for kind, offset, size in iter_atoms(f, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return offset, size
+            return find_atom(f, path[1:], offset, offset + size)
+    return None
+
+
+@register_probe('.mp4', '.m4a', '.m4v', '.m4b', '.m4r', '.f4v', '.f4a', '.f4b', '.mov', '.3gp')
+def probe_mp4(f):
+    """Read the 'moov' atom of a MP4/QuickTime file.
+
+    The duration and creation time come from 'mvhd', the resolution and codec
+    from the 'tkhd' and 'stsd' atoms of the first video track. The 'mvhd'
+    duration of a fragmented file only covers the samples of 'moov', often
+    none: its duration is read from 'mehd', and is unknown (None) if there is
+    no 'mehd'.
+    """
+    end = f.seek(0, os.SEEK_END)
+    moov = find_atom(f, [b'moov'], 0, end)
+    if moov is None:
+        raise ProbeError("No 'moov' atom.")
+    moov_start, moov_end = moov[0], moov[0] + moov[1]
+    creation_time, timescale, duration = read_mvhd(f, moov_start, moov_end)
+    if timescale == 0:
+        raise ProbeError("Null timescale.")
+    if find_atom(f, [b'mvex'], moov_start, moov_end) is not None:  # fragmented file
+        duration = read_mehd(f, moov_start, moov_end)
+    elif duration in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):  # not set
+        duration = None
+    width, height, codec = probe_mp4_video_track(f, moov_start, moov_end)
+    return MediaInfo(duration=duration / timescale if duration is not None else None, width=width, height=height,
+                     codec=codec, creation_time=creation_time)
+
+
+def read_mvhd(f, start, end):
+    """Return (creation_time, timescale, duration) of the 'mvhd' atom in
+    'moov'. creation_time is a POSIX timestamp, or None if it is not set."""
+    mvhd = find_atom(f, [b'mvhd'], start, end)
+    if mvhd is None:
+        raise ProbeError("No 'mvhd' atom.")
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        creation, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+    else:
+        creation, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+    creation_time = creation - QUICKTIME_EPOCH if creation else None
+    return creation_time, timescale, duration
+
+
+def read_mehd(f, start, end):
+    """Return the duration of a fragmented file from the 'mehd' atom in
+    'moov', in the timescale of 'mvhd', or None if it is not set."""
+    mehd = find_atom(f, [b'mvex', b'mehd'], start, end)
+    if mehd is None:
+        return None
+    f.seek(mehd[0])
+    version = f.read(4)[0]
+    if version == 1:
+        duration, = struct.unpack('>Q', f.read(8))
+    else:
+        duration, = struct.unpack('>I', f.read(4))
+    return duration or None
+
+
+def probe_mp4_video_track(f, start, end):
+    """Return (width, height, codec) of the first video track in 'moov'."""
+    for kind, offset, size in list(iter_atoms(f, start, end)):
+        if kind != b'trak':
+            continue
+        hdlr = find_atom(f, [b'mdia', b'hdlr'], offset, offset + size)
+        if hdlr is None:
+            continue
+        f.seek(hdlr[0] + 8)  # version, flags and pre-defined
+        if f.read(4) != b'vide':
+            continue
+        width = height = codec = None
+        tkhd = find_atom(f, [b'tkhd'], offset, offset + size)
+        if tkhd is not None and tkhd[1] >= 8:
+            # width and height are 16.16 fixed-point numbers ending the atom
+            f.seek(tkhd[0] + tkhd[1] - 8)
+            width, height = (value >> 16 for value in struct.unpack('>II', f.read(8)))
+        stsd = find_atom(f, [b'mdia', b'minf', b'stbl', b'stsd'], offset, offset + size)
+        if stsd is not None and stsd[1] >= 16:
+            f.seek(stsd[0] + 12)  # version, flags, entry count, entry size
+            codec = f.read(4).decode('latin-1').strip()
+        return width, height, codec
+    return None, None, None
+
+
+# AVI ===========================================================================
+
+@register_probe('.avi')
+def probe_avi(f):
+    """Read the 'avih' main header and first 'strh' stream header of an AVI
+    file.
+
+    The 'avih' frame count only covers the first RIFF segment of the file. An
+    OpenDML file (over 1 GB) has other 'AVIX' segments, and its frame count is
+    read from the 'dmlh' header: its duration is unknown (None) if there is
+    none.
+    """
+    end = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    riff, riff_size, form = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or form != b'AVI ':
+        raise ProbeError("Not an AVI file.")
+    # the first chunk is 'LIST' 'hdrl', whose first sub-chunk is 'avih'
+    list_id, list_size, list_type = struct.unpack('<4sI4s', f.read(12))
+    chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+    if list_id != b'LIST' or list_type != b'hdrl' or chunk_id != b'avih' or chunk_size < 40:
+        raise ProbeError("No 'avih' header.")
+    (micro_sec_per_frame, _, _, _, total_frames,
+     _, _, _, width, height) = struct.unpack('<10I', f.read(40))
+    # 'avih' is followed by a 'LIST' 'strl' per stream, starting with 'strh'
+    codec = None
+    f.seek(32 + chunk_size + chunk_size % 2)
+    header = f.read(20)
+    if len(header) == 20:
+        list_id, _, list_type, chunk_id, _ = struct.unpack('<4sI4s4sI', header)
+        if list_id == b'LIST' and list_type == b'strl' and chunk_id == b'strh':
+            stream_type, handler = struct.unpack('<4s4s', f.read(8))
+            if stream_type == b'vids':
+                codec = handler.decode('latin-1').strip('\x00 ') or None
+    odml_frames = read_dmlh(f, 24, min(20 + list_size, end))
+    if odml_frames is not None:
+        total_frames = odml_frames
+    elif has_riff_extension(f, 8 + riff_size + riff_size % 2):
+        total_frames = None
+    duration = micro_sec_per_frame * total_frames / 1e6 if total_frames is not None else None
+    return MediaInfo(duration=duration, width=width, height=height, codec=codec)
+
+
+def has_riff_extension(f, offset):
+    """Return whether another RIFF segment starts at `offset`."""
+    f.seek(offset)
+    return f.read(4) == b'RIFF'
+
+
+def read_dmlh(f, start, end):
+    """Return the total frame count of the 'dmlh' header of the 'LIST' 'odml'
+    chunk of 'hdrl', between `start` and `end`, or None if there is none."""
+    position = start
+    while position + 12 <= end:
+        f.seek(position)
+        chunk_id, chunk_size, list_type = struct.unpack('<4sI4s', f.read(12))
+        if chunk_id == b'LIST' and list_type == b'odml':
+            f.seek(position + 12)
+            sub_id, sub_size = struct.unpack('<4sI', f.read(8))
+            if sub_id == b'dmlh' and sub_size >= 4:
+                return struct.unpack('<I', f.read(4))[0]
+            return None
+        position += 8 + chunk_size + chunk_size % 2
+    return None
+
+
+# FLV ===========================================================================
+
+def read_amf_value(f):
+    """Read an AMF0 value from `f`."""
+    marker = f.read(1)[0]
+    if marker == 0x00:  # number
+        return struct.unpack('>d', f.read(8))[0]
+    if marker == 0x01:  # boolean
+        return f.read(1)[0] != 0
+    if marker == 0x02:  # string
+        return read_amf_string(f)
+    if marker in (0x03, 0x08):  # object, ECMA array
+        if marker == 0x08:
+            f.read(4)  # approximate number of entries
+        value = dict()
+        while True:
+            key = read_amf_string(f)
+            if key == "":
+                if f.read(1) == b'\x09':  # object end
+                    return value
+                f.seek(-1, os.SEEK_CUR)
+            value[key] = read_amf_value(f)
+    if marker in (0x05, 0x06):  # null, undefined
+        return None
+    if marker == 0x0A:  # strict array
+        count = struct.unpack('>I', f.read(4))[0]
+        return [read_amf_value(f) for _ in range(count)]
+    if marker == 0x0B:  # date
+        timestamp, _ = struct.unpack('>dh', f.read(10))
+        return timestamp / 1000
+    if marker == 0x0C:  # long string
+        length = struct.unpack('>I', f.read(4))[0]
+        return f.read(length).decode('utf-8', 'replace')
+    raise ProbeError(f"Unsupported AMF0 marker {marker}.")
+
+
+def read_amf_string(f):
+    length = struct.unpack('>H', f.read(2))[0]
+    return f.read(length).decode('utf-8', 'replace')
+
+
+@register_probe('.flv')
+def probe_flv(f):
+    """Read the duration from the 'onMetaData' script tag of a FLV file."""
+    signature, _, _, header_size = struct.unpack('>3sBBI', f.read(9))
+    if signature != b'FLV':
+        raise ProbeError("Not a FLV file.")
+    # skip PreviousTagSize0
+    f.seek(header_size + 4)
+    tag_type = f.read(1)[0]
+    if tag_type != 18:  # script data
+        raise ProbeError("No 'onMetaData' tag.")
+    f.read(10)  # data size, timestamp, stream id
+    if f.read(1) != b'\x02' or read_amf_string(f) != "onMetaData":
+        raise ProbeError("No 'onMetaData' tag.")
+    metadata = read_amf_value(f)
+    if not isinstance(metadata, dict) or "duration" not in metadata:
+        raise ProbeError("No duration in 'onMetaData'.")
+    width, height = metadata.get("width"), metadata.get("height")
+    codec = metadata.get("videocodecid")
+    return MediaInfo(
+        duration=metadata["duration"],
+        width=int(width) if width else None,
+        height=int(height) if height else None,
+        codec=str(int(codec)) if isinstance(codec, float) else codec,
+    )
+
+
+# ASF (WMV) =====================================================================
+
+ASF_HEADER_GUID = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+ASF_FILE_PROPERTIES_GUID = bytes.fromhex('a1dcab8c47a9cf118ee400c00c205365')
+
+
+@register_probe('.wmv', '.wma', '.asf')
+def probe_asf(f):
+    """Read the duration from the File Properties object of an ASF file."""
+    guid, _, count, _ = struct.unpack('<16sQIH', f.read(30))
+    if guid != ASF_HEADER_GUID:
+        raise ProbeError("Not an ASF file.")
+    for _ in range(count):
+        position = f.tell()
+        guid, size = struct.unpack('<16sQ', f.read(24))
+        if guid == ASF_FILE_PROPERTIES_GUID:
+            f.read(24)  # file id, file size
+            creation, _, play_duration, _, preroll = struct.unpack('<QQQQQ', f.read(40))
+            creation_time = (creation - FILETIME_EPOCH) / 1e7 if creation else None
+            return MediaInfo(duration=play_duration / 1e7 - preroll / 1e3, creation_time=creation_time)
+        if size < 24:
+            break
+        f.seek(position + size)
+    raise ProbeError("No File Properties object.")
+
+
+class ProbeError(Exception):
+    pass
@@ -0,0 +1,104 @@
+# encoding: utf-8
+"""Safety check used by the functions.py module.
+
+Before moving files, the tool checks that the folder does not contain its own
+scripts, which are marked by a '.videolog' file. Only the places where moving
+files could move the scripts are searched: the folder, its ancestors and its
+subfolders up to a limited depth.
+"""
+
+import os
+import time
+
+
+MARKER_FILE_NAME = ".videolog"
+
+
+def has_marker(folder):
+    """Return whether a folder directly contains the '.videolog' marker."""
+    return os.path.isfile(os.path.join(folder, MARKER_FILE_NAME))
+
+
+def modification_time(folder):
+    """Return the mtime of a folder in nanoseconds, None if it is gone."""
+    try:
+        return os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SafetyCheck(object):
+    """Search for the '.videolog' marker, with memoized results.
+
+    The result for a folder is kept for the session, with the modification
+    times of the folders searched (its ancestors and its subfolders). It is
+    computed again if one of them changes, as creating or removing a marker
+    changes the modification time of its folder, or after `invalidate`.
+
+    Parameters
+    ----------
+    depth : int
+        Number of levels of subfolders searched. 0 only searches the folder
+        and its ancestors.
+    """
+
+    def __init__(self, depth=2):
+        self.depth = depth
+        # (absolute path, depth) -> ([(folder searched, mtime_ns)], result)
+        self.results = dict()
+        # duration of the last check, in seconds
+        self.last_duration = 0.
+
+    def contains_marker(self, path='.'):
+        """Return whether the marker is found around a folder.
+
+        Parameters
+        ----------
+        path : string
+            Folder to check.
+        """
+        start = time.perf_counter()
+        path = os.path.abspath(path)
+        key = (path, self.depth)
+        cached = self.results.get(key)
+        if cached is not None and all(modification_time(folder) == mtime for folder, mtime in cached[0]):
+            found = cached[1]
+        else:
+            searched = []
+            found = self.search_ancestors(path, searched) or self.search_subfolders(path, self.depth, searched)
+            self.results[key] = (searched, found)
+        self.last_duration = time.perf_counter() - start
+        return found
+
+    def invalidate(self):
+        """Forget the memoized results."""
+        self.results.clear()
+
+    def search_ancestors(self, path, searched):
+        """Return whether the marker is in `path` or one of its ancestors. The
+        folders searched are added to `searched` with their mtime."""
+        while True:
+            searched.append((path, modification_time(path)))
+            if has_marker(path):
+                return True
+            parent = os.path.dirname(path)
+            if parent == path:  # root of the file system
+                return False
+            path = parent
+
+    def search_subfolders(self, path, depth, searched):
+        """Return whether the marker is in a subfolder of `path`, at most
+        `depth` levels below it. Symbolic links are not followed. The
+        subfolders searched are added to `searched` with their mtime."""
+        if depth <= 0:
+            return False
+        try:
+            with os.scandir(path) as iterator:
+                subfolders = [entry.path for entry in iterator if entry.is_dir(follow_symlinks=False)]
+        except PermissionError:
+            return False
+        for subfolder in subfolders:
+            searched.append((subfolder, modification_time(subfolder)))
+            if has_marker(subfolder):
+                return True
+        return any(self.search_subfolders(subfolder, depth - 1, searched) for subfolder in subfolders)
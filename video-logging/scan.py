@@ -0,0 +1,202 @@
+# encoding: utf-8
+"""Directory scanning used by the functions.py module.
+
+A folder is listed once per command with os.scandir, and the stat data of its
+entries is kept in a Snapshot, so that the operations do not need to call
+os.path.isdir, os.path.isfile or os.path.getmtime on every file.
+"""
+
+import os
+from collections import namedtuple
+from stat import S_ISDIR, S_ISREG
+from videologging.instrument import recorder
+
+
+# files created by this tool (metadata cache...) start with this prefix
+TOOL_FILE_PREFIX = ".videolog-"
+
+Entry = namedtuple("Entry", ["name", "extension", "kind", "size", "mtime", "mtime_ns", "inode"])
+Entry.__doc__ = """Entry of a directory listing.
+
+name : string
+    Name of the entry.
+extension : string
+    Extension of the entry, as returned by os.path.splitext.
+kind : string
+    'file', 'dir' or 'other'.
+size : int
+    Size in bytes.
+mtime : float
+    Modification time.
+mtime_ns : int
+    Modification time in nanoseconds.
+inode : int
+    Inode number.
+"""
+
+
+class Snapshot(object):
+    """Listing of a directory, taken once.
+
+    Parameters
+    ----------
+    path : string
+        Scanned directory.
+    entries : list
+        Entries of the directory, sorted by name.
+    """
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def files(self):
+        """Return the entries that are regular files."""
+        return [entry for entry in self.entries if entry.kind == 'file']
+
+    def names(self):
+        """Return the set of the names of the entries."""
+        return {entry.name for entry in self.entries}
+
+
+def is_tool_file(file):
+    """Return whether a file was created by this tool (metadata cache...) and
+    must therefore not be moved.
+
+    Parameters
+    ----------
+    file : string
+        Name of the file.
+    """
+    return file.startswith(TOOL_FILE_PREFIX)
+
+
+def snapshot(path='.'):
+    """Scan a directory and return its Snapshot.
+
+    The files created by this tool are left out.
+
+    Parameters
+    ----------
+    path : string
+        Directory to scan.
+    """
+    with recorder.phase("listing"):
+        entries = []
+        with os.scandir(path) as iterator:
+            for dir_entry in iterator:
+                if is_tool_file(dir_entry.name):
+                    continue
+                try:
+                    entries.append(make_entry(dir_entry))
+                except FileNotFoundError:  # removed since it was listed
+                    continue
+        entries.sort(key=lambda entry: entry.name)
+    recorder.count("files scanned", len(entries))
+    return Snapshot(path, entries)
+
+
+def walk(root='.', skip=None):
+    """Walk a tree, one directory at a time.
+
+    The directories are listed lazily, depth first, so that only the listing
+    of the current directory and the paths of the directories left to visit
+    are kept in memory. A directory can therefore be modified by the caller
+    before the walk goes on. Symbolic links to directories are not followed.
+
+    Parameters
+    ----------
+    root : string
+        Root of the tree.
+    skip : function
+        Called with the os.DirEntry of each subdirectory. The subdirectories
+        for which it returns True are not visited.
+
+    Yields
+    ------
+    (string, Snapshot)
+        Path of each directory relative to `root` ('' for `root` itself), and
+        its snapshot.
+    """
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        path = os.path.join(root, relative) if relative else root
+        entries = []
+        subdirectories = []
+        try:
+            with recorder.phase("listing"), os.scandir(path) as iterator:
+                for dir_entry in iterator:
+                    if is_tool_file(dir_entry.name):
+                        continue
+                    try:
+                        entries.append(make_entry(dir_entry))
+                    except FileNotFoundError:  # removed since it was listed
+                        continue
+                    if dir_entry.is_dir(follow_symlinks=False) and not (skip is not None and skip(dir_entry)):
+                        subdirectories.append(os.path.join(relative, dir_entry.name))
+        except PermissionError:
+            continue
+        entries.sort(key=lambda entry: entry.name)
+        recorder.count("files scanned", len(entries))
+        pending.extend(sorted(subdirectories, reverse=True))
+        yield relative, Snapshot(path, entries)
+
+
+def make_entry(dir_entry):
+    """Return the Entry of an os.DirEntry, using its cached stat data."""
+    try:
+        stat = dir_entry.stat()
+    except OSError:  # broken symbolic link
+        stat = dir_entry.stat(follow_symlinks=False)
+    if dir_entry.is_dir():
+        kind = 'dir'
+    elif dir_entry.is_file():
+        kind = 'file'
+    else:
+        kind = 'other'
+    return Entry(
+        name=dir_entry.name,
+        extension=os.path.splitext(dir_entry.name)[1],
+        kind=kind,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        mtime_ns=stat.st_mtime_ns,
+        inode=stat.st_ino,
+    )
+
+
+def stat_entry(path):
+    """Return the Entry of a path, or None if it does not exist.
+
+    Parameters
+    ----------
+    path : string
+        Path of the entry.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if S_ISDIR(stat.st_mode):
+        kind = 'dir'
+    elif S_ISREG(stat.st_mode):
+        kind = 'file'
+    else:
+        kind = 'other'
+    name = os.path.basename(path)
+    return Entry(
+        name=name,
+        extension=os.path.splitext(name)[1],
+        kind=kind,
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        mtime_ns=stat.st_mtime_ns,
+        inode=stat.st_ino,
+    )
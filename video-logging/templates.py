@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""Template-driven bulk renaming used by the functions.py module.
+
+The new name of each file is computed from a template such as
+'{date:%y%m%d}_{camera}_{seq:04d}{ext}', using the str.format syntax. The
+available fields are:
+    name    name of the file, without its extension;
+    ext     extension of the file, with its dot;
+    type    type of the file, as in the 'EXTENSIONS' of data.yaml;
+    date    capture time of the file (or modification time), a datetime;
+    seq     position of the file, from 1, in the order of the dates;
+    camera  camera model of the EXIF data of the images, or 'unknown';
+    folder  name of the folder of the file.
+
+All the renames are checked before any file is touched: two files cannot get
+the same name, nor take the name of a file that is not renamed. Files whose
+new name is the old name of another one (chains such as a -> b -> c, or
+cycles such as a -> b -> a) are renamed in two phases, through temporary
+names, so that none of them is overwritten.
+"""
+
+import os
+import string
+from videologging.scan import TOOL_FILE_PREFIX
+
+
+FIELDS = ["name", "ext", "type", "date", "seq", "camera", "folder"]
+# prefix of the temporary names of the files renamed in two phases
+TEMPORARY_PREFIX = TOOL_FILE_PREFIX + "rename-"
+
+
+def template_fields(template):
+    """Return the set of the fields used by a template.
+
+    Raises TemplateError if the template is not valid or uses unknown fields.
+    """
+    try:
+        fields = {field.split('.')[0].split('[')[0]
+                  for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+    except ValueError as e:
+        raise TemplateError(f"The template '{template}' is not valid: {e}.")
+    unknown = fields - set(FIELDS)
+    if "" in fields:
+        raise TemplateError("The fields of a template must be named, e.g. '{seq:04d}'.")
+    if unknown:
+        raise TemplateError(f"Unknown field(s) {', '.join(sorted(unknown))} in the template. "
+                            f"The possible fields are {', '.join(FIELDS)}.")
+    return fields
+
+
+def render(template, values):
+    """Return the name given by a template to a file.
+
+    Parameters
+    ----------
+    template : string
+        Template of the names.
+    values : dict
+        Value of each field of the template for the file.
+    """
+    try:
+        name = template.format(**values)
+    except (ValueError, TypeError) as e:
+        raise TemplateError(f"The template '{template}' cannot be applied to '{values['name']}{values['ext']}': {e}.")
+    if name in ["", ".", ".."] or "/" in name or os.sep in name or "\0" in name:
+        raise TemplateError(f"The template '{template}' gives an invalid name ('{name}') to "
+                            f"'{values['name']}{values['ext']}'.")
+    return name
+
+
+def plan_renames(renames, existing):
+    """Check renames and order them so that no file is overwritten.
+
+    Parameters
+    ----------
+    renames : list
+        (old name, new name) of the files, in the same folder. The files whose
+        name does not change are ignored.
+    existing : set
+        Names of all the entries of the folder.
+
+    Returns
+    -------
+    list
+        (source, destination) moves to do in order. The files renamed in two
+        phases are first moved to a temporary name.
+
+    Raises
+    ------
+    TemplateError
+        If two files get the same name, or a file gets the name of an entry
+        that is not renamed.
+    """
+    renames = [(old, new) for old, new in renames if old != new]
+    sources = {old for old, _ in renames}
+    owners = dict()
+    for old, new in renames:
+        if new in owners:
+            raise TemplateError(f"'{owners[new]}' and '{old}' would both be renamed '{new}'.")
+        owners[new] = old
+        if new in existing and new not in sources:
+            raise TemplateError(f"'{old}' would be renamed '{new}', which already exists.")
+
+    direct = [(old, new) for old, new in renames if new not in sources]
+    chained = [(old, new) for old, new in renames if new in sources]
+    first_phase = [(old, f"{TEMPORARY_PREFIX}{i}") for i, (old, _) in enumerate(chained)]
+    second_phase = [(f"{TEMPORARY_PREFIX}{i}", new) for i, (_, new) in enumerate(chained)]
+    return first_phase + direct + second_phase
+
+
+def count_cycles(renames):
+    """Return the number of cycles (a -> b -> a) among renames."""
+    successor = {old: new for old, new in renames if old != new}
+    seen = set()
+    cycles = 0
+    for start in successor:
+        path = set()
+        name = start
+        while name in successor and name not in seen:
+            seen.add(name)
+            path.add(name)
+            name = successor[name]
+        if name in path:
+            cycles += 1
+    return cycles
+
+
+class TemplateError(Exception):
+    pass
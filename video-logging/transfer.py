@@ -0,0 +1,173 @@
+# encoding: utf-8
+"""Cross-device transfers used by the moves.py module.
+
+os.rename cannot move a file to another file system. Such files are copied
+with os.copy_file_range when available (large buffered reads otherwise),
+optionally verified with a checksum, and only then deleted from the source.
+"""
+
+import errno
+import os
+from progress.bar import IncrementalBar
+from videologging.scan import TOOL_FILE_PREFIX
+
+
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+class TransferSettings(object):
+    """Settings of the cross-device transfers.
+
+    Parameters
+    ----------
+    workers : int
+        Number of files copied concurrently.
+    verify : bool
+        Whether or not to compare the checksums of the source and the copy
+        before deleting the source.
+    """
+
+    def __init__(self, workers=4, verify=False):
+        self.workers = workers
+        self.verify = verify
+
+
+class ByteBar(IncrementalBar):
+    """Progress bar counting bytes and showing the transfer rate."""
+    suffix = '%(percent)d%% - %(rate)s'
+
+    @property
+    def rate(self):
+        if self.elapsed == 0:
+            return "-"
+        return f"{self.index / self.elapsed / 1e6:.1f} MB/s"
+
+
+def device(path):
+    """Return the device of `path`, or of its nearest existing ancestor."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+def copy_file(source, destination, on_bytes=None):
+    """Copy the content and metadata of a file.
+
+    Parameters
+    ----------
+    source : string
+        File to copy.
+    destination : string
+        Path of the copy.
+    on_bytes : function
+        Called with the number of bytes copied after each chunk.
+    """
+    # imported here because it is slow to import and only needed across file systems
+    import shutil
+    with open(source, 'rb') as fsrc, open(destination, 'wb') as fdst:
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while True:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), BUFFER_SIZE)
+                    if n == 0:
+                        break
+                    copied += n
+                    if on_bytes is not None:
+                        on_bytes(n)
+            except OSError:
+                # not supported between these file systems
+                if copied != 0:
+                    raise
+        if copied == 0:
+            buffer = bytearray(BUFFER_SIZE)
+            view = memoryview(buffer)
+            while True:
+                n = fsrc.readinto(buffer)
+                if n == 0:
+                    break
+                fdst.write(view[:n])
+                if on_bytes is not None:
+                    on_bytes(n)
+    shutil.copystat(source, destination)
+
+
+def file_digest(path):
+    """Return the BLAKE2 digest of a file, read in large chunks."""
+    # imported here because it is slow to import and only needed to verify the transfers and find duplicates
+    import hashlib
+    digest = hashlib.blake2b()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buffer)
+            if n == 0:
+                break
+            digest.update(view[:n])
+    return digest.digest()
+
+
+def transfer(source, destination, verify=False, on_bytes=None):
+    """Move a file to another file system.
+
+    The file is copied under a temporary name next to `destination`, renamed
+    once complete (and verified if asked), then the source is deleted.
+
+    Parameters
+    ----------
+    source : string
+        File to move.
+    destination : string
+        New path of the file.
+    verify : bool
+        Whether or not to compare the checksums of the source and the copy.
+    on_bytes : function
+        Called with the number of bytes copied after each chunk.
+    """
+    if os.path.isdir(source):
+        # imported here because it is slow to import and only needed across file systems
+        import shutil
+        shutil.move(source, destination)
+        return
+    directory, name = os.path.split(destination)
+    partial = os.path.join(directory, f"{TOOL_FILE_PREFIX}{name}.part")
+    try:
+        copy_file(source, partial, on_bytes)
+        if verify and file_digest(source) != file_digest(partial):
+            raise TransferError(f"The copy of '{source}' to '{destination}' is corrupted, the source has been kept.")
+        os.replace(partial, destination)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    os.remove(source)
+
+
+def move(source, destination, verify=False):
+    """Move a file, copying it if `destination` is on another file system.
+
+    Parameters
+    ----------
+    source : string
+        File to move.
+    destination : string
+        New path of the file.
+    verify : bool
+        Whether or not to verify the copy of a cross-device move.
+    """
+    try:
+        os.rename(source, destination)
+    except OSError as e:
+        if not is_cross_device(e):
+            raise
+        transfer(source, destination, verify)
+
+
+def is_cross_device(error):
+    """Return whether an OSError was raised by a rename across file systems."""
+    return error.errno == errno.EXDEV
+
+
+class TransferError(OSError):
+    pass
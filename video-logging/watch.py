@@ -0,0 +1,278 @@
+# encoding: utf-8
+"""Watching of an ingest folder, used by the functions.py module.
+
+The new files of the folder are reported by inotify on Linux, or found by
+listing the folder at regular intervals elsewhere (or when inotify is not
+available). A file is only handed over once it has stopped growing, i.e. its
+size and mtime did not change for a few seconds, so that files still being
+copied are not moved. With inotify, a file created in the folder must also
+have been closed by its writer.
+
+A watcher thread puts the complete files into a bounded queue, which blocks
+it when the files land faster than they are sorted: inotify then keeps the
+events in the kernel, and if its queue overflows the folder is listed once
+again. The files are taken from the queue by batches, so that a burst of
+thousands of files is probed and moved in a few plans.
+"""
+
+import os
+import queue
+import select
+import struct
+import threading
+import time
+import videologging.scan as scan
+
+
+# inotify flags, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# wd, mask, cookie, len of an inotify event, followed by its name
+EVENT_HEADER = struct.Struct('iIII')
+# returned by the watchers when some events were lost
+RESCAN = None
+
+
+class WatchSettings(object):
+    """Settings of the 'watch' command.
+
+    Parameters
+    ----------
+    settle : float
+        Number of seconds a file must keep the same size and mtime before it
+        is sorted.
+    batch_size : int
+        Maximum number of files sorted at once.
+    batch_delay : float
+        Number of seconds to wait for more files before sorting a batch that
+        is not full.
+    queue_size : int
+        Maximum number of complete files waiting to be sorted.
+    poll_interval : float
+        Number of seconds between two listings of the folder when inotify is
+        not available.
+    """
+
+    def __init__(self, settle=2., batch_size=500, batch_delay=1., queue_size=10000, poll_interval=1.):
+        self.settle = settle
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+
+
+class InotifyWatcher(object):
+    """Watcher of the names of the files created in, or moved into, a folder,
+    using inotify through ctypes.
+
+    Parameters
+    ----------
+    folder : string
+        Watched folder. Its subfolders are not watched.
+
+    Raises
+    ------
+    OSError
+        If inotify is not available.
+    """
+
+    def __init__(self, folder):
+        # imported here because it is slow to import and only needed by 'watch'
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this system.")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not start inotify.")
+        mask = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Could not watch {folder}.")
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds for events and return the names they
+        concern, as a dict name -> whether the file is still open by the
+        process that created it, or RESCAN if some events were lost."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return dict()
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return dict()
+        names = dict()
+        position = 0
+        while position < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+            position += EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                return RESCAN
+            if not mask & IN_ISDIR:
+                names[os.fsdecode(data[position:position + length].rstrip(b'\0'))] = bool(mask & IN_CREATE)
+            position += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Watcher of the names of the new or modified files of a folder, listing
+    it at regular intervals.
+
+    Parameters
+    ----------
+    folder : string
+        Watched folder. Its subfolders are not watched.
+    interval : float
+        Number of seconds between two listings.
+    """
+
+    def __init__(self, folder, interval=1.):
+        self.folder = folder
+        self.interval = interval
+        # name -> (size, mtime_ns) at the last listing
+        self.known = dict()
+
+    def read(self, timeout):
+        """Wait up to `timeout` seconds, list the folder and return the names
+        of the files that appeared or changed since the last listing, as a
+        dict name -> False, as whether they are still open is unknown."""
+        time.sleep(min(timeout, self.interval))
+        listing = {entry.name: (entry.size, entry.mtime_ns) for entry in scan.snapshot(self.folder).files()}
+        names = {name: False for name, state in listing.items() if self.known.get(name) != state}
+        self.known = listing
+        return names
+
+    def close(self):
+        pass
+
+
+def make_watcher(folder, poll_interval=1.):
+    """Return an InotifyWatcher of a folder, or a PollingWatcher if inotify is
+    not available."""
+    try:
+        return InotifyWatcher(folder)
+    except (OSError, AttributeError):
+        return PollingWatcher(folder, poll_interval)
+
+
+class FolderWatcher(object):
+    """Thread putting the Entry of each complete new file of a folder into a
+    bounded queue.
+
+    The files already in the folder when the thread starts are handled as new
+    files. Hidden files (such as the temporary files of rsync) are ignored.
+
+    Parameters
+    ----------
+    folder : string
+        Watched folder.
+    settings : WatchSettings
+        Settings of the watch.
+    """
+
+    def __init__(self, folder, settings):
+        self.folder = folder
+        self.settings = settings
+        self.watcher = make_watcher(folder, settings.poll_interval)
+        self.queue = queue.Queue(maxsize=settings.queue_size)
+        # name -> [size, mtime_ns, time of the last change, whether it is open] of the files not complete yet
+        self.pending = dict()
+        self.stopped = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self):
+        try:
+            self.add(self.list_folder())
+            while not self.stopped.is_set():
+                names = self.watcher.read(min(self.settings.settle, 0.5) if self.pending else 0.5)
+                self.add(self.list_folder() if names is RESCAN else names)
+                for entry in self.complete_files():
+                    # blocks while the queue is full
+                    while not self.stopped.is_set():
+                        try:
+                            self.queue.put(entry, timeout=0.5)
+                            break
+                        except queue.Full:
+                            pass
+        except Exception as e:  # reported by the consumer
+            self.error = e
+
+    def list_folder(self):
+        return {entry.name: False for entry in scan.snapshot(self.folder).files()}
+
+    def add(self, names):
+        """Start waiting for files to stop growing.
+
+        Parameters
+        ----------
+        names : dict
+            Name of each file -> whether it is still open by its writer.
+        """
+        now = time.monotonic()
+        for name, is_open in names.items():
+            if name.startswith('.'):
+                continue
+            if name not in self.pending:
+                # the size is set when the file is first checked
+                self.pending[name] = [None, None, now, is_open]
+            elif not is_open:
+                self.pending[name][3] = False
+
+    def complete_files(self):
+        """Return the Entry of the pending files that stopped growing and are
+        closed, and forget the files that disappeared."""
+        now = time.monotonic()
+        complete = []
+        for name, (size, mtime_ns, since, is_open) in list(self.pending.items()):
+            entry = scan.stat_entry(os.path.join(self.folder, name))
+            if entry is None or entry.kind != 'file':
+                del self.pending[name]
+            elif (entry.size, entry.mtime_ns) != (size, mtime_ns):
+                self.pending[name] = [entry.size, entry.mtime_ns, now, is_open]
+            elif not is_open and now - since >= self.settings.settle:
+                del self.pending[name]
+                complete.append(entry)
+        return complete
+
+    def batches(self, stop=None):
+        """Yield lists of up to `batch_size` complete files, waiting
+        `batch_delay` seconds for more files once the first one is here,
+        until the Event `stop` is set."""
+        while stop is None or not stop.is_set():
+            if self.error is not None:
+                raise self.error
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.settings.batch_delay
+            while len(batch) < self.settings.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            yield batch
+
+    def close(self):
+        """Stop the thread."""
+        self.stopped.set()
+        self.thread.join()
+        self.watcher.close()